@@ -5,11 +5,12 @@ AI-powered city optimization and strategy management
 """
 
 import numpy as np
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Sequence, Tuple, Optional, Union
 from dataclasses import dataclass
 from enum import Enum
 import random
 import json
+import itertools
 
 
 class CityStrategy(Enum):
@@ -20,6 +21,48 @@ class CityStrategy(Enum):
     RESEARCH = "research"
 
 
+# Building costs, in the order the model scores buildings
+BUILDING_COSTS = {
+    'house': {'gold': 100, 'wood': 50, 'stone': 25},
+    'farm': {'gold': 50, 'wood': 100, 'stone': 0},
+    'mine': {'gold': 200, 'wood': 50, 'stone': 100},
+    'lumber_mill': {'gold': 100, 'wood': 50, 'stone': 25},
+    'power_plant': {'gold': 300, 'wood': 100, 'stone': 150},
+    'factory': {'gold': 500, 'wood': 250, 'stone': 200},
+}
+BUILDING_TYPES = list(BUILDING_COSTS)
+BUILDING_NAMES = np.array(BUILDING_TYPES, dtype=object)
+RESOURCE_TYPES = ['gold', 'wood', 'stone', 'food', 'energy']
+COST_RESOURCES = RESOURCE_TYPES[:3]
+COST_MATRIX = np.array([
+    [BUILDING_COSTS[b].get(r, 0) for r in COST_RESOURCES] for b in BUILDING_TYPES
+], dtype=np.float64)
+
+STRATEGY_INDEX = {
+    CityStrategy.BALANCED: 0,
+    CityStrategy.ECONOMY: 1,
+    CityStrategy.POPULATION: 2,
+    CityStrategy.MILITARY: 3,
+    CityStrategy.RESEARCH: 4,
+}
+STRATEGY_BONUSES = {
+    CityStrategy.ECONOMY: {'mine': 0.3, 'factory': 0.2, 'lumber_mill': 0.2},
+    CityStrategy.POPULATION: {'house': 0.3, 'farm': 0.2, 'hospital': 0.2},
+    CityStrategy.RESEARCH: {'research_lab': 0.4, 'factory': 0.1},
+    CityStrategy.MILITARY: {'defense_tower': 0.3, 'barracks': 0.2},
+    CityStrategy.BALANCED: {},
+}
+
+# Divisors that normalize the CityState.to_vector features, in order
+FEATURE_SCALE = np.array(
+    [10000, 10000, 10000, 10000, 10000, 10000, 100, 100, 50, 30, 100000],
+    dtype=np.float64
+)
+FEATURE_COUNT = len(FEATURE_SCALE) + len(STRATEGY_INDEX)
+# CityStateBatch building columns: the four feature buildings come first
+BATCH_BUILDINGS = ['house', 'farm', 'mine', 'factory', 'lumber_mill', 'power_plant', 'research_lab']
+
+
 @dataclass
 class CityState:
     resources: Dict[str, float]
@@ -46,6 +89,159 @@ class CityState:
         return np.array(features)
 
 
+class CityStateBatch:
+    """
+    Columnar storage for many CityStates
+    
+    Resources, population, building counts, score and cycle live in
+    preallocated float32 columns, so feature matrices are filled with a
+    few in-place divides instead of one to_vector() call per city. The
+    first five resource columns are RESOURCE_TYPES and the first four
+    building columns are the feature buildings; keys beyond those get
+    columns of their own. Values round-trip at float32 precision.
+    """
+    
+    def __init__(
+        self,
+        capacity: int = 1024,
+        resource_types: Optional[List[str]] = None,
+        building_types: Optional[List[str]] = None
+    ):
+        self.resource_types = list(resource_types or RESOURCE_TYPES)
+        self.building_types = list(building_types or BATCH_BUILDINGS)
+        if self.resource_types[:len(RESOURCE_TYPES)] != RESOURCE_TYPES:
+            raise ValueError(f"resource_types must start with {RESOURCE_TYPES}")
+        if self.building_types[:4] != BATCH_BUILDINGS[:4]:
+            raise ValueError(f"building_types must start with {BATCH_BUILDINGS[:4]}")
+        self._resource_index = {r: i for i, r in enumerate(self.resource_types)}
+        self._building_index = {b: i for i, b in enumerate(self.building_types)}
+        self.size = 0
+        self._allocate(max(1, capacity))
+    
+    def _allocate(self, capacity: int):
+        """(Re)allocate every column at the given capacity, keeping rows"""
+        old = self._columns() if self.size else ()
+        self.capacity = capacity
+        self.resources = np.zeros((capacity, len(self.resource_types)), dtype=np.float32)
+        self.population = np.zeros(capacity, dtype=np.float32)
+        self.buildings = np.zeros((capacity, len(self.building_types)), dtype=np.float32)
+        self.score = np.zeros(capacity, dtype=np.float32)
+        self.cycle = np.zeros(capacity, dtype=np.float32)
+        self._features = np.zeros((capacity, FEATURE_COUNT), dtype=np.float32)
+        if old:
+            for new, rows in zip(self._columns(), old):
+                new[:self.size] = rows[:self.size]
+    
+    def _columns(self) -> Tuple[np.ndarray, ...]:
+        return self.resources, self.population, self.buildings, self.score, self.cycle
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    @classmethod
+    def from_states(cls, states: Sequence[CityState], capacity: int = 0) -> 'CityStateBatch':
+        """Build a batch from CityStates, adding columns for any extra keys"""
+        resource_types = list(RESOURCE_TYPES)
+        building_types = list(BATCH_BUILDINGS)
+        for state in states:
+            for key in state.resources:
+                if key not in resource_types:
+                    resource_types.append(key)
+            for key in state.buildings:
+                if key not in building_types:
+                    building_types.append(key)
+        batch = cls(max(capacity, len(states)), resource_types, building_types)
+        n = len(states)
+        batch.resources[:n] = np.fromiter(
+            itertools.chain.from_iterable(
+                [s.resources.get(r, 0) for r in resource_types] for s in states
+            ),
+            np.float32, n * len(resource_types)
+        ).reshape(n, len(resource_types))
+        batch.buildings[:n] = np.fromiter(
+            itertools.chain.from_iterable(
+                [s.buildings.get(b, 0) for b in building_types] for s in states
+            ),
+            np.float32, n * len(building_types)
+        ).reshape(n, len(building_types))
+        batch.population[:n] = np.fromiter((s.population for s in states), np.float32, n)
+        batch.score[:n] = np.fromiter((s.score for s in states), np.float32, n)
+        batch.cycle[:n] = np.fromiter((s.cycle for s in states), np.float32, n)
+        batch.size = n
+        return batch
+    
+    def append(self, state: CityState) -> int:
+        """Add one city, growing the columns if full; returns its row"""
+        for key in state.resources:
+            if key not in self._resource_index:
+                raise KeyError(f"No column for resource '{key}'")
+        for key in state.buildings:
+            if key not in self._building_index:
+                raise KeyError(f"No column for building '{key}'")
+        if self.size == self.capacity:
+            self._allocate(self.capacity * 2)
+        row = self.size
+        self.resources[row] = [state.resources.get(r, 0) for r in self.resource_types]
+        self.buildings[row] = [state.buildings.get(b, 0) for b in self.building_types]
+        self.population[row] = state.population
+        self.score[row] = state.score
+        self.cycle[row] = state.cycle
+        self.size += 1
+        return row
+    
+    def state(self, row: int) -> CityState:
+        """Rebuild the CityState stored at a row"""
+        if not 0 <= row < self.size:
+            raise IndexError(f"Row {row} out of range for batch of {self.size}")
+        return CityState(
+            resources=dict(zip(self.resource_types, self.resources[row].tolist())),
+            population=float(self.population[row]),
+            buildings={
+                b: int(v) for b, v in zip(self.building_types, self.buildings[row].tolist())
+            },
+            score=float(self.score[row]),
+            cycle=int(self.cycle[row]),
+        )
+    
+    def to_states(self) -> List[CityState]:
+        """Rebuild CityStates for every row, with a dict key per column"""
+        n = self.size
+        buildings = self.buildings[:n].astype(np.int64).tolist()
+        return [
+            CityState(
+                resources=dict(zip(self.resource_types, resources)),
+                population=population,
+                buildings=dict(zip(self.building_types, counts)),
+                score=score,
+                cycle=cycle,
+            )
+            for resources, population, counts, score, cycle in zip(
+                self.resources[:n].tolist(),
+                self.population[:n].tolist(),
+                buildings,
+                self.score[:n].tolist(),
+                self.cycle[:n].astype(np.int64).tolist(),
+            )
+        ]
+    
+    def features(self, strategy: CityStrategy = CityStrategy.BALANCED) -> np.ndarray:
+        """
+        Normalized feature matrix, one _extract_features row per city
+        
+        Filled in place in a buffer owned by the batch and returned as a
+        view: it is overwritten by the next call, so copy it to keep it.
+        """
+        n = self.size
+        out = self._features[:n]
+        np.divide(self.resources[:n, :5], FEATURE_SCALE[0:5], out=out[:, 0:5])
+        np.divide(self.population[:n], FEATURE_SCALE[5], out=out[:, 5])
+        np.divide(self.buildings[:n, :4], FEATURE_SCALE[6:10], out=out[:, 6:10])
+        np.divide(self.score[:n], FEATURE_SCALE[10], out=out[:, 10])
+        out[:, len(FEATURE_SCALE):] = 0
+        out[:, len(FEATURE_SCALE) + STRATEGY_INDEX[strategy]] = 1
+        return out
+
+
 class AICityManager:
     """
     AI Manager for Solana AI City
@@ -61,12 +257,12 @@ class AICityManager:
         self.ai_level = ai_level
         self.strategy = CityStrategy.BALANCED
         self.learning_rate = 0.1
-        self.weights = self        self.history._initialize_weights()
-: List[Dict] = []
+        self.weights = self._initialize_weights()
+        self.history: List[Dict] = []
         
     def _initialize_weights(self) -> np.ndarray:
-        """Initialize ML model weights"""
-        return np.random.randn(15) * 0.1
+        """Initialize ML model weights (one row of feature weights per building)"""
+        return np.random.randn(len(BUILDING_TYPES), FEATURE_COUNT) * 0.1
     
     def get_optimal_build(
         self, 
@@ -83,19 +279,9 @@ class AICityManager:
         features = self._extract_features(city_state, available_resources)
         scores = self._predict_scores(features)
         
-        # Filter by available resources
-        building_costs = {
-            'house': {'gold': 100, 'wood': 50, 'stone': 25},
-            'farm': {'gold': 50, 'wood': 100, 'stone': 0},
-            'mine': {'gold': 200, 'wood': 50, 'stone': 100},
-            'lumber_mill': {'gold': 100, 'wood': 50, 'stone': 25},
-            'power_plant': {'gold': 300, 'wood': 100, 'stone': 150},
-            'factory': {'gold': 500, 'wood': 250, 'stone': 200},
-        }
-        
         # Score each building based on strategy
         building_scores = {}
-        for building, cost in building_costs.items():
+        for building, cost in BUILDING_COSTS.items():
             # Check affordability
             if all(available_resources.get(r, 0) >= v for r, v in cost.items()):
                 base_score = scores.get(building, 0.5)
@@ -110,6 +296,63 @@ class AICityManager:
         
         return best_building, confidence
     
+    def get_optimal_builds(
+        self,
+        states: Union[Sequence[CityState], CityStateBatch],
+        resources: Union[Sequence[Dict[str, float]], np.ndarray]
+    ) -> List[Tuple[str, float]]:
+        """
+        Batched get_optimal_build: one (building, confidence) per city
+        
+        Scores every building for every city with a single matrix multiply;
+        affordability and strategy bonuses are applied as array masks, so the
+        result matches calling get_optimal_build on each city in turn.
+        states may be a CityStateBatch, and resources an (n, 3) array of
+        gold, wood and stone, e.g. batch.resources[:len(batch), :3].
+        """
+        if len(states) != len(resources):
+            raise ValueError("states and resources must have the same length")
+        if not len(states):
+            return []
+        
+        if isinstance(states, CityStateBatch):
+            logits = states.features(self.strategy) @ self.weights.T
+        else:
+            features = stack_features(states)
+            weights = self.weights[:, :len(FEATURE_SCALE)]
+            # The strategy one-hot is the same for every row: add its column
+            strategy_column = self.weights[:, len(FEATURE_SCALE) + STRATEGY_INDEX[self.strategy]]
+            logits = features @ weights.T + strategy_column
+        scores = 1.0 / (1.0 + np.exp(-logits))  # Sigmoid
+        
+        bonuses = STRATEGY_BONUSES.get(self.strategy, {})
+        scores *= 1 + np.array([bonuses.get(b, 0.0) for b in BUILDING_TYPES])
+        
+        if isinstance(resources, np.ndarray):
+            available = resources
+        else:
+            available = np.fromiter(
+                itertools.chain.from_iterable(
+                    (r.get('gold', 0), r.get('wood', 0), r.get('stone', 0)) for r in resources
+                ),
+                np.float64, len(resources) * len(COST_RESOURCES)
+            ).reshape(len(resources), len(COST_RESOURCES))
+        affordable = available[:, 0:1] >= COST_MATRIX[:, 0]
+        for i in range(1, len(COST_RESOURCES)):
+            affordable &= available[:, i:i + 1] >= COST_MATRIX[:, i]
+        scores = np.where(affordable, scores, -np.inf)
+        
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(states)), best]
+        # As in get_optimal_build: confidence is best over max (the argmax
+        # is the max), and 'house' with 0.0 when nothing is affordable
+        any_affordable = affordable.any(axis=1)
+        with np.errstate(invalid='ignore'):
+            confidence = np.where(any_affordable, best_scores / best_scores, 0.0)
+        best = np.where(any_affordable, best, BUILDING_TYPES.index('house'))
+        
+        return list(zip(BUILDING_NAMES[best].tolist(), confidence.tolist()))
+    
     def predict_resource_needs(
         self, 
         city_state: CityState,
@@ -155,11 +398,11 @@ class AICityManager:
         """
         # Calculate efficiency based on buildings
         production_efficiency = {
-            'gold': 1.0 + (city_state.buildings.get('mine', 0) * 0.1,
-            'wood': 1.0 + (city_state.buildings.get('lumber_mill', 0) * 0.1,
-            'stone': 1.0 + (city_state.buildings.get('mine', 0) * 0.05,
-            'food': 1.0 + (city_state.buildings.get('farm', 0) * 0.1,
-            'energy': 1.0 + (city_state.buildings.get('power_plant', 0) * 0.15,
+            'gold': 1.0 + city_state.buildings.get('mine', 0) * 0.1,
+            'wood': 1.0 + city_state.buildings.get('lumber_mill', 0) * 0.1,
+            'stone': 1.0 + city_state.buildings.get('mine', 0) * 0.05,
+            'food': 1.0 + city_state.buildings.get('farm', 0) * 0.1,
+            'energy': 1.0 + city_state.buildings.get('power_plant', 0) * 0.15,
         }
         
         # Apply AI bonus
@@ -270,7 +513,7 @@ class AICityManager:
         error = outcome - prediction
         
         # Update weights
-        self.weights += self.learning_rate * error * features
+        self.weights[self._building_index(action)] += self.learning_rate * error * features
         
         # Record history
         self.history.append({
@@ -294,47 +537,34 @@ class AICityManager:
         features = city_state.to_vector()
         
         # Add strategy feature
-        strategy_map = {
-            CityStrategy.BALANCED: 0,
-            CityStrategy.ECONOMY: 1,
-            CityStrategy.POPULATION: 2,
-            CityStrategy.MILITARY: 3,
-            CityStrategy.RESEARCH: 4,
-        }
-        strategy_feature = np.zeros(5)
-        strategy_feature[strategy_map[self.strategy]] = 1
+        strategy_feature = np.zeros(len(STRATEGY_INDEX))
+        strategy_feature[STRATEGY_INDEX[self.strategy]] = 1
         features = np.concatenate([features, strategy_feature])
         
         return features
     
     def _predict_scores(self, features: np.ndarray) -> Dict[str, float]:
         """Predict scores for each building type"""
-        buildings = ['house', 'farm', 'mine', 'lumber_mill', 'power_plant', 'factory']
         scores = {}
         
-        for i, building in enumerate(buildings):
+        for i, building in enumerate(BUILDING_TYPES):
             # Simple linear model (would be neural network in production)
-            base_score = np.dot(features, self.weights[i * 3:(i + 1) * 3])
+            base_score = np.dot(features, self.weights[i])
             scores[building] = 1.0 / (1.0 + np.exp(-base_score))  # Sigmoid
         
         return scores
     
     def _predict_single(self, features: np.ndarray, action: str) -> float:
         """Predict score for single action"""
-        building_index = ['house', 'farm', 'mine'].index(action) if action in ['house', 'farm', 'mine'] else 0
-        return np.dot(features, self.weights[building_index * 3:(building_index + 1) * 3])
+        return np.dot(features, self.weights[self._building_index(action)])
+    
+    def _building_index(self, action: str) -> int:
+        """Weight row for a building (unknown actions train the first row)"""
+        return BUILDING_TYPES.index(action) if action in BUILDING_TYPES else 0
     
     def _get_strategy_bonus(self, building: str) -> float:
         """Get bonus multiplier based on strategy"""
-        strategy_bonuses = {
-            CityStrategy.ECONOMY: {'mine': 0.3, 'factory': 0.2, 'lumber_mill': 0.2},
-            CityStrategy.POPULATION: {'house': 0.3, 'farm': 0.2, 'hospital': 0.2},
-            CityStrategy.RESEARCH: {'research_lab': 0.4, 'factory': 0.1},
-            CityStrategy.MILITARY: {'defense_tower': 0.3, 'barracks': 0.2},
-            CityStrategy.BALANCED: {},
-        }
-        
-        return strategy_bonuses.get(self.strategy, {}).get(building, 0.0)
+        return STRATEGY_BONUSES.get(self.strategy, {}).get(building, 0.0)
     
     def _get_strategy_multiplier(self) -> float:
         """Get resource need multiplier based on strategy"""
@@ -406,6 +636,30 @@ class AICityManager:
         self.learning_rate = data['learning_rate']
 
 
+def stack_features(states: Sequence[CityState]) -> np.ndarray:
+    """Stack CityState.to_vector rows for many cities into one matrix"""
+    rows = (
+        (
+            s.resources.get('gold', 0),
+            s.resources.get('wood', 0),
+            s.resources.get('stone', 0),
+            s.resources.get('food', 0),
+            s.resources.get('energy', 0),
+            s.population,
+            s.buildings.get('house', 0),
+            s.buildings.get('farm', 0),
+            s.buildings.get('mine', 0),
+            s.buildings.get('factory', 0),
+            s.score,
+        )
+        for s in states
+    )
+    raw = np.fromiter(
+        itertools.chain.from_iterable(rows), np.float64, len(states) * len(FEATURE_SCALE)
+    )
+    return raw.reshape(len(states), len(FEATURE_SCALE)) / FEATURE_SCALE
+
+
 # Convenience function
 def create_ai_manager(ai_level: int = 1) -> AICityManager:
     """Create and initialize AI manager"""
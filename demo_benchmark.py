@@ -0,0 +1,1903 @@
+#!/usr/bin/env python3
+"""
+Solana AI City - Demo Server Benchmarks
+
+Each subcommand measures one aspect of demo_server.py:
+
+    python demo_benchmark.py throughput --clients 64 --seconds 10
+    python demo_benchmark.py throughput --modes threaded,prefork --state-every 0 --build-every 2
+    python demo_benchmark.py world-tick --cities 5000
+    python demo_benchmark.py memory --cities 1000000
+    python demo_benchmark.py tick-latency
+    python demo_benchmark.py recovery --cities 100000
+    python demo_benchmark.py cold-start
+    python demo_benchmark.py state-delta --cities 20000
+    python demo_benchmark.py state-export --cities 10000 50000
+    python demo_benchmark.py scheduler --cities 1000000
+    python demo_benchmark.py catch-up
+    python demo_benchmark.py build-batch --builds 50
+    python demo_benchmark.py keep-alive --clients 8
+    python demo_benchmark.py metrics-overhead
+    python demo_benchmark.py shards --shards 1 16
+    python demo_benchmark.py overload --herd 64
+    python demo_benchmark.py static --clients 8
+    python demo_benchmark.py buildings --buildings 10 1000 100000
+    python demo_benchmark.py events --clients 50
+    python demo_benchmark.py replay --log data/ --profiler sample
+    python demo_benchmark.py worlds --herd 16
+"""
+
+import argparse
+import gc
+import gzip
+import hashlib
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ═══════════════════════════════════════════════════════════════
+#    Helpers
+# ═══════════════════════════════════════════════════════════════
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, *extra_args, cwd=None):
+    """Launch demo_server.py in a subprocess (serving static files from cwd) and wait until it accepts"""
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "demo_server.py"), str(port), *extra_args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        cwd=cwd,
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"demo server did not start on port {port}")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def request(port, method, path, payload=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        body = json.dumps(payload) if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, data
+    finally:
+        conn.close()
+
+
+def seed_cities(port, count, buildings_per_city=0):
+    city_ids = []
+    for i in range(count):
+        _, data = request(port, "POST", "/api/game/create_city", {"name": f"Bench {i}", "address": f"bench_{i}"})
+        city_id = json.loads(data)["city_id"]
+        for _ in range(buildings_per_city):
+            request(port, "POST", "/api/game/build", {"city_id": city_id, "building_type": "farm"})
+        city_ids.append(city_id)
+    return city_ids
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+# ═══════════════════════════════════════════════════════════════
+#    throughput: single vs threaded serving modes
+# ═══════════════════════════════════════════════════════════════
+
+def _client_process(port, city_ids, threads, seconds, state_every, build_every, results):
+    """One load-generator process running `threads` closed-loop clients"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.time() + seconds
+
+    def client(worker):
+        local = []
+        n = 0
+        while time.time() < stop_at:
+            n += 1
+            started = time.perf_counter()
+            try:
+                city_id = city_ids[(worker + n) % len(city_ids)]
+                if state_every and n % state_every == 0:
+                    request(port, "GET", "/api/game/state")
+                elif build_every and n % build_every == 0:
+                    request(port, "POST", "/api/game/build", {"city_id": city_id, "building_type": "farm"})
+                else:
+                    request(port, "POST", "/api/game/tick", {"city_id": city_id})
+            except OSError:
+                with lock:
+                    errors[0] += 1
+                continue
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=client, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put((latencies, errors[0]))
+
+
+def _slow_client(port, stop_event):
+    """Holds a connection open by trickling request headers, like a bad mobile link"""
+    while not stop_event.is_set():
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=30) as sock:
+                sock.sendall(b"GET /api/resources HTTP/1.0\r\n")
+                while not stop_event.wait(0.5):
+                    sock.sendall(b"X-Slow: 1\r\n")
+                sock.sendall(b"\r\n")
+        except OSError:
+            time.sleep(0.1)
+
+
+def run_load(port, city_ids, clients, seconds, state_every, slow_clients, build_every=0):
+    procs_count = max(1, min(clients, os.cpu_count() or 1))
+    per_proc = [clients // procs_count + (1 if i < clients % procs_count else 0) for i in range(procs_count)]
+    results = multiprocessing.Queue()
+    stop_slow = threading.Event()
+    slow = [threading.Thread(target=_slow_client, args=(port, stop_slow), daemon=True) for _ in range(slow_clients)]
+    for t in slow:
+        t.start()
+    time.sleep(0.2)
+
+    started = time.perf_counter()
+    procs = [
+        multiprocessing.Process(target=_client_process,
+                                args=(port, city_ids, n, seconds, state_every, build_every, results))
+        for n in per_proc if n
+    ]
+    for p in procs:
+        p.start()
+    latencies, errors = [], 0
+    for _ in procs:
+        lat, err = results.get()
+        latencies.extend(lat)
+        errors += err
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+    stop_slow.set()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def cmd_throughput(args):
+    modes = args.modes.split(",")
+    report = {}
+    for mode in modes:
+        port = free_port()
+        extra = ["--mode", mode]
+        if args.workers:
+            extra += ["--workers", str(args.workers)]
+        if mode == "prefork" and args.processes:
+            extra += ["--processes", str(args.processes)]
+        proc = start_server(port, *extra)
+        try:
+            city_ids = seed_cities(port, args.cities, args.buildings)
+            report[mode] = run_load(port, city_ids, args.clients, args.seconds, args.state_every, args.slow_clients,
+                                    args.build_every)
+        finally:
+            stop_server(proc)
+        r = report[mode]
+        print(f"{mode:>9}: {r['rps']:9.1f} req/s  p50 {r['p50_ms']:7.2f} ms  "
+              f"p99 {r['p99_ms']:8.2f} ms  ({r['requests']} ok, {r['errors']} errors)")
+
+    if "single" in report and len(report) > 1:
+        base = report["single"]["rps"]
+        for mode, r in report.items():
+            if mode == "single":
+                continue
+            if base:
+                print(f"{mode} / single = {r['rps'] / base:.1f}x")
+            else:
+                print(f"{mode} / single = inf (single mode starved by slow clients)")
+    return report
+
+
+# ═══════════════════════════════════════════════════════════════
+#    world-tick: per-city tick loop vs one vectorized pass
+# ═══════════════════════════════════════════════════════════════
+
+def populate_world(cities, buildings_per_city, seed=0):
+    """Fill demo_server's in-process state with `cities` cities"""
+    import demo_server
+
+    rng = random.Random(seed)
+    with demo_server.state_lock:
+        for i in range(cities):
+            city_id = demo_server.create_city({"address": f"bench_{i}", "ai_level": rng.randint(1, 5)})
+            resources = demo_server.game_state["resources"][city_id]
+            for resource in resources:
+                resources[resource] = 10 ** 9
+            for _ in range(buildings_per_city):
+                demo_server.build(city_id, rng.choice(demo_server.BUILDING_TYPES))
+    return demo_server
+
+
+def cmd_world_tick(args):
+    demo_server = populate_world(args.cities, args.buildings)
+    city_ids = list(demo_server.game_state["cities"])
+
+    with demo_server.state_lock:
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            for city_id in city_ids:
+                demo_server.tick_city(city_id)
+        per_city = (time.perf_counter() - started) / args.rounds
+
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            demo_server.tick_world()
+        vectorized = (time.perf_counter() - started) / args.rounds
+
+    print(f"{args.cities} cities x {args.buildings} buildings")
+    print(f"  tick_city loop: {per_city * 1000:9.2f} ms / cycle")
+    print(f"  tick_world:     {vectorized * 1000:9.2f} ms / cycle  ({per_city / vectorized:.1f}x)")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    memory: CityStore vs the old nested city dicts
+# ═══════════════════════════════════════════════════════════════
+
+def _legacy_city(i, buildings, rng):
+    """One city laid out the way create_city/build stored it before CityStore"""
+    import demo_server
+
+    city = {
+        "id": f"bench_{i}",
+        "owner": f"bench_{i}",
+        "name": f"Bench {i}",
+        "level": 1,
+        "population": 100,
+        "resources": dict(demo_server.STARTING_RESOURCES),
+        "buildings": [],
+        "score": 100,
+        "ai_level": 1,
+        "strategy": "balanced",
+        "created_at": int(time.time()),
+    }
+    for _ in range(buildings):
+        building_type = rng.choice(demo_server.BUILDING_TYPES)
+        city["buildings"].append({
+            "id": f"building_{rng.randint(10000, 99999)}",
+            "type": building_type,
+            "level": 1,
+            "emoji": demo_server.BUILDINGS[building_type]["emoji"],
+        })
+    return city
+
+
+def _measure(build):
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    tracemalloc.start()
+    started = time.perf_counter()
+    kept = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    objects = len(gc.get_objects()) - objects_before
+    return kept, size, objects, elapsed
+
+
+def cmd_memory(args):
+    import demo_server
+
+    def build_store():
+        rng = random.Random(0)
+        store = demo_server.CityStore()
+        now = int(time.time())
+        for i in range(args.cities):
+            row = store.create(f"bench_{i}", f"bench_{i}", f"Bench {i}", 1, "balanced", now)
+            for _ in range(args.buildings):
+                store.add_buildings(row, rng.randrange(len(demo_server.BUILDING_TYPES)), 1)
+        return store
+
+    def build_dicts():
+        rng = random.Random(0)
+        return {f"bench_{i}": _legacy_city(i, args.buildings, rng) for i in range(args.dict_cities)}
+
+    _, store_bytes, store_objects, store_secs = _measure(build_store)
+    _, dict_bytes, dict_objects, dict_secs = _measure(build_dicts)
+    scale = args.cities / args.dict_cities
+
+    print(f"{args.cities} cities x {args.buildings} buildings")
+    print(f"  CityStore:    {store_bytes / 2**20:9.1f} MiB  {store_bytes / args.cities:7.1f} B/city  "
+          f"{store_objects:>10} GC objects  ({store_secs:.1f}s to build)")
+    print(f"  nested dicts: {dict_bytes * scale / 2**20:9.1f} MiB  {dict_bytes / args.dict_cities:7.1f} B/city  "
+          f"{int(dict_objects * scale):>10} GC objects  (extrapolated from {args.dict_cities})")
+    print(f"  ratio: {dict_bytes * scale / store_bytes:.1f}x smaller")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    tick-latency: one city's tick as its building count grows
+# ═══════════════════════════════════════════════════════════════
+
+def _legacy_tick(city):
+    """The tick rules as written before production was cached: one pass over buildings"""
+    import demo_server
+
+    ai_bonus = 1 + (city["ai_level"] * 0.1)
+    production = {"gold": 0, "wood": 0, "stone": 0, "food": 0, "energy": 0}
+    for building in city["buildings"]:
+        building_type = building["type"]
+        if building_type in demo_server.BUILDINGS:
+            for resource, amount in demo_server.BUILDINGS[building_type]["production"].items():
+                production[resource] += int(amount * ai_bonus)
+    for resource, amount in production.items():
+        city["resources"][resource] += amount
+    if city["resources"]["food"] > city["population"] * 2:
+        growth = int(city["population"] * 0.05 * ai_bonus)
+    else:
+        growth = int(city["population"] * 0.02)
+    city["population"] += growth
+    city["score"] += int(city["population"] / 100)
+    return production
+
+
+def _time_per_call(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations
+
+
+def cmd_tick_latency(args):
+    import demo_server
+
+    rng = random.Random(0)
+    print(f"{'buildings':>10} {'tick_row':>12} {'legacy loop':>14}")
+    for count in args.buildings:
+        store = demo_server.CityStore()
+        row = store.create("bench", "bench", "Bench", 3, "balanced", 0)
+        for _ in range(count):
+            store.add_buildings(row, rng.randrange(len(demo_server.BUILDING_TYPES)), 1)
+        legacy = store.city_dict(row)
+        legacy["buildings"] = store.buildings_of(row)
+
+        cached = _time_per_call(lambda: store.tick_row(row), args.iterations)
+        looped = _time_per_call(lambda: _legacy_tick(legacy), max(1, args.iterations * 10 // count))
+        print(f"{count:>10} {cached * 1e6:>9.2f} us {looped * 1e6:>11.2f} us")
+
+
+def cmd_catch_up(args):
+    import demo_server
+
+    print(f"{'ticks':>10} {'catch_up_row':>14} {'tick_row loop':>15}")
+    for ticks in args.ticks:
+        stores = []
+        for _ in range(2):
+            store = demo_server.CityStore()
+            row = store.create("bench", "bench", "Bench", 3, "balanced", 0)
+            store.add_buildings(row, demo_server.BUILDING_INDEX["farm"], args.buildings)
+            stores.append((store, row))
+
+        (jump, jump_row), (loop, loop_row) = stores
+        started = time.perf_counter()
+        jump.catch_up_row(jump_row, ticks)
+        jumped = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(ticks):
+            loop.tick_row(loop_row)
+        looped = time.perf_counter() - started
+        assert jump.city_dict(jump_row) == loop.city_dict(loop_row)
+        print(f"{ticks:>10} {jumped * 1000:>11.2f} ms {looped * 1000:>12.2f} ms")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    recovery: restart from snapshot + log tail vs full history
+# ═══════════════════════════════════════════════════════════════
+
+_RECOVER_SCRIPT = """
+import sys, time
+sys.path.insert(0, {here!r})
+started = time.perf_counter()
+import demo_server
+snapshot_seq, replayed, _ = demo_server.enable_persistence({directory!r}, snapshot_interval=0)
+print(len(demo_server.cities), snapshot_seq, replayed, time.perf_counter() - started)
+"""
+
+
+def _recover_in_subprocess(directory):
+    out = subprocess.run(
+        [sys.executable, "-c", _RECOVER_SCRIPT.format(here=HERE, directory=directory)],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return int(out[0]), int(out[1]), int(out[2]), float(out[3])
+
+
+def cmd_recovery(args):
+    import demo_server
+
+    root = tempfile.mkdtemp(prefix="demo-recovery-")
+    try:
+        directory = os.path.join(root, "data")
+        demo_server.enable_persistence(directory, snapshot_interval=0)
+        rng = random.Random(0)
+        started = time.perf_counter()
+        with demo_server.state_lock:
+            for i in range(args.cities):
+                city_id = demo_server.create_city({"address": f"bench_{i}", "ai_level": rng.randint(1, 5)})
+                for _ in range(args.buildings):
+                    demo_server.build(city_id, rng.choice(["farm", "house", "lumber_mill"]))
+            for _ in range(args.history_ticks):
+                demo_server.tick_world()
+        demo_server.wait_durable()
+        print(f"wrote {demo_server.persistence.log.last_seq} actions in "
+              f"{time.perf_counter() - started:.1f}s ({demo_server.persistence.log.batches} fsync batches)")
+
+        log_only = os.path.join(root, "log-only")
+        demo_server.persistence.log.rotate()
+        shutil.copytree(directory, log_only)
+
+        demo_server.persistence.snapshot()
+        with demo_server.state_lock:
+            for i in range(args.tail):
+                demo_server.tick_city(f"bench_{rng.randrange(args.cities)}")
+        demo_server.wait_durable()
+        demo_server.persistence.log.close()
+
+        for label, path in (("snapshot + tail", directory), ("full log replay", log_only)):
+            count, snapshot_seq, replayed, elapsed = _recover_in_subprocess(path)
+            print(f"  {label:<16} {count} cities, snapshot @{snapshot_seq}, "
+                  f"{replayed} actions replayed: {elapsed:.2f}s")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ═══════════════════════════════════════════════════════════════
+#    cold-start: mapping a binary snapshot as the world grows
+# ═══════════════════════════════════════════════════════════════
+
+_COLD_START_SCRIPT = """
+import sys, time
+sys.path.insert(0, {here!r})
+import demo_server
+started = time.perf_counter()
+demo_server.enable_persistence({directory!r}, snapshot_interval=0)
+ready = time.perf_counter() - started
+started = time.perf_counter()
+with demo_server.state_lock:
+    demo_server.tick_city({probe!r})
+first = time.perf_counter() - started
+print(len(demo_server.cities), ready, first)
+"""
+
+
+def synthetic_store(cities, buildings_per_city):
+    """A CityStore of `cities` farming cities, filled column-wise instead of city by city"""
+    import numpy as np
+    import demo_server
+
+    store = demo_server.CityStore(capacity=max(1024, cities))
+    store.ids = [f"bench_{i}" for i in range(cities)]
+    store.owners = list(store.ids)
+    store.names = [f"Bench {i}" for i in range(cities)]
+    store.strategies = ["balanced"] * cities
+    store.index = {city_id: row for row, city_id in enumerate(store.ids)}
+    store.id_hash[:cities] = [demo_server.city_hash(city_id) for city_id in store.ids]
+
+    rows = slice(0, cities)
+    farm = demo_server.BUILDING_INDEX["farm"]
+    store.resources[rows] = [demo_server.STARTING_RESOURCES[r] for r in demo_server.RESOURCE_NAMES]
+    store.population[rows] = 100 + 10 * buildings_per_city
+    store.score[rows] = 100 + 10 * buildings_per_city
+    store.level[rows] = 1
+    store.ai_level[rows] = np.arange(cities) % 5 + 1
+    store.ai_bonus[rows] = 1 + store.ai_level[rows] * 0.1
+    store.building_counts[rows, farm] = buildings_per_city
+    store.building_seq[rows] = buildings_per_city
+    for level in range(1, 6):
+        members = np.flatnonzero(store.ai_level[rows] == level)
+        store.production[members] = store.building_counts[members] @ demo_server._unit_production(1 + level * 0.1)
+
+    # One run of farms per city
+    if buildings_per_city:
+        store.building_total = cities
+        store.building_code = np.full(cities, (buildings_per_city << 3) | farm, dtype=np.uint32)
+        store.building_next = np.full(cities, -1, dtype=np.int64)
+        store.first_building[rows] = np.arange(cities)
+        store.last_building[rows] = np.arange(cities)
+    else:
+        store.first_building[rows] = -1
+        store.last_building[rows] = -1
+    return store
+
+
+def cmd_cold_start(args):
+    import demo_server
+
+    root = tempfile.mkdtemp(prefix="demo-cold-start-")
+    try:
+        print(f"{'cities':>10} {'snapshot':>10} {'ready':>10} {'first tick':>12}")
+        for count in args.cities:
+            directory = os.path.join(root, str(count))
+            os.makedirs(directory)
+            store = synthetic_store(count, args.buildings)
+            path = os.path.join(directory, "snapshot-000000000000.city")
+            demo_server.write_snapshot(path, store.to_arrays(), seq=0)
+            del store
+
+            out = subprocess.run(
+                [sys.executable, "-c", _COLD_START_SCRIPT.format(
+                    here=HERE, directory=directory, probe=f"bench_{count // 2}")],
+                check=True, capture_output=True, text=True,
+            ).stdout.split()
+            size = os.path.getsize(path) / 2**20
+            print(f"{int(out[0]):>10} {size:>7.1f} MiB {float(out[1]) * 1000:>7.1f} ms "
+                  f"{float(out[2]) * 1000:>9.2f} ms")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ═══════════════════════════════════════════════════════════════
+#    state-delta: full state dump vs ?since= poll
+# ═══════════════════════════════════════════════════════════════
+
+def cmd_state_delta(args):
+    demo_server = populate_world(args.cities, args.buildings)
+    city_ids = list(demo_server.game_state["cities"])
+    rng = random.Random(1)
+
+    print(f"{args.cities} cities x {args.buildings} buildings")
+    print(f"{'changed':>10} {'full':>22} {'since':>22}")
+    for changed in args.changed:
+        with demo_server.state_lock:
+            cursor = demo_server.cities.world_version
+            for city_id in rng.sample(city_ids, changed):
+                demo_server.tick_city(city_id)
+
+            full = _time_per_call(lambda: json.dumps(demo_server.cities.state_document()).encode(), args.rounds)
+            delta = _time_per_call(lambda: json.dumps(demo_server.state_since(cursor)).encode(), args.rounds)
+            full_size = len(json.dumps(demo_server.cities.state_document()).encode())
+            delta_size = len(json.dumps(demo_server.state_since(cursor)).encode())
+        print(f"{changed:>10} {full_size / 1024:>9.1f} KiB {full * 1000:>7.2f} ms "
+              f"{delta_size / 1024:>9.1f} KiB {delta * 1000:>7.2f} ms")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    state-export: one json.dumps vs streamed chunks
+# ═══════════════════════════════════════════════════════════════
+
+class _NullSink:
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _peak_bytes(fn):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        return tracemalloc.get_traced_memory()[1], elapsed
+    finally:
+        tracemalloc.stop()
+
+
+def cmd_state_export(args):
+    import demo_server
+
+    print(f"{'cities':>10} {'json.dumps peak':>22} {'streamed peak':>22}")
+    populated = 0
+    for count in args.cities:
+        populate_world(count - populated, args.buildings, seed=count)
+        populated = count
+        sink = _NullSink()
+
+        def dump():
+            with demo_server.state_lock:
+                sink.write(json.dumps(demo_server.cities.state_document()).encode())
+
+        whole, whole_time = _peak_bytes(dump)
+        streamed, streamed_time = _peak_bytes(lambda: demo_server.export_state(sink))
+        print(f"{count:>10} {whole / 2**20:>9.1f} MiB {whole_time * 1000:>7.0f} ms "
+              f"{streamed / 2**20:>9.1f} MiB {streamed_time * 1000:>7.0f} ms")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    scheduler: request latency under server-driven ticks
+# ═══════════════════════════════════════════════════════════════
+
+def cmd_scheduler(args):
+    import demo_server
+
+    root = tempfile.mkdtemp(prefix="demo-scheduler-")
+    try:
+        store = synthetic_store(args.cities, args.buildings)
+        base = os.path.join(root, "base")
+        os.makedirs(base)
+        demo_server.write_snapshot(os.path.join(base, "snapshot-000000000000.city"), store.to_arrays(), seq=0)
+        del store
+
+        if args.probe == "tick":
+            probe = ("POST", "/api/game/tick", {"city_id": "bench_0"})
+        else:
+            probe = ("GET", "/api/game/state?cursor=0&limit=1", None)
+        poller = ", one client polling GET /api/leaderboard" if args.poll_leaderboard else ""
+        print(f"{args.cities} cities, {args.rate:g} ticks/s, probing {probe[0]} {probe[1]}{poller}")
+        print(f"{'slices':>8} {'p50':>9} {'p99':>9} {'max':>9} {'tick':>10} {'max lag':>10} {'cycles':>7} {'overruns':>9}")
+        for slices in args.slices:
+            directory = os.path.join(root, str(slices))
+            shutil.copytree(base, directory)
+            port = free_port()
+            proc = start_server(port, "--data-dir", directory, "--snapshot-interval", "0",
+                                "--tick-rate", str(args.rate), "--tick-slices", str(slices))
+            stop = threading.Event()
+            polling = threading.Thread(target=_poll_leaderboard, args=(port, stop), daemon=True)
+            try:
+                if args.poll_leaderboard:
+                    polling.start()
+                latencies = []
+                deadline = time.perf_counter() + args.seconds
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    request(port, *probe)
+                    latencies.append(time.perf_counter() - started)
+                stats = json.loads(request(port, "GET", "/api/game/scheduler")[1])
+            finally:
+                stop.set()
+                if polling.is_alive():
+                    polling.join()
+                stop_server(proc)
+            latencies.sort()
+            print(f"{slices:>8} {percentile(latencies, 50) * 1000:>6.2f} ms {percentile(latencies, 99) * 1000:>6.2f} ms "
+                  f"{latencies[-1] * 1000:>6.2f} ms {stats['mean_duration_ms']:>7.1f} ms "
+                  f"{stats['max_lag_ms']:>7.1f} ms {stats['cycles']:>7} {stats['overruns']:>9}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _poll_leaderboard(port, stop):
+    while not stop.is_set():
+        request(port, "GET", "/api/leaderboard")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    build-batch: N build requests vs one build_batch request
+# ═══════════════════════════════════════════════════════════════
+
+def cmd_build_batch(args):
+    import demo_server
+
+    root = tempfile.mkdtemp(prefix="demo-build-batch-")
+    try:
+        store = synthetic_store(args.cities, 0)
+        store.resources[:args.cities] = 10 ** 12
+        demo_server.write_snapshot(os.path.join(root, "snapshot-000000000000.city"), store.to_arrays(), seq=0)
+        del store
+
+        port = free_port()
+        proc = start_server(port, "--data-dir", root, "--snapshot-interval", "0", *args.server_args)
+        rng = random.Random(0)
+        try:
+            singles = batches = 0.0
+            for _ in range(args.rounds):
+                operations = [
+                    {"city_id": f"bench_{rng.randrange(args.cities)}", "building_type": rng.choice(demo_server.BUILDING_TYPES)}
+                    for _ in range(args.builds)
+                ]
+                started = time.perf_counter()
+                for operation in operations:
+                    request(port, "POST", "/api/game/build", operation)
+                singles += time.perf_counter() - started
+
+                started = time.perf_counter()
+                status, _ = request(port, "POST", "/api/game/build_batch", {"operations": operations})
+                batches += time.perf_counter() - started
+                assert status == 200
+        finally:
+            stop_server(proc)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"{args.builds} builds over {args.cities} cities, {args.rounds} rounds")
+    print(f"  /api/game/build x {args.builds}: {singles / args.rounds * 1000:8.2f} ms")
+    print(f"  /api/game/build_batch:    {batches / args.rounds * 1000:8.2f} ms  ({singles / batches:.1f}x)")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    keep-alive: connection per request vs persistent connections
+# ═══════════════════════════════════════════════════════════════
+
+def _tick_client(port, city_id, requests_each, persistent, latencies):
+    body = json.dumps({"city_id": city_id})
+    headers = {"Content-Type": "application/json"}
+    conn = None
+    for _ in range(requests_each):
+        started = time.perf_counter()
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        conn.request("POST", "/api/game/tick", body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        if not persistent or response.will_close:
+            conn.close()
+            conn = None
+        latencies.append(time.perf_counter() - started)
+    if conn is not None:
+        conn.close()
+
+
+def cmd_keep_alive(args):
+    port = free_port()
+    proc = start_server(port, *args.server_args)
+    try:
+        city_ids = seed_cities(port, args.clients)
+        print(f"{args.clients} clients x {args.requests} POST /api/game/tick")
+        print(f"{'connections':>12} {'req/s':>9} {'p50':>9} {'p99':>9}")
+        for persistent in (False, True):
+            latencies = []
+            threads = [
+                threading.Thread(target=_tick_client, args=(port, city_id, args.requests, persistent, latencies))
+                for city_id in city_ids
+            ]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+            latencies.sort()
+            print(f"{'keep-alive' if persistent else 'per request':>12} {len(latencies) / elapsed:>9.0f} "
+                  f"{percentile(latencies, 50) * 1000:>6.2f} ms {percentile(latencies, 99) * 1000:>6.2f} ms")
+
+        seed_cities(port, args.state_cities)
+        for encoding in ("identity", "gzip"):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            conn.request("GET", "/api/game/state?cursor=0&limit=1000", headers={"Accept-Encoding": encoding})
+            size = len(conn.getresponse().read())
+            conn.close()
+            print(f"GET /api/game/state?cursor=0&limit=1000, {encoding}: {size / 1024:.1f} KiB")
+    finally:
+        stop_server(proc)
+
+
+# ═══════════════════════════════════════════════════════════════
+#    metrics-overhead: instrumented vs --no-metrics
+# ═══════════════════════════════════════════════════════════════
+
+def _process_cpu(pid):
+    """CPU seconds (user + system) a process has used so far, from /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _tick_load(port, city_ids, requests_each):
+    latencies = []
+    threads = [
+        threading.Thread(target=_tick_client, args=(port, city_id, requests_each, True, latencies))
+        for city_id in city_ids
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(latencies)
+
+
+def cmd_metrics_overhead(args):
+    import demo_server
+
+    # What GameHandler adds per request: two clock reads, the route lookup,
+    # Metrics.observe and the counting wrapper around two writes and a flush
+    registry = demo_server.Metrics()
+    headers = http.client.HTTPMessage()
+    headers["Content-Length"] = "30"
+    writer = demo_server._CountingWriter(_NullSink())
+
+    def instrumentation():
+        started = time.perf_counter()
+        writer.written = 0
+        writer.write(b"x" * 200)
+        writer.write(b"x" * 400)
+        writer.flush()
+        length = headers.get("Content-Length", "0")
+        path = "/api/game/tick".partition("?")[0]
+        route = path if path in demo_server.METRIC_ROUTES else "other"
+        registry.observe("POST", route, 200, time.perf_counter() - started,
+                         int(length) if length.isdigit() else 0, writer.written)
+
+    def baseline():
+        writer._raw.write(b"x" * 200)
+        writer._raw.write(b"x" * 400)
+        writer._raw.flush()
+
+    added = _time_per_call(instrumentation, 200_000) - _time_per_call(baseline, 200_000)
+
+    # Server CPU per request rather than client-observed req/s: the load
+    # generator shares the machine, which makes throughput too noisy to
+    # resolve a few percent.
+    cpu = {False: [], True: []}
+    for _ in range(args.rounds):
+        for instrumented in (False, True):
+            port = free_port()
+            proc = start_server(port, *([] if instrumented else ["--no-metrics"]))
+            try:
+                city_ids = seed_cities(port, args.clients)
+                before = _process_cpu(proc.pid)
+                handled = _tick_load(port, city_ids, args.requests)
+                cpu[instrumented].append((_process_cpu(proc.pid) - before) / handled)
+            finally:
+                stop_server(proc)
+
+    plain, instrumented = min(cpu[False]), min(cpu[True])
+    print(f"{args.clients} keep-alive clients x {args.requests} POST /api/game/tick, best of {args.rounds}")
+    print(f"  --no-metrics: {plain * 1e6:7.1f} us server CPU / request")
+    print(f"  metrics:      {instrumented * 1e6:7.1f} us server CPU / request  "
+          f"({(instrumented - plain) / plain * 100:+.1f}%, +/- run-to-run noise)")
+    print(f"  instrumentation alone: {added * 1e6:.2f} us / request = {added / plain * 100:.1f}% of a request")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    shards: single-city requests while other clients dump the world
+# ═══════════════════════════════════════════════════════════════
+
+def _state_reader(port, stop_event, dumps):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    while not stop_event.is_set():
+        conn.request("GET", "/api/game/state")
+        conn.getresponse().read()
+        dumps.append(1)
+    conn.close()
+
+
+def cmd_shards(args):
+    import demo_server
+
+    root = tempfile.mkdtemp(prefix="demo-shards-")
+    try:
+        store = synthetic_store(args.cities, args.buildings)
+        base = os.path.join(root, "base")
+        os.makedirs(base)
+        demo_server.write_snapshot(os.path.join(base, "snapshot-000000000000.city"), store.to_arrays(), seq=0)
+        del store
+
+        print(f"{args.cities} cities; {args.clients} keep-alive clients x {args.requests} POST /api/game/tick "
+              f"while {args.readers} clients stream GET /api/game/state")
+        print(f"{'shards':>8} {'req/s':>9} {'p50':>9} {'p99':>9} {'max':>9} {'dumps':>6}")
+        for shards in args.shards:
+            directory = os.path.join(root, str(shards))
+            shutil.copytree(base, directory)
+            port = free_port()
+            proc = start_server(port, "--data-dir", directory, "--snapshot-interval", "0",
+                                "--shards", str(shards), *args.server_args)
+            stop_event = threading.Event()
+            dumps = []
+            readers = [threading.Thread(target=_state_reader, args=(port, stop_event, dumps))
+                       for _ in range(args.readers)]
+            try:
+                for t in readers:
+                    t.start()
+                latencies = []
+                clients = [
+                    threading.Thread(target=_tick_client,
+                                     args=(port, f"bench_{i * 7919 % args.cities}", args.requests, True, latencies))
+                    for i in range(args.clients)
+                ]
+                started = time.perf_counter()
+                for t in clients:
+                    t.start()
+                for t in clients:
+                    t.join()
+                elapsed = time.perf_counter() - started
+            finally:
+                stop_event.set()
+                for t in readers:
+                    t.join()
+                stop_server(proc)
+            latencies.sort()
+            print(f"{shards:>8} {len(latencies) / elapsed:>9.0f} {percentile(latencies, 50) * 1000:>6.2f} ms "
+                  f"{percentile(latencies, 99) * 1000:>6.2f} ms {latencies[-1] * 1000:>6.2f} ms {len(dumps):>6}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ═══════════════════════════════════════════════════════════════
+#    buildings: pool slots and city document size as a city grows
+# ═══════════════════════════════════════════════════════════════
+
+def cmd_buildings(args):
+    import demo_server
+
+    print("pool: 12 bytes (code + link) per slot; one slot per building before runs")
+    print(f"{'buildings':>10} {'built':>8} {'pool slots':>11} {'document':>10} {'with list':>10} "
+          f"{'render':>10} {'with list':>10}")
+    for count in args.buildings:
+        for batched in (False, True):
+            rng = random.Random(0)
+            store = demo_server.CityStore()
+            row = store.create("bench", "bench", "Bench", 3, "balanced", 0)
+            if batched:
+                # A few types, each built count / 4 at a time like build_batch does
+                for i in range(4):
+                    store.add_buildings(row, i % len(demo_server.BUILDING_TYPES), count // 4)
+            else:
+                for _ in range(count):
+                    store.add_buildings(row, rng.randrange(len(demo_server.BUILDING_TYPES)), 1)
+
+            def with_list():
+                city = store.city_dict(row)
+                city["buildings"] = store.buildings_of(row)
+                return json.dumps(city)
+
+            compact = _time_per_call(lambda: json.dumps(store.city_dict(row)), args.iterations)
+            listed = _time_per_call(with_list, max(1, args.iterations * 10 // count))
+            print(f"{count:>10} {'batches' if batched else 'singly':>8} {store.building_total:>11} "
+                  f"{len(json.dumps(store.city_dict(row))):>8} B {len(with_list()):>8} B "
+                  f"{compact * 1e6:>7.1f} us {listed * 1e6:>7.0f} us")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    overload: steady clients while a herd floods the server
+# ═══════════════════════════════════════════════════════════════
+
+HERD_ADDRESS = "127.0.0.2"
+
+
+def _herd_process(port, city_ids, threads, seconds, results, prefix=""):
+    """
+    Closed-loop clients from HERD_ADDRESS mixing full state dumps and ticks, backing off 10 ms when refused.
+    
+    prefix is prepended to every path, e.g. /worlds/<id> to aim at one world.
+    """
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(n):
+        rng = random.Random(n)
+        while time.perf_counter() < deadline:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30, source_address=(HERD_ADDRESS, 0))
+            try:
+                if rng.random() < 0.5:
+                    conn.request("GET", prefix + "/api/game/state")
+                else:
+                    conn.request("POST", prefix + "/api/game/tick", body=json.dumps({"city_id": rng.choice(city_ids)}),
+                                 headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except OSError:
+                status = "error"
+            finally:
+                conn.close()
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+            if status != 200:
+                time.sleep(0.01)
+
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    results.put(statuses)
+
+
+def _steady_client(port, address, city_id, rate, seconds, latencies, statuses):
+    """Open loop from its own address: a request every 1/rate seconds on schedule, cheap reads and ticks alternating"""
+    interval = 1.0 / rate
+    started = time.perf_counter()
+    n = 0
+    while True:
+        due = started + n * interval
+        if due - started >= seconds:
+            break
+        time.sleep(max(0.0, due - time.perf_counter()))
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30, source_address=(address, 0))
+        try:
+            if n % 2:
+                conn.request("POST", "/api/game/tick", body=json.dumps({"city_id": city_id}),
+                             headers={"Content-Type": "application/json"})
+            else:
+                conn.request("GET", "/api/leaderboard/rank?city_id=" + city_id)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except OSError:
+            status = "error"
+        finally:
+            conn.close()
+        # Latency from when the request was due, so queueing in the client counts too
+        if status == 200:
+            latencies.append(time.perf_counter() - due)
+        statuses[status] = statuses.get(status, 0) + 1
+        n += 1
+
+
+def _start_on_free_port(*server_args, attempts=5):
+    """start_server on a fresh port, retrying: the herd's client sockets churn through ephemeral ports"""
+    for attempt in range(attempts):
+        port = free_port()
+        try:
+            return port, start_server(port, *server_args)
+        except RuntimeError:
+            if attempt == attempts - 1:
+                raise
+
+
+def cmd_overload(args):
+    import demo_server
+
+    variants = [
+        ("no admission", ["--queue-depth", "0"]),
+        ("admission", []),
+        (f"+ {args.rate_limit:g}/s limit", ["--rate-limit", str(args.rate_limit)]),
+    ]
+    root = tempfile.mkdtemp(prefix="demo-overload-")
+    try:
+        # Seeded from a snapshot: creating cities over HTTP would run into the rate limit
+        store = synthetic_store(args.cities, args.buildings)
+        base = os.path.join(root, "base")
+        os.makedirs(base)
+        demo_server.write_snapshot(os.path.join(base, "snapshot-000000000000.city"), store.to_arrays(), seq=0)
+        city_ids = list(store.ids)
+        del store
+
+        print(f"{args.cities} cities; {args.steady} steady clients x {args.rate:g} req/s (rank reads + ticks), "
+              f"each from its own address, while {args.herd} herd clients from {HERD_ADDRESS} loop on "
+              f"full state dumps + ticks; {args.workers} workers, {args.seconds:g}s")
+        print(f"{'server':>16} {'ok':>6} {'p50':>9} {'p99':>9} {'max':>9} {'shed':>5} | "
+              f"{'herd 200':>8} {'503':>6} {'429':>6} {'err':>5}")
+        for name, extra in variants:
+            directory = os.path.join(root, name.replace(" ", "-").replace("/", ""))
+            shutil.copytree(base, directory)
+            port, proc = _start_on_free_port("--workers", str(args.workers), "--data-dir", directory,
+                                             "--snapshot-interval", "0", *extra, *args.server_args)
+            try:
+                results = multiprocessing.Queue()
+                herd = [
+                    multiprocessing.Process(target=_herd_process,
+                                            args=(port, city_ids, args.herd // args.herd_processes, args.seconds,
+                                                  results))
+                    for _ in range(args.herd_processes if args.herd else 0)
+                ]
+                for p in herd:
+                    p.start()
+                latencies, statuses = [], {}
+                steady = [
+                    threading.Thread(target=_steady_client,
+                                     args=(port, f"127.0.1.{i + 1}", city_ids[i * 7919 % len(city_ids)], args.rate,
+                                           args.seconds, latencies, statuses))
+                    for i in range(args.steady)
+                ]
+                for t in steady:
+                    t.start()
+                for t in steady:
+                    t.join()
+                herd_statuses = {}
+                for _ in herd:
+                    for status, count in results.get().items():
+                        herd_statuses[status] = herd_statuses.get(status, 0) + count
+                for p in herd:
+                    p.join()
+            finally:
+                stop_server(proc)
+            latencies.sort()
+            total = sum(statuses.values())
+            shed = total - statuses.get(200, 0)
+            print(f"{name:>16} {statuses.get(200, 0) / max(1, total) * 100:>5.1f}% "
+                  f"{percentile(latencies, 50) * 1000:>6.1f} ms {percentile(latencies, 99) * 1000:>6.1f} ms "
+                  f"{(latencies[-1] if latencies else 0) * 1000:>6.1f} ms {shed:>5} | "
+                  f"{herd_statuses.get(200, 0):>8} {herd_statuses.get(503, 0):>6} {herd_statuses.get(429, 0):>6} "
+                  f"{herd_statuses.get('error', 0):>5}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ═══════════════════════════════════════════════════════════════
+#    static: the landing page and a large file, from disk vs cached
+# ═══════════════════════════════════════════════════════════════
+
+def _get_client(port, path, headers, requests_each, latencies):
+    conn = None
+    for _ in range(requests_each):
+        started = time.perf_counter()
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        if response.will_close:
+            conn.close()
+            conn = None
+        latencies.append(time.perf_counter() - started)
+    if conn is not None:
+        conn.close()
+
+
+def cmd_static(args):
+    root = tempfile.mkdtemp(prefix="demo-static-")
+    try:
+        shutil.copy(os.path.join(HERE, "index.html"), root)
+        with open(os.path.join(root, "large.bin"), "wb") as f:
+            f.write(os.urandom(args.large_kb * 1024))
+        cases = [
+            ("/ (index.html)", "/", {}, args.requests, "cached"),
+            ("/, gzip", "/", {"Accept-Encoding": "gzip"}, args.requests, "cached"),
+            (f"large.bin {args.large_kb} KiB", "/large.bin", {}, max(1, args.requests // 10), "sendfile"),
+        ]
+        print(f"{args.clients} keep-alive clients; server CPU per request is the less noisy number on a shared machine")
+        print(f"{'request':>22} {'server':>9} {'req/s':>9} {'p50':>9} {'p99':>9} {'CPU/req':>10} {'bytes':>9}")
+        for name, path, headers, requests_each, served in cases:
+            for cached in (False, True):
+                port = free_port()
+                proc = start_server(port, *([] if cached else ["--no-static-cache"]), "--no-metrics", cwd=root)
+                try:
+                    # Warm up, and measure what goes over the wire
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                    conn.request("GET", path, headers=headers)
+                    size = len(conn.getresponse().read())
+                    conn.close()
+                    latencies = []
+                    threads = [
+                        threading.Thread(target=_get_client, args=(port, path, headers, requests_each, latencies))
+                        for _ in range(args.clients)
+                    ]
+                    before = _process_cpu(proc.pid)
+                    started = time.perf_counter()
+                    for t in threads:
+                        t.start()
+                    for t in threads:
+                        t.join()
+                    elapsed = time.perf_counter() - started
+                    cpu = (_process_cpu(proc.pid) - before) / len(latencies)
+                finally:
+                    stop_server(proc)
+                latencies.sort()
+                print(f"{name:>22} {served if cached else 'read':>9} {len(latencies) / elapsed:>9.0f} "
+                      f"{percentile(latencies, 50) * 1000:>6.2f} ms {percentile(latencies, 99) * 1000:>6.2f} ms "
+                      f"{cpu * 1e6:>7.0f} us {size:>9}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ═══════════════════════════════════════════════════════════════
+#    events: polling ?since= vs Server-Sent Events
+# ═══════════════════════════════════════════════════════════════
+
+MARKER_PREFIX = "marker_"
+
+
+def _note_markers(document, seen):
+    now = time.time()
+    for city_id in document["cities"]:
+        if city_id.startswith(MARKER_PREFIX) and city_id not in seen:
+            seen[city_id] = now
+
+
+def _polling_client(port, interval, deadline, seen, received):
+    """
+    GET /api/game/state?since= every interval seconds, accepting gzip like a browser would.
+    
+    A connection per poll: a kept-alive connection would hold a worker
+    thread through every wait between polls.
+    """
+    version = json.loads(request(port, "GET", "/api/game/state?cursor=0&limit=1")[1])["version"]
+    next_poll = time.perf_counter()
+    while time.perf_counter() < deadline:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        conn.request("GET", f"/api/game/state?since={version}", headers={"Accept-Encoding": "gzip"})
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        received[0] += len(body)
+        received[1] += 1
+        next_poll += interval
+        if response.status != 200:
+            # Shed; try again at the next poll
+            time.sleep(max(0.0, next_poll - time.perf_counter()))
+            continue
+        if response.getheader("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        document = json.loads(body)
+        version = document["version"]
+        _note_markers(document, seen)
+        time.sleep(max(0.0, next_poll - time.perf_counter()))
+
+
+def _sse_client(port, deadline, seen, received):
+    """Hold GET /api/game/events open and read delta frames as they arrive"""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=30)
+    sock.sendall(b"GET /api/game/events HTTP/1.1\r\nHost: bench\r\n\r\n")
+    sock.settimeout(0.5)
+    buffer = b""
+    event = None
+    while time.perf_counter() < deadline:
+        try:
+            data = sock.recv(65536)
+        except socket.timeout:
+            continue
+        if not data:
+            break
+        received[0] += len(data)
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.startswith(b"event: "):
+                event = line[7:].strip()
+            elif line.startswith(b"data: ") and event == b"delta":
+                _note_markers(json.loads(line[6:]), seen)
+    sock.close()
+
+
+def _events_process(port, mode, interval, clients, seconds, results):
+    """`clients` threads of one kind; reports when each saw each marker, the bytes they read and their requests"""
+    deadline = time.perf_counter() + seconds
+    sightings = [{} for _ in range(clients)]
+    received = [[0, 0] for _ in range(clients)]
+    threads = [
+        threading.Thread(target=_sse_client, args=(port, deadline, sightings[i], received[i])) if mode == "sse" else
+        threading.Thread(target=_polling_client, args=(port, interval, deadline, sightings[i], received[i]))
+        for i in range(clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put((sightings, sum(r[0] for r in received), sum(r[1] for r in received)))
+
+
+def cmd_events(args):
+    import demo_server
+
+    variants = [(f"poll {ms:g} ms", "poll", ms / 1000) for ms in args.poll_ms] + [("sse", "sse", None)]
+    root = tempfile.mkdtemp(prefix="demo-events-")
+    try:
+        store = synthetic_store(args.cities, args.buildings)
+        demo_server.write_snapshot(os.path.join(root, "snapshot-000000000000.city"), store.to_arrays(), seq=0)
+        city_ids = list(store.ids)
+        del store
+
+        print(f"{args.cities} cities, {args.writes:g} ticks/s of background writes; a new city every "
+              f"{args.marker_ms:g} ms is the update whose delivery is timed. {args.clients} clients watch the world "
+              f"for {args.seconds:g}s; sse pushes every {args.events_interval_ms:g} ms")
+        print(f"{'clients':>14} {'p50':>9} {'p99':>9} {'missed':>6} {'server CPU':>10} {'KB/s/client':>11} {'requests':>9}")
+        for name, mode, interval in variants:
+            directory = os.path.join(root, mode + str(interval))
+            os.makedirs(directory)
+            shutil.copy(os.path.join(root, "snapshot-000000000000.city"), directory)
+            port, proc = _start_on_free_port("--data-dir", directory, "--snapshot-interval", "0", "--no-metrics",
+                                             "--events-interval-ms",
+                                             str(args.events_interval_ms), *args.server_args)
+            try:
+                # Past version 0, so the first ?since= is a delta rather than the whole world
+                request(port, "POST", "/api/game/tick", {"city_id": city_ids[0]})
+                results = multiprocessing.Queue()
+                processes = min(args.processes, args.clients)
+                watchers = [
+                    multiprocessing.Process(target=_events_process,
+                                            args=(port, mode, interval, args.clients // processes,
+                                                  args.seconds + 2, results))
+                    for _ in range(processes)
+                ]
+                for p in watchers:
+                    p.start()
+                time.sleep(1)
+                before = _process_cpu(proc.pid)
+                markers = {}
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                rng = random.Random(0)
+                started = time.perf_counter()
+                next_marker = started
+                writes = 0
+                while time.perf_counter() - started < args.seconds:
+                    now = time.perf_counter()
+                    if now >= next_marker:
+                        city_id = f"{MARKER_PREFIX}{len(markers)}"
+                        markers[city_id] = time.time()
+                        conn.request("POST", "/api/game/create_city", body=json.dumps({"address": city_id}),
+                                     headers={"Content-Type": "application/json"})
+                        next_marker += args.marker_ms / 1000
+                    elif args.writes > 0:
+                        conn.request("POST", "/api/game/tick", body=json.dumps({"city_id": rng.choice(city_ids)}),
+                                     headers={"Content-Type": "application/json"})
+                        writes += 1
+                    else:
+                        time.sleep(max(0.0, next_marker - now))
+                        continue
+                    conn.getresponse().read()
+                    if args.writes > 0:
+                        time.sleep(max(0.0, started + writes / args.writes - time.perf_counter()))
+                conn.close()
+                cpu = _process_cpu(proc.pid) - before
+                elapsed = time.perf_counter() - started
+                delays, missed, received, polls = [], 0, 0, 0
+                for _ in watchers:
+                    sightings, read, requests = results.get()
+                    received += read
+                    polls += requests
+                    for seen in sightings:
+                        for city_id, created in markers.items():
+                            if city_id in seen:
+                                delays.append(seen[city_id] - created)
+                            else:
+                                missed += 1
+                for p in watchers:
+                    p.join()
+            finally:
+                stop_server(proc)
+            delays.sort()
+            print(f"{name:>14} {percentile(delays, 50) * 1000:>6.0f} ms {percentile(delays, 99) * 1000:>6.0f} ms "
+                  f"{missed:>6} {cpu / elapsed * 100:>9.0f}% {received / 1024 / (args.seconds + 2) / args.clients:>11.1f} "
+                  f"{polls if mode == 'poll' else '-':>9}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ═══════════════════════════════════════════════════════════════
+#    worlds: a hot world next to a quiet one, shared vs partitioned
+# ═══════════════════════════════════════════════════════════════
+
+def cmd_worlds(args):
+    import demo_server
+
+    root = tempfile.mkdtemp(prefix="demo-worlds-")
+    try:
+        hot = synthetic_store(args.cities, args.buildings)
+        hot_ids = list(hot.ids)
+        quiet = synthetic_store(args.quiet_cities, args.buildings)
+        quiet_ids = list(quiet.ids)
+        for directory, store in (("shared", hot), ("partitioned/hot", hot), ("partitioned/quiet", quiet)):
+            os.makedirs(os.path.join(root, directory))
+            demo_server.write_snapshot(os.path.join(root, directory, "snapshot-000000000000.city"),
+                                       store.to_arrays(), seq=0)
+        del hot, quiet
+
+        variants = [
+            ("one world", os.path.join(root, "shared"), [], ""),
+            ("two worlds", os.path.join(root, "partitioned"), ["--worlds", "quiet,hot"], "/worlds/hot"),
+        ]
+        print(f"{args.herd} herd clients loop on full state dumps + ticks of a {args.cities}-city world while "
+              f"{args.steady} steady clients x {args.rate:g} req/s use a quiet one ({args.quiet_cities} cities); "
+              f"{args.seconds:g}s, no admission control")
+        print(f"{'server':>12} {'ok':>6} {'p50':>9} {'p99':>9} {'max':>9} | {'herd 200':>8}")
+        for name, directory, extra, herd_prefix in variants:
+            port, proc = _start_on_free_port("--data-dir", directory, "--snapshot-interval", "0", "--queue-depth", "0",
+                                             *extra, *args.server_args)
+            try:
+                results = multiprocessing.Queue()
+                herd = [
+                    multiprocessing.Process(target=_herd_process,
+                                            args=(port, hot_ids, args.herd // args.herd_processes, args.seconds,
+                                                  results, herd_prefix))
+                    for _ in range(args.herd_processes if args.herd else 0)
+                ]
+                for p in herd:
+                    p.start()
+                latencies, statuses = [], {}
+                steady = [
+                    threading.Thread(target=_steady_client,
+                                     args=(port, f"127.0.1.{i + 1}", quiet_ids[i * 7919 % len(quiet_ids)], args.rate,
+                                           args.seconds, latencies, statuses))
+                    for i in range(args.steady)
+                ]
+                for t in steady:
+                    t.start()
+                for t in steady:
+                    t.join()
+                herd_ok = 0
+                for _ in herd:
+                    herd_ok += results.get().get(200, 0)
+                for p in herd:
+                    p.join()
+            finally:
+                stop_server(proc)
+            latencies.sort()
+            total = sum(statuses.values())
+            print(f"{name:>12} {statuses.get(200, 0) / max(1, total) * 100:>5.1f}% "
+                  f"{percentile(latencies, 50) * 1000:>6.1f} ms {percentile(latencies, 99) * 1000:>6.1f} ms "
+                  f"{(latencies[-1] if latencies else 0) * 1000:>6.1f} ms | {herd_ok:>8}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ═══════════════════════════════════════════════════════════════
+#    replay: a recorded action log through the handlers, profiled
+# ═══════════════════════════════════════════════════════════════
+
+REPLAY_PATHS = {
+    "create_city": "/api/game/create_city",
+    "build": "/api/game/build",
+    "build_batch": "/api/game/build_batch",
+    "tick": "/api/game/tick",
+    "tick_world": "/api/game/tick_all",
+}
+
+
+def synthetic_log(path, actions, players, seed):
+    """
+    Write a seeded action log in ActionLog's format: players creating cities,
+    building and ticking them, and an occasional world tick.
+    
+    Players are named player_<n>; replay maps the ones the log never creates
+    onto cities of the world it runs against.
+    """
+    import demo_server
+
+    rng = random.Random(seed)
+    created = 0
+    with open(path, "w") as f:
+        for seq in range(1, actions + 1):
+            player = f"player_{rng.randrange(players)}"
+            roll = rng.random()
+            if roll < 0.05:
+                record = {"op": "create_city", "city_id": f"new_{created}", "owner": f"new_{created}",
+                          "name": f"New {created}", "ai_level": rng.randint(1, 5), "strategy": "balanced",
+                          "created_at": demo_server.SIMULATION_EPOCH + seq}
+                created += 1
+            elif roll < 0.35:
+                record = {"op": "build", "city_id": player, "building_type": rng.choice(demo_server.BUILDING_TYPES)}
+            elif roll < 0.40:
+                record = {"op": "build_batch",
+                          "builds": [[player, rng.choice(demo_server.BUILDING_TYPES), rng.randint(1, 10)]]}
+            elif roll < 0.9995:
+                record = {"op": "tick", "city_id": player, "ticks": rng.choice((1, 1, 1, 10))}
+            else:
+                record = {"op": "tick_world"}
+            f.write(json.dumps({"seq": seq, **record}) + "\n")
+
+
+def _log_records(log):
+    """Records of a --data-dir's segments, or of one segment file"""
+    import demo_server
+
+    paths = [path for _, path in demo_server.ActionLog.segments(log)] if os.path.isdir(log) else [log]
+    for path in paths:
+        yield from demo_server.ActionLog.read(path)
+
+
+def _replay_requests(records, world_cities):
+    """
+    Turn logged actions back into the POST requests that made them:
+    (op, path, body, created_at) tuples.
+    
+    Cities the log acts on without creating are mapped onto bench_<n> cities
+    of a world of world_cities, by a stable hash of their id. Created cities
+    keep their logged id (sent as the address, so they are owned by it). Scheduler steps
+    (tick_rows) have no request and are replayed as they were logged (path
+    None).
+    """
+    created = set()
+
+    def city(city_id):
+        if city_id in created:
+            return city_id
+        return f"bench_{zlib.crc32(city_id.encode()) % world_cities}"
+
+    for record in records:
+        op = record["op"]
+        if op == "create_city":
+            created.add(record["city_id"])
+            body = {"address": record["city_id"], "name": record["name"], "ai_level": record["ai_level"],
+                    "strategy": record["strategy"]}
+            yield op, REPLAY_PATHS[op], body, record["created_at"]
+        elif op == "build":
+            yield op, REPLAY_PATHS[op], {"city_id": city(record["city_id"]), "building_type": record["building_type"]}, None
+        elif op == "build_batch":
+            operations = [[city(city_id), building_type, len(count) if isinstance(count, list) else count]
+                          for city_id, building_type, count in record["builds"]]
+            yield op, REPLAY_PATHS[op], {"operations": operations}, None
+        elif op == "tick":
+            yield op, REPLAY_PATHS[op], {"city_id": city(record["city_id"]), "ticks": record.get("ticks", 1)}, None
+        elif op == "tick_world":
+            yield op, REPLAY_PATHS[op], None, None
+        else:
+            yield op, None, record, None
+
+
+class StackSampler:
+    """
+    A sampling profiler for the main thread: a SIGPROF timer records the
+    interrupted stack every `interval` seconds of CPU time. Much cheaper per
+    call than cProfile, so the costs it attributes stay close to unprofiled
+    ones.
+    
+    Python runs the handler between bytecodes, so the ticks of one long C
+    call (a numpy pass over the world) arrive as one signal, in the frame
+    that made the call. Each sample is therefore weighted by the CPU time
+    since the previous one rather than counted once.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.seconds = 0.0
+        self._previous = None
+        self._last = 0.0
+
+    def __enter__(self):
+        self._last = time.process_time()
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def __exit__(self, *exc):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous)
+
+    def _sample(self, signum, frame):
+        now = time.process_time()
+        weight, self._last = now - self._last, now
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+            frame = frame.f_back
+        key = ";".join(reversed(stack))
+        self.stacks[key] = self.stacks.get(key, 0.0) + weight
+        self.samples += 1
+        self.seconds += weight
+
+    def top(self, limit):
+        """[(function, self seconds, total seconds)], by self seconds"""
+        own, total = {}, {}
+        for key, seconds in self.stacks.items():
+            frames = key.split(";")
+            own[frames[-1]] = own.get(frames[-1], 0.0) + seconds
+            for name in set(frames):
+                total[name] = total.get(name, 0.0) + seconds
+        ranked = sorted(own.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(name, count, total[name]) for name, count in ranked]
+
+    def write_collapsed(self, path):
+        """Stacks in the collapsed format flamegraph.pl and speedscope read, in microseconds"""
+        with open(path, "w") as f:
+            for key, seconds in sorted(self.stacks.items()):
+                f.write(f"{key} {round(seconds * 1e6)}\n")
+
+
+def world_digest(store):
+    """SHA-256 of every column and string of a CityStore: equal digests, equal worlds"""
+    digest = hashlib.sha256()
+    arrays = store.to_arrays()
+    for name in sorted(arrays):
+        value = arrays[name]
+        digest.update(value.tobytes() if hasattr(value, "tobytes") else json.dumps(value).encode())
+    return digest.hexdigest()
+
+
+def replay_world(snapshot, log, world_cities, seed, profiler, profile_out, top):
+    """
+    Body of one replay subprocess: map the snapshot, run every logged action
+    through demo_server.post_action (no sockets, no persistence) and print
+    per-action costs, a digest of the resulting world and a profile.
+    """
+    import cProfile
+    import pstats
+    import demo_server
+
+    demo_server.seed_simulation(seed)
+    with demo_server.state_lock:
+        demo_server.cities.attach(demo_server.MappedSnapshot(snapshot))
+    requests = list(_replay_requests(_log_records(log), world_cities))
+
+    costs = {}
+    statuses = {}
+    gc.collect()
+    profile = cProfile.Profile() if profiler == "cprofile" else None
+    sampler = StackSampler() if profiler == "sample" else None
+    if sampler is not None:
+        sampler.__enter__()
+    if profile is not None:
+        profile.enable()
+    started = time.perf_counter()
+    for op, path, body, created_at in requests:
+        if created_at is not None:
+            demo_server.sim_clock.now = created_at
+        begun = time.perf_counter()
+        if path is None:
+            with demo_server.state_lock:
+                demo_server.replay_action(body)
+            status = 200
+        else:
+            status, _ = demo_server.post_action(path, body)
+        costs.setdefault(op, []).append(time.perf_counter() - begun)
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - started
+    if profile is not None:
+        profile.disable()
+    if sampler is not None:
+        sampler.__exit__()
+
+    print(f"{len(demo_server.cities)} cities after {len(requests)} actions in {elapsed:.2f}s "
+          f"({len(requests) / elapsed:.0f}/s), statuses {dict(sorted(statuses.items()))}")
+    print(f"  {'action':>12} {'count':>8} {'mean':>10} {'p50':>10} {'p99':>10} {'total':>10} {'share':>6}")
+    for op, times in sorted(costs.items(), key=lambda item: sum(item[1]), reverse=True):
+        total = sum(times)
+        times.sort()
+        print(f"  {op:>12} {len(times):>8} {total / len(times) * 1e6:>7.1f} us "
+              f"{percentile(times, 50) * 1e6:>7.1f} us {percentile(times, 99) * 1e6:>7.1f} us "
+              f"{total * 1000:>7.1f} ms {total / elapsed * 100:>5.1f}%")
+    print(f"  world digest {world_digest(demo_server.cities)[:16]}")
+
+    if profile is not None:
+        stats = pstats.Stats(profile, stream=sys.stdout)
+        stats.sort_stats("tottime").print_stats(top)
+        if profile_out:
+            stats.dump_stats(profile_out)
+    if sampler is not None:
+        print(f"  {'self':>6} {'total':>6}  function ({sampler.samples} samples over {sampler.seconds:.2f}s of CPU)")
+        for name, own, total in sampler.top(top):
+            print(f"  {own / sampler.seconds * 100:>5.1f}% {total / sampler.seconds * 100:>5.1f}%  {name}")
+        if profile_out:
+            sampler.write_collapsed(profile_out)
+
+
+_REPLAY_SCRIPT = """
+import sys
+sys.path.insert(0, {here!r})
+import demo_benchmark
+demo_benchmark.replay_world(*{args!r})
+"""
+
+
+def cmd_replay(args):
+    import demo_server
+
+    root = tempfile.mkdtemp(prefix="demo-replay-")
+    try:
+        log = args.log
+        if log is None:
+            log = os.path.join(root, "actions-000000000001.log")
+            synthetic_log(log, args.actions, args.players, args.seed)
+            print(f"synthetic log: {args.actions} actions from {args.players} players (seed {args.seed})")
+        for count in args.cities:
+            store = synthetic_store(count, args.buildings)
+            snapshot = os.path.join(root, f"world-{count}.city")
+            demo_server.write_snapshot(snapshot, store.to_arrays(), seq=0)
+            del store
+            profile_out = None
+            if args.profile_out:
+                profile_out = f"{args.profile_out}.{count}.{'prof' if args.profiler == 'cprofile' else 'folded'}"
+            print(f"\n== {count} cities x {args.buildings} buildings")
+            sys.stdout.flush()
+            script = _REPLAY_SCRIPT.format(here=HERE, args=(snapshot, log, count, args.seed, args.profiler,
+                                                            profile_out, args.top))
+            subprocess.run([sys.executable, "-c", script], check=True)
+            os.remove(snapshot)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solana AI City demo server benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("throughput", help="requests/sec of each serving mode under concurrent clients")
+    p.add_argument("--modes", default="single,threaded", help="comma-separated serving modes to compare")
+    p.add_argument("--workers", type=int, default=None, help="worker threads for threaded mode (per process in prefork)")
+    p.add_argument("--processes", type=int, default=None, help="worker processes for prefork mode (default: cpus)")
+    p.add_argument("--clients", type=int, default=32, help="concurrent closed-loop clients")
+    p.add_argument("--slow-clients", type=int, default=1, help="connections that trickle their headers")
+    p.add_argument("--seconds", type=float, default=5.0, help="duration of each run")
+    p.add_argument("--cities", type=int, default=200, help="cities to seed before the run")
+    p.add_argument("--buildings", type=int, default=2, help="buildings per seeded city")
+    p.add_argument("--state-every", type=int, default=20,
+                   help="every Nth request is a full GET /api/game/state (0 disables)")
+    p.add_argument("--build-every", type=int, default=0,
+                   help="every Nth request is a POST /api/game/build (0 disables)")
+    p.set_defaults(func=cmd_throughput)
+
+    p = sub.add_parser("world-tick", help="in-process per-city ticks vs tick_world()")
+    p.add_argument("--cities", type=int, default=5000)
+    p.add_argument("--buildings", type=int, default=20, help="buildings per city")
+    p.add_argument("--rounds", type=int, default=5, help="cycles to average over")
+    p.set_defaults(func=cmd_world_tick)
+
+    p = sub.add_parser("memory", help="bytes and GC objects per city, CityStore vs nested dicts")
+    p.add_argument("--cities", type=int, default=1_000_000)
+    p.add_argument("--buildings", type=int, default=5, help="buildings per city")
+    p.add_argument("--dict-cities", type=int, default=100_000,
+                   help="cities built with the old dict layout (result is scaled up to --cities)")
+    p.set_defaults(func=cmd_memory)
+
+    p = sub.add_parser("tick-latency", help="single-city tick cost from 10 to 10,000 buildings")
+    p.add_argument("--buildings", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    p.add_argument("--iterations", type=int, default=2000, help="ticks timed per building count")
+    p.set_defaults(func=cmd_tick_latency)
+
+    p = sub.add_parser("catch-up", help="one catch_up_row(N) vs N tick_row calls on an idle city")
+    p.add_argument("--ticks", type=int, nargs="+", default=[10, 1000, 100_000, 1_000_000])
+    p.add_argument("--buildings", type=int, default=10, help="farms in the city")
+    p.set_defaults(func=cmd_catch_up)
+
+    p = sub.add_parser("recovery", help="restart time from snapshot + log tail vs replaying all history")
+    p.add_argument("--cities", type=int, default=100_000)
+    p.add_argument("--buildings", type=int, default=3, help="builds per city in the history")
+    p.add_argument("--history-ticks", type=int, default=20, help="world ticks in the history")
+    p.add_argument("--tail", type=int, default=10_000, help="single-city ticks logged after the snapshot")
+    p.set_defaults(func=cmd_recovery)
+
+    p = sub.add_parser("cold-start", help="startup time from a mapped binary snapshot at several world sizes")
+    p.add_argument("--cities", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p.add_argument("--buildings", type=int, default=3, help="buildings per city")
+    p.set_defaults(func=cmd_cold_start)
+
+    p = sub.add_parser("state-delta", help="GET /api/game/state size and encode time, full vs ?since=")
+    p.add_argument("--cities", type=int, default=20_000)
+    p.add_argument("--buildings", type=int, default=3, help="buildings per city")
+    p.add_argument("--changed", type=int, nargs="+", default=[0, 10, 100, 1000],
+                   help="cities changed between polls")
+    p.add_argument("--rounds", type=int, default=5, help="encodes to average over")
+    p.set_defaults(func=cmd_state_delta)
+
+    p = sub.add_parser("state-export", help="peak memory of a full state dump, json.dumps vs streamed")
+    p.add_argument("--cities", type=int, nargs="+", default=[10_000, 50_000])
+    p.add_argument("--buildings", type=int, default=3, help="buildings per city")
+    p.set_defaults(func=cmd_state_export)
+
+    p = sub.add_parser("scheduler", help="request latency while the server ticks the world on its own")
+    p.add_argument("--cities", type=int, default=1_000_000)
+    p.add_argument("--buildings", type=int, default=3, help="buildings per city")
+    p.add_argument("--rate", type=float, default=1.0, help="world ticks per second")
+    p.add_argument("--slices", type=int, nargs="+", default=[1, 10, 50], help="steps per tick to compare")
+    p.add_argument("--seconds", type=float, default=10.0, help="probe duration per setting")
+    p.add_argument("--probe", choices=["state", "tick"], default="state",
+                   help="request timed: a one-city state page or a single-city tick")
+    p.add_argument("--poll-leaderboard", action="store_true",
+                   help="keep one client reading GET /api/leaderboard meanwhile")
+    p.set_defaults(func=cmd_scheduler)
+
+    p = sub.add_parser("build-batch", help="one build_batch request vs the same builds one request each")
+    p.add_argument("--builds", type=int, default=50, help="builds per round")
+    p.add_argument("--cities", type=int, default=10, help="cities the builds are spread over")
+    p.add_argument("--rounds", type=int, default=20)
+    p.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                   help="extra demo_server.py arguments, e.g. --commit-delay-ms 0")
+    p.set_defaults(func=cmd_build_batch)
+
+    p = sub.add_parser("keep-alive", help="tick-heavy clients with a connection per request vs kept alive")
+    p.add_argument("--clients", type=int, default=8, help="concurrent clients, one city each")
+    p.add_argument("--requests", type=int, default=500, help="ticks per client")
+    p.add_argument("--state-cities", type=int, default=1000, help="cities for the compressed page size check")
+    p.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                   help="extra demo_server.py arguments, e.g. --workers 16")
+    p.set_defaults(func=cmd_keep_alive)
+
+    p = sub.add_parser("metrics-overhead", help="request throughput with and without instrumentation")
+    p.add_argument("--clients", type=int, default=4)
+    p.add_argument("--requests", type=int, default=2000, help="ticks per client per run")
+    p.add_argument("--rounds", type=int, default=3, help="alternating runs of each server")
+    p.set_defaults(func=cmd_metrics_overhead)
+
+    p = sub.add_parser("shards", help="single-city tick latency behind full state dumps at several shard counts")
+    p.add_argument("--cities", type=int, default=20000)
+    p.add_argument("--buildings", type=int, default=3, help="farms per city")
+    p.add_argument("--shards", type=int, nargs="+", default=[1, 16])
+    p.add_argument("--clients", type=int, default=8, help="concurrent tick clients")
+    p.add_argument("--requests", type=int, default=300, help="ticks per client")
+    p.add_argument("--readers", type=int, default=2, help="clients streaming the full state meanwhile")
+    p.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                   help="extra demo_server.py arguments, e.g. --commit-delay-ms 0")
+    p.set_defaults(func=cmd_shards)
+
+    p = sub.add_parser("buildings", help="pool slots and city document size, per-type counts vs the full building list")
+    p.add_argument("--buildings", type=int, nargs="+", default=[10, 1000, 100000])
+    p.add_argument("--iterations", type=int, default=2000, help="renders timed per building count")
+    p.set_defaults(func=cmd_buildings)
+
+    p = sub.add_parser("overload", help="steady clients' latency while a herd floods the server, with and without admission control")
+    p.add_argument("--workers", type=int, default=4, help="server worker threads")
+    p.add_argument("--cities", type=int, default=2000)
+    p.add_argument("--buildings", type=int, default=3, help="farms per city")
+    p.add_argument("--steady", type=int, default=8, help="well-behaved open-loop clients")
+    p.add_argument("--rate", type=float, default=5.0, help="requests per second per steady client")
+    p.add_argument("--herd", type=int, default=64, help="closed-loop herd clients, in total")
+    p.add_argument("--herd-processes", type=int, default=4, help="processes the herd runs in")
+    p.add_argument("--rate-limit", type=float, default=10.0, help="per-address limit for the last variant")
+    p.add_argument("--seconds", type=float, default=10.0, help="duration of each run")
+    p.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                   help="extra demo_server.py arguments, e.g. --queue-timeout-ms 200")
+    p.set_defaults(func=cmd_overload)
+
+    p = sub.add_parser("static", help="GET / and a large file, read from disk per request vs cached / sendfile")
+    p.add_argument("--clients", type=int, default=8, help="concurrent keep-alive clients")
+    p.add_argument("--requests", type=int, default=500, help="requests per client (a tenth of that for the large file)")
+    p.add_argument("--large-kb", type=int, default=4096, help="size of the large file, above the in-memory cache limit")
+    p.set_defaults(func=cmd_static)
+
+    p = sub.add_parser("events", help="update latency and cost of clients polling ?since= vs subscribed to events")
+    p.add_argument("--cities", type=int, default=5000)
+    p.add_argument("--buildings", type=int, default=3, help="farms per city")
+    p.add_argument("--clients", type=int, default=50, help="clients watching the whole world")
+    p.add_argument("--processes", type=int, default=2, help="processes the clients run in")
+    p.add_argument("--poll-ms", type=float, nargs="+", default=[1000, 250], help="polling intervals to compare")
+    p.add_argument("--events-interval-ms", type=float, default=250, help="server's push interval")
+    p.add_argument("--writes", type=float, default=20, help="background single-city ticks per second")
+    p.add_argument("--marker-ms", type=float, default=500, help="interval between timed updates")
+    p.add_argument("--seconds", type=float, default=10.0, help="duration of each run")
+    p.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                   help="extra demo_server.py arguments, e.g. --workers 8")
+    p.set_defaults(func=cmd_events)
+
+    p = sub.add_parser("worlds", help="a quiet world's latency next to a hot one, in one world vs separate worlds")
+    p.add_argument("--cities", type=int, default=5000, help="cities in the hot world")
+    p.add_argument("--quiet-cities", type=int, default=100, help="cities in the quiet world")
+    p.add_argument("--buildings", type=int, default=3, help="farms per city")
+    p.add_argument("--steady", type=int, default=4, help="open-loop clients of the quiet world")
+    p.add_argument("--rate", type=float, default=5.0, help="requests per second per steady client")
+    p.add_argument("--herd", type=int, default=16, help="closed-loop clients of the hot world, in total")
+    p.add_argument("--herd-processes", type=int, default=2, help="processes the herd runs in")
+    p.add_argument("--seconds", type=float, default=10.0, help="duration of each run")
+    p.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                   help="extra demo_server.py arguments, e.g. --workers 8")
+    p.set_defaults(func=cmd_worlds)
+
+    p = sub.add_parser("replay", help="per-action cost of a recorded action log at several world sizes, profiled")
+    p.add_argument("--log", default=None,
+                   help="a --data-dir (all its segments) or one actions-*.log; default: a seeded synthetic log")
+    p.add_argument("--cities", type=int, nargs="+", default=[1000, 100_000, 1_000_000],
+                   help="world sizes to replay against")
+    p.add_argument("--buildings", type=int, default=3, help="farms per city of each world")
+    p.add_argument("--actions", type=int, default=20000, help="actions in the synthetic log")
+    p.add_argument("--players", type=int, default=500, help="distinct cities the synthetic log acts on")
+    p.add_argument("--seed", type=int, default=0, help="seed for the synthetic log and the simulation")
+    p.add_argument("--profiler", choices=("none", "cprofile", "sample"), default="none")
+    p.add_argument("--top", type=int, default=15, help="functions listed from the profile")
+    p.add_argument("--profile-out", default=None,
+                   help="prefix for each size's profile (.prof for cprofile, collapsed stacks .folded for sample)")
+    p.set_defaults(func=cmd_replay)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
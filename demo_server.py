@@ -5,230 +5,4312 @@ Can run in any browser with Python backend
 """
 
 from http.server import HTTPServer, SimpleHTTPRequestHandler
+from collections.abc import Mapping, MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import bisect
+import collections
+import contextlib
+import email.utils
+import functools
+import gzip
+import hashlib
+import heapq
+import itertools
 import json
+import math
+import mimetypes
+import mmap
+import os
+import sys
+import threading
 import time
 import random
+import selectors
+import signal
+import socket
+import stat
+import numpy as np
 from urllib.parse import urlparse, parse_qs
 import socketserver
+import struct
+import zlib
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait as wait_connections
+
+class LockSet:
+    """Several locks taken together, in list order, and released in reverse"""
+    
+    def __init__(self, locks):
+        self.locks = locks
+    
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+        return self
+    
+    def __exit__(self, *exc_info):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+class ShardedLock(LockSet):
+    """
+    One RLock per shard of the city store; a city's shard is city_hash(id) % N.
+    
+    Entering the object takes every shard, for whole-world work. shard(),
+    for_city() and for_cities() take only what single-city and batch
+    requests need. Locks are always taken in ascending shard order, and a
+    thread holding some shards never enters the whole set, so holders
+    cannot deadlock. In prefork mode the locks are multiprocessing RLocks,
+    created before forking, and guard the shared-memory world across
+    processes.
+    """
+    
+    def __init__(self, count):
+        super().__init__([])
+        self.resize(count)
+    
+    def __len__(self):
+        return len(self.locks)
+    
+    def resize(self, count, factory=threading.RLock):
+        """Set the number of shards; only before any other thread or process uses the lock"""
+        if count < 1:
+            raise ValueError("need at least one shard")
+        self.locks = [factory() for _ in range(count)]
+    
+    def shard(self, shard):
+        return self.locks[shard]
+    
+    def for_city(self, city_id):
+        return self.locks[city_hash(city_id) % len(self.locks)]
+    
+    def for_cities(self, city_ids):
+        shards = {city_hash(city_id) % len(self.locks) for city_id in city_ids}
+        return LockSet([self.locks[shard] for shard in sorted(shards)])
+
+
+# Guards every read and write of game_state once requests run concurrently.
+# City rows are split into shards, each with its own lock: single-city
+# requests hold only their city's shard, and readers of many cities (state
+# dumps, leaderboards) render each city under its shard's lock, so requests
+# on different shards never wait on each other. `with state_lock:` holds
+# every shard, for work on the whole world (creating cities, which may grow
+# the columns; world ticks; snapshots; recovery). Handlers release all
+# locks before writing to the socket.
+DEFAULT_SHARDS = 16
+state_lock = ShardedLock(DEFAULT_SHARDS)
+
+# Resource templates
+RESOURCES = {
+    "gold": {"emoji": "💰", "name": "Gold"},
+    "wood": {"emoji": "🪵", "name": "Wood"},
+    "stone": {"emoji": "🪨", "name": "Stone"},
+    "food": {"emoji": "🍎", "name": "Food"},
+    "energy": {"emoji": "⚡", "name": "Energy"},
+}
+
+BUILDINGS = {
+    "house": {"emoji": "🏠", "name": "House", "cost": {"gold": 100, "wood": 50, "stone": 25}, "production": {}, "bonus": {"population": 50}},
+    "farm": {"emoji": "🌾", "name": "Farm", "cost": {"gold": 50, "wood": 100, "stone": 0}, "production": {"food": 10}, "bonus": {"population": 10}},
+    "mine": {"emoji": "⛏️", "name": "Mine", "cost": {"gold": 200, "wood": 50, "stone": 100}, "production": {"gold": 5, "stone": 10}, "bonus": {}},
+    "lumber_mill": {"emoji": "🪚", "name": "Lumber Mill", "cost": {"gold": 100, "wood": 50, "stone": 25}, "production": {"wood": 15}, "bonus": {}},
+    "power_plant": {"emoji": "⚡", "name": "Power Plant", "cost": {"gold": 300, "wood": 100, "stone": 150}, "production": {"energy": 20}, "bonus": {}},
+    "factory": {"emoji": "🏭", "name": "Factory", "cost": {"gold": 500, "wood": 250, "stone": 200}, "production": {"gold": 15}, "bonus": {}},
+}
+
+RESOURCE_NAMES = list(RESOURCES)
+RESOURCE_INDEX = {r: i for i, r in enumerate(RESOURCE_NAMES)}
+BUILDING_TYPES = list(BUILDINGS)
+BUILDING_INDEX = {b: i for i, b in enumerate(BUILDING_TYPES)}
+FOOD = RESOURCE_INDEX["food"]
+
+# [building, resource] base production per cycle
+PRODUCTION_TABLE = np.array(
+    [[BUILDINGS[b]["production"].get(r, 0) for r in RESOURCE_NAMES] for b in BUILDING_TYPES],
+    dtype=np.int64,
+)
+
+# [building, resource] construction cost, and population added per building
+COST_TABLE = np.array(
+    [[BUILDINGS[b]["cost"].get(r, 0) for r in RESOURCE_NAMES] for b in BUILDING_TYPES],
+    dtype=np.int64,
+)
+POPULATION_BONUS = [BUILDINGS[b]["bonus"].get("population", 0) for b in BUILDING_TYPES]
+
+# Stored numbers saturate here: int64 columns cannot wrap, the float math
+# in the growth rules stays exact, and JavaScript clients read them exactly.
+MAX_SAFE_INTEGER = 2 ** 53 - 1
+
+STARTING_RESOURCES = {"gold": 1000, "wood": 500, "stone": 250, "food": 1000, "energy": 500}
+
+# The building pool holds runs, consecutive buildings of one type in a
+# city's build order, packed as count * 8 + type code
+_BUILDING_SHIFT = 3
+_BUILDING_TYPE_MASK = (1 << _BUILDING_SHIFT) - 1
+_MAX_RUN = (1 << (32 - _BUILDING_SHIFT)) - 1
+
+
+@functools.lru_cache(maxsize=256)
+def _unit_production(ai_bonus):
+    """Per-building output at one ai_bonus, truncated per building like int(amount * ai_bonus)"""
+    unit = np.trunc(PRODUCTION_TABLE * ai_bonus).astype(np.int64)
+    unit.flags.writeable = False
+    return unit
+
+
+def _food_regime_flip(food, food_rate, population, fed):
+    """
+    First cycle j >= 1 from now whose fed test differs from `fed`, or None.
+    
+    Food after j cycles is min(food + j * food_rate, MAX_SAFE_INTEGER)
+    while population stays put; a city is fed when that exceeds 2 x population.
+    """
+    threshold = population * 2
+    if not fed and food_rate > 0 and threshold < MAX_SAFE_INTEGER:
+        return (threshold - food) // food_rate + 1
+    if fed and food_rate < 0:
+        return -((threshold - food) // -food_rate)
+    return None
+
+
+def city_hash(city_id):
+    """Stable hash of a city id, the crc32 of its snapshot encoding; picks its shard"""
+    return zlib.crc32(_encode_string(city_id)[0])
+
+
+def _json_number(value):
+    """ai_level arrives as a JSON number; hand integers back as integers"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+class LeaderboardIndex:
+    """
+    Cities ordered by score (highest first), ties in creation order.
+    
+    Each row is indexed under one integer key, (-score << 40) | row, kept
+    in a list of sorted sublists with a Fenwick tree over the sublist
+    lengths. Moving a row after a score change, ranking a row and selecting
+    by rank are all O(log n); reading the top K is O(K). The score a row is
+    currently indexed under is kept in a NumPy column, so the index costs
+    one int per city on top of the sublists.
+    
+    source() returns the current score column. defer() drops the index
+    until the first read, for stores opened from a snapshot that may never
+    be asked for rankings, and mark() queues rows whose scores moved in
+    bulk (a tick) as dirty in O(rows). A read moves the dirty rows itself
+    a chunk at a time, or, when more than a 64th of the index is dirty
+    (one tick step at most dirties a slice of one shard), rebuilds it from
+    a copy of source().
+    
+    Rows of every shard move through the one index, so it has a lock of
+    its own; public methods take it, and callers may hold shard locks.
+    Writers only ever wait for one chunk or for the swap: a rebuild sorts
+    outside the lock while writers queue their rows as dirty, and the
+    rows queued during it are moved after the swap.
+    """
+    
+    _LOAD = 512
+    _ROW_BITS = 40
+    # Dirty rows a read moves per hold of the lock
+    _CHUNK = 1024
+    
+    def __init__(self, source=None, sync=None):
+        self._lists = []
+        self._maxes = []
+        self._tree = []
+        self._scores = np.zeros(0, dtype=np.int64)
+        self._present = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._source = source
+        # Called before every read, without the lock, to mark() rows that
+        # changed behind the index's back (other processes' writes)
+        self._sync = sync
+        # The sublists must be rebuilt from source() before the next read
+        self._stale = False
+        # Generation of the stale index; defer() during a rebuild voids it
+        self._generation = 0
+        self._rebuilding = False
+        self._dirty = []
+        self._dirty_count = 0
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+    
+    def __len__(self):
+        with self._current():
+            return self._size
+    
+    def defer(self, source=None):
+        """Drop the index and rebuild it from source() (current scores) on first read"""
+        with self._lock:
+            if source is not None:
+                self._source = source
+            self._lists, self._maxes, self._tree = [], [], []
+            self._stale = True
+            self._generation += 1
+            self._dirty, self._dirty_count = [], 0
+    
+    def mark(self, rows):
+        """Queue rows whose scores changed; reads move them to their new scores"""
+        with self._lock:
+            if self._stale and not self._rebuilding:
+                return
+            self._dirty.append(rows)
+            self._dirty_count += len(rows)
+            if not self._rebuilding and self._dirty_count > self._rebuild_threshold():
+                # The next read rebuilds anyway; stop queueing rows for it
+                self._stale = True
+                self._dirty, self._dirty_count = [], 0
+    
+    def _rebuild_threshold(self):
+        """Dirty rows past which reading rebuilds instead of moving them"""
+        return max(self._CHUNK, self._size // 64)
+    
+    @contextlib.contextmanager
+    def _current(self):
+        """
+        Hold the lock with the index caught up with source().
+        
+        Dirty rows are moved a chunk per hold of the lock, and a stale or
+        mostly dirty index is rebuilt outside it. A read that rebuilds
+        serves the index as of its copy of the scores; rows dirtied while it
+        sorted are left for the next read.
+        """
+        if self._sync is not None:
+            self._sync()
+        while True:
+            self._lock.acquire()
+            if self._rebuilding or self._stale or self._dirty_count > self._rebuild_threshold():
+                self._lock.release()
+                if self._rebuild_from_source():
+                    break
+                continue
+            if self._dirty_count <= self._CHUNK:
+                self._move_dirty(self._CHUNK)
+                break
+            self._move_dirty(self._CHUNK)
+            self._lock.release()
+        try:
+            yield
+        finally:
+            self._lock.release()
+    
+    def _move_dirty(self, limit):
+        if not self._dirty:
+            return
+        dirty = np.concatenate(self._dirty) if len(self._dirty) > 1 else np.asarray(self._dirty[0])
+        rows, rest = np.unique(dirty[:limit]), dirty[limit:]
+        self._dirty = [rest] if len(rest) else []
+        self._dirty_count = len(rest)
+        scores = self._source()
+        for row, score in zip(rows.tolist(), scores[rows].tolist()):
+            self._move(row, score)
+    
+    def _rebuild_from_source(self):
+        """
+        Sort a copy of source() outside the lock and swap the result in.
+        
+        Returns True still holding the lock once this call's rebuild is
+        installed, so the caller reads it before anything else can go
+        stale; False (not holding it) when there was nothing to do or a
+        defer() overtook the copy.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                if not self._stale and self._dirty_count <= self._rebuild_threshold():
+                    return False
+                generation = self._generation
+                self._rebuilding = True
+                self._dirty, self._dirty_count = [], 0
+            try:
+                built = self._sorted(np.array(self._source(), dtype=np.int64))
+            except BaseException:
+                with self._lock:
+                    # The rows dirtied before the copy went with it
+                    self._rebuilding = False
+                    self._stale = True
+                raise
+            self._lock.acquire()
+            self._rebuilding = False
+            if generation == self._generation:
+                self._install(*built)
+                return True
+            self._lock.release()
+            return False
+    
+    def _key(self, row, score):
+        return (-score << self._ROW_BITS) | row
+    
+    def _row(self, key):
+        return key & ((1 << self._ROW_BITS) - 1)
+    
+    # Fenwick tree over len(self._lists[i])
+    
+    def _rebuild_tree(self):
+        tree = [len(lst) for lst in self._lists]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+    
+    def _tree_add(self, pos, delta):
+        tree = self._tree
+        while pos < len(tree):
+            tree[pos] += delta
+            pos |= pos + 1
+    
+    def _tree_prefix(self, pos):
+        """Number of keys in sublists [0, pos)"""
+        total = 0
+        tree = self._tree
+        while pos > 0:
+            total += tree[pos - 1]
+            pos &= pos - 1
+        return total
+    
+    def _tree_find(self, index):
+        """(sublist, offset) of the key at global position index"""
+        tree = self._tree
+        pos = 0
+        step = 1 << (len(tree).bit_length())
+        while step:
+            nxt = pos + step
+            if nxt <= len(tree) and tree[nxt - 1] <= index:
+                index -= tree[nxt - 1]
+                pos = nxt
+            step >>= 1
+        return pos, index
+    
+    # Keys
+    
+    def _insert(self, key):
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._rebuild_tree()
+            return
+        pos = bisect.bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._lists[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            bisect.insort(self._lists[pos], key)
+        self._tree_add(pos, 1)
+        lst = self._lists[pos]
+        if len(lst) > 2 * self._LOAD:
+            self._lists[pos:pos + 1] = [lst[:self._LOAD], lst[self._LOAD:]]
+            self._maxes[pos:pos + 1] = [lst[self._LOAD - 1], lst[-1]]
+            self._rebuild_tree()
+    
+    def _remove(self, key):
+        pos = bisect.bisect_left(self._maxes, key)
+        lst = self._lists[pos]
+        del lst[bisect.bisect_left(lst, key)]
+        if lst:
+            self._maxes[pos] = lst[-1]
+            self._tree_add(pos, -1)
+        else:
+            del self._lists[pos]
+            del self._maxes[pos]
+            self._rebuild_tree()
+    
+    # Rows
+    
+    def _reserve(self, row):
+        if row >= len(self._scores):
+            size = max(1024, 2 * len(self._scores), row + 1)
+            scores = np.zeros(size, dtype=np.int64)
+            scores[:len(self._scores)] = self._scores
+            present = np.zeros(size, dtype=bool)
+            present[:len(self._present)] = self._present
+            self._scores, self._present = scores, present
+    
+    def update(self, row, score):
+        """Index row under score, moving it if it was already indexed"""
+        with self._lock:
+            if self._rebuilding:
+                self._dirty.append([row])
+                self._dirty_count += 1
+            elif not self._stale:
+                self._move(row, int(score))
+    
+    def _move(self, row, score):
+        self._reserve(row)
+        if self._present[row]:
+            old = int(self._scores[row])
+            if old == score:
+                return
+            self._remove(self._key(row, old))
+        else:
+            self._present[row] = True
+            self._size += 1
+        self._scores[row] = score
+        self._insert(self._key(row, score))
+    
+    def rebuild(self, scores):
+        """Re-index rows 0..len(scores)-1 from scratch in O(n log n) NumPy time"""
+        built = self._sorted(np.array(scores, dtype=np.int64))
+        with self._lock:
+            self._generation += 1
+            self._dirty, self._dirty_count = [], 0
+            self._install(*built)
+    
+    def _sorted(self, scores):
+        """Sublists for scores, built without touching the index"""
+        n = len(scores)
+        rows = np.arange(n)
+        limit = 1 << (63 - self._ROW_BITS)
+        if n == 0 or (-limit < scores.min() and scores.max() < limit):
+            # Every key fits an int64: build and sort them in NumPy
+            keys = np.sort((-scores << self._ROW_BITS) | rows).tolist()
+        else:
+            order = np.lexsort((rows, -scores))
+            keys = [self._key(row, score) for row, score in zip(order.tolist(), scores[order].tolist())]
+        lists = [keys[i:i + self._LOAD] for i in range(0, n, self._LOAD)]
+        return scores, lists
+    
+    def _install(self, scores, lists):
+        self._lists = lists
+        self._maxes = [lst[-1] for lst in lists]
+        self._rebuild_tree()
+        self._scores = scores
+        self._present = np.ones(len(scores), dtype=bool)
+        self._size = len(scores)
+        self._stale = False
+    
+    def rank(self, row):
+        """0-based position of row (0 is the top city)"""
+        with self._current():
+            return self._rank(row)
+    
+    def placing(self, row):
+        """(rank, score) of row, the score being the one it is ranked under"""
+        with self._current():
+            return self._rank(row), int(self._scores[row])
+    
+    def _rank(self, row):
+        if row >= len(self._present) or not self._present[row]:
+            # Created after the scores this index was rebuilt from
+            self._move(row, int(self._source()[row]))
+        key = self._key(row, int(self._scores[row]))
+        pos = bisect.bisect_left(self._maxes, key)
+        return self._tree_prefix(pos) + bisect.bisect_left(self._lists[pos], key)
+    
+    def slice(self, start, stop):
+        """Rows at positions [start, stop), walking sublists in O(stop - start)"""
+        with self._current():
+            return self._slice(start, stop)
+    
+    def _slice(self, start, stop):
+        start = max(0, start)
+        stop = min(self._size, stop)
+        if start >= stop:
+            return []
+        pos, offset = self._tree_find(start)
+        rows = []
+        remaining = stop - start
+        while remaining > 0:
+            chunk = self._lists[pos][offset:offset + remaining]
+            rows.extend(self._row(key) for key in chunk)
+            remaining -= len(chunk)
+            pos += 1
+            offset = 0
+        return rows
+    
+    def top(self, k):
+        return self.slice(0, k)
+    
+    def around(self, row, radius):
+        """(rank of row, rows ranked within radius of it)"""
+        with self._current():
+            rank = self._rank(row)
+            return rank, self._slice(rank - radius, rank + radius + 1)
+
+
+class CityStore(Mapping):
+    """
+    Struct-of-arrays storage for every city, indexed by interned city id.
+    
+    Each numeric field is one typed NumPy column and row i belongs to
+    ids[i]. Strings live in plain lists. Buildings sit in one shared pool of
+    packed (count, type) runs, chained per city in build order through
+    first_building/last_building and building_next, so a city costs no
+    Python objects beyond its strings and a run of same-type builds costs
+    one pool slot. Building ids come from the per-city building_seq
+    counter: buildings are never removed, so a city's buildings are
+    building_{seq - total + 1} .. building_{seq} in build order. Indexing the store by city id returns
+    a CityView, a live dict-like view whose to_dict() renders the same
+    document the old nested dicts did.
+    
+    Code that writes a column directly reports the rows it touched through
+    changed()/changed_rows() so derived indexes (the leaderboard) follow.
+    
+    Rows belong to shards (id_hash % len(state_lock)). Writers hold their
+    rows' shard locks; state shared by every shard (the building pool, the
+    world version, the leaderboard) has small locks of its own. Only
+    create() appends rows or grows the columns, under every shard lock.
+    """
+    
+    # name -> (dtype, trailing shape)
+    COLUMNS = {
+        "resources": (np.int64, (len(RESOURCE_NAMES),)),
+        "population": (np.int64, ()),
+        "score": (np.int64, ()),
+        "level": (np.int16, ()),
+        "ai_level": (np.float64, ()),
+        "created_at": (np.int64, ()),
+        "building_counts": (np.int32, (len(BUILDING_TYPES),)),
+        # Derived from ai_level and building_counts, maintained on build so
+        # a tick costs O(resources) however many buildings a city owns
+        "ai_bonus": (np.float64, ()),
+        "production": (np.int64, (len(RESOURCE_NAMES),)),
+        "first_building": (np.int64, ()),
+        "last_building": (np.int64, ()),
+        # world_version at the row's last change, for ?since= deltas
+        "version": (np.int64, ()),
+        # city_hash(id), fixed at creation; the row's shard is id_hash % shards
+        "id_hash": (np.uint32, ()),
+        # Buildings ever built, kept across a reset so ids are never reused
+        "building_seq": (np.int64, ()),
+    }
+    
+    def __init__(self, capacity=1024):
+        self.ids = []
+        self.owners = []
+        self.names = []
+        self.strategies = []
+        self.index = {}
+        self.capacity = capacity
+        for name, (dtype, shape) in self.COLUMNS.items():
+            setattr(self, name, np.zeros((capacity,) + shape, dtype=dtype))
+        self.building_total = 0
+        self.building_code = np.zeros(capacity, dtype=np.uint32)
+        self.building_next = np.zeros(capacity, dtype=np.int64)
+        self.world_version = 0
+        self.leaderboard = LeaderboardIndex(self._current_scores)
+        self._pool_lock = threading.Lock()
+        self._version_lock = threading.Lock()
+    
+    # Mapping protocol: city_id -> CityView
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __iter__(self):
+        return iter(list(self.ids))
+    
+    def __contains__(self, city_id):
+        return city_id in self.index
+    
+    def __getitem__(self, city_id):
+        return CityView(self, self.index[city_id])
+    
+    def row_of(self, city_id):
+        """city_id's row, or None (also for ids no city can have, like a JSON list)"""
+        try:
+            return self.index.get(city_id)
+        except TypeError:
+            return None
+    
+    def _grow(self):
+        self.capacity *= 2
+        for name in self.COLUMNS:
+            old = getattr(self, name)
+            new = np.zeros((self.capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+    
+    def create(self, city_id, owner, name, ai_level, strategy, created_at):
+        """
+        Add a city, or reset it in place if the id already exists.
+        
+        Every argument is checked and converted before a column is written:
+        a bad one raises ValueError and leaves the store as it was.
+        """
+        try:
+            hash(city_id)
+        except TypeError:
+            raise ValueError("city id must be a string or a number") from None
+        if isinstance(ai_level, bool) or not isinstance(ai_level, (int, float)):
+            raise ValueError("ai_level must be a number")
+        try:
+            ai_level = float(ai_level)
+        except OverflowError:
+            raise ValueError("ai_level is out of range") from None
+        if not math.isfinite(ai_level):
+            raise ValueError("ai_level must be finite")
+        created_at = int(created_at)
+        self._reserve_strings(owner, name, strategy, city_id)
+        
+        row = self.index.get(city_id)
+        if row is None:
+            row = len(self.ids)
+            if row == self.capacity:
+                self._grow()
+            city_id = sys.intern(city_id) if isinstance(city_id, str) else city_id
+            if owner == city_id:
+                owner = city_id
+            self.id_hash[row] = city_hash(city_id)
+            self.index[city_id] = row
+            self.ids.append(city_id)
+            self.owners.append(owner)
+            self.names.append(name)
+            self.strategies.append(strategy)
+        else:
+            self.owners[row] = owner
+            self.names[row] = name
+            self.strategies[row] = strategy
+        self.resources[row] = [STARTING_RESOURCES[r] for r in RESOURCE_NAMES]
+        self.population[row] = 100
+        self.score[row] = 100
+        self.level[row] = 1
+        self.ai_level[row] = ai_level
+        self.created_at[row] = created_at
+        self.building_counts[row] = 0
+        self.refresh_production(row)
+        # A reset city's old buildings stay in the pool, unreachable
+        self.first_building[row] = -1
+        self.last_building[row] = -1
+        self.changed(row)
+        return row
+    
+    def _reserve_strings(self, *values):
+        """Raise before create() appends values to string columns that cannot take them"""
+    
+    def changed(self, row):
+        """Bump the world version and refresh derived indexes after row's columns were written"""
+        with self._version_lock:
+            self.world_version += 1
+            self.version[row] = self.world_version
+        self.leaderboard.update(row, self.score[row])
+    
+    def changed_rows(self, rows):
+        """changed() for many rows; the leaderboard moves them on its next read"""
+        with self._version_lock:
+            self.world_version += 1
+            self.version[rows] = self.world_version
+        self.leaderboard.mark(rows)
+    
+    def add_buildings(self, row, type_code, count):
+        """Append count buildings of one type to row's chain, extending its last run if it is the same type"""
+        # The pool is shared by every shard; growing it swaps the arrays
+        with self._pool_lock:
+            remaining = count
+            last = self.last_building.item(row)
+            if last >= 0:
+                code = self.building_code.item(last)
+                if code & _BUILDING_TYPE_MASK == type_code:
+                    extra = min(remaining, _MAX_RUN - (code >> _BUILDING_SHIFT))
+                    self.building_code[last] = code + (extra << _BUILDING_SHIFT)
+                    remaining -= extra
+            while remaining:
+                run = min(remaining, _MAX_RUN)
+                slot = self.building_total
+                if slot == len(self.building_code):
+                    self._grow_buildings()
+                self.building_total += 1
+                self.building_code[slot] = (run << _BUILDING_SHIFT) | type_code
+                self.building_next[slot] = -1
+                if last < 0:
+                    self.first_building[row] = slot
+                else:
+                    self.building_next[last] = slot
+                last = slot
+                remaining -= run
+        self.last_building[row] = last
+        self.building_counts[row, type_code] += count
+        self.building_seq[row] += count
+        self.production[row] += _unit_production(float(self.ai_bonus[row]))[type_code] * count
+    
+    def _grow_buildings(self):
+        self.building_code = np.concatenate([self.building_code, np.zeros_like(self.building_code)])
+        self.building_next = np.concatenate([self.building_next, np.zeros_like(self.building_next)])
+    
+    def build(self, row, type_code):
+        """Pay for and add one building; the caller has checked affordability"""
+        self.build_many(row, type_code, 1)
+    
+    def build_many(self, row, type_code, count):
+        """build() count times, re-indexing the row once at the end"""
+        self.resources[row] -= COST_TABLE[type_code] * count
+        self.add_buildings(row, type_code, count)
+        self.population[row] = min(int(self.population[row]) + POPULATION_BONUS[type_code] * count, MAX_SAFE_INTEGER)
+        self.score[row] = min(int(self.score[row]) + 10 * count, MAX_SAFE_INTEGER)
+        self.changed(row)
+    
+    def building_runs(self, row):
+        """Packed (count, type) runs of one city's buildings, in build order"""
+        codes = []
+        with self._pool_lock:
+            code_at, next_of = self.building_code.item, self.building_next.item
+        slot = self.first_building.item(row)
+        while slot >= 0:
+            codes.append(code_at(slot))
+            slot = next_of(slot)
+        return codes
+    
+    def buildings_of(self, row, offset=0, limit=None):
+        """
+        Render a city's buildings (or the slice offset:offset+limit of them,
+        in build order) as the list of dicts clients expect. Only requests
+        for the detail pay for it; city documents carry per-type counts.
+        """
+        total = int(self.building_counts[row].sum())
+        first_id = int(self.building_seq[row]) - total + 1
+        stop = total if limit is None else min(total, offset + limit)
+        buildings = []
+        index = 0
+        for code in self.building_runs(row):
+            if index >= stop:
+                break
+            count = code >> _BUILDING_SHIFT
+            if index + count > offset:
+                building_type = BUILDING_TYPES[code & _BUILDING_TYPE_MASK]
+                emoji = BUILDINGS[building_type]["emoji"]
+                for i in range(max(index, offset), min(index + count, stop)):
+                    buildings.append({"id": f"building_{first_id + i}", "type": building_type, "level": 1,
+                                      "emoji": emoji})
+            index += count
+        return buildings
+    
+    def building_summary(self, row):
+        """{type: count} of the building types a city owns, in catalog order"""
+        return {BUILDING_TYPES[t]: n for t, n in enumerate(self.building_counts[row].tolist()) if n}
+    
+    def resources_of(self, row):
+        return dict(zip(RESOURCE_NAMES, self.resources[row].tolist()))
+    
+    def city_dict(self, row, resources=None):
+        """
+        The city document, key for key what create_city used to store, except
+        that buildings is {type: count}: the per-building list is paged out
+        of GET /api/game/city/buildings
+        """
+        return {
+            "id": self.ids[row],
+            "owner": self.owners[row],
+            "name": self.names[row],
+            "level": int(self.level[row]),
+            "population": int(self.population[row]),
+            "resources": resources if resources is not None else self.resources_of(row),
+            "buildings": self.building_summary(row),
+            "building_total": int(self.building_counts[row].sum()),
+            "score": int(self.score[row]),
+            "ai_level": _json_number(self.ai_level[row]),
+            "strategy": self.strategies[row],
+            "created_at": int(self.created_at[row]),
+        }
+    
+    def state_document(self, rows=None):
+        """Everything GET /api/game/state returns, as plain dicts (optionally only some rows)"""
+        cities = {}
+        resources = {}
+        for row in range(len(self.ids)) if rows is None else rows:
+            city_id = self.ids[row]
+            resources[city_id] = self.resources_of(row)
+            cities[city_id] = self.city_dict(row, resources[city_id])
+        return {"cities": cities, "resources": resources, "leaderboard": []}
+    
+    def changed_since(self, version):
+        """Rows whose last change is newer than version, in row order"""
+        return np.flatnonzero(self.version[:len(self.ids)] > version).tolist()
+    
+    def shard_rows(self, shard, shards, start, stop):
+        """Rows start..stop-1 that fall in shard (of `shards`), in row order"""
+        return np.flatnonzero(self.id_hash[start:stop] % shards == shard) + start
+    
+    def _current_scores(self):
+        return self.score[:len(self.ids)]
+    
+    def to_arrays(self):
+        """Copy of every column, the building pool and the string columns, for snapshots"""
+        n = len(self.ids)
+        arrays = {name: getattr(self, name)[:n].copy() for name in self.COLUMNS}
+        arrays["building_code"] = self.building_code[:self.building_total].copy()
+        arrays["building_next"] = self.building_next[:self.building_total].copy()
+        arrays["strings"] = [list(self.ids), list(self.owners), list(self.names), list(self.strategies)]
+        arrays["world_version"] = self.world_version
+        return arrays
+    
+    def attach(self, snapshot):
+        """
+        Serve the store straight out of a MappedSnapshot.
+        
+        Columns become views of the mapped records and strings and id
+        lookups decode on first use, so this is O(1) in the world size. Pages
+        are copy-on-write: changes never reach the file.
+        """
+        records = snapshot.records
+        self.capacity = len(records)
+        for name in self.COLUMNS:
+            setattr(self, name, records[name])
+        self.building_total = snapshot.building_total
+        self.building_code = snapshot.building_code
+        self.building_next = snapshot.building_next
+        self.world_version = snapshot.world_version
+        self.ids, self.owners, self.names, self.strategies = (
+            MappedStrings(snapshot, field) for field in range(len(SNAPSHOT_STRING_FIELDS))
+        )
+        self.index = MappedIndex(snapshot, self.ids)
+        self.leaderboard = LeaderboardIndex(self._current_scores)
+        self.leaderboard.defer()
+    
+    def refresh_production(self, row):
+        """Recompute row's cached ai_bonus and production from its building counts"""
+        self.ai_bonus[row] = ai_bonus = 1 + (float(self.ai_level[row]) * 0.1)
+        self.production[row] = self.building_counts[row] @ _unit_production(ai_bonus)
+    
+    def tick_rows(self, rows):
+        """Advance the given rows one cycle in one vectorized pass"""
+        production = self.production[rows]
+        ai_bonus = self.ai_bonus[rows]
+        resources = np.minimum(self.resources[rows] + production, MAX_SAFE_INTEGER)
+        population = self.population[rows]
+        
+        # Population growth
+        fed = resources[:, FOOD] > population * 2
+        growth = np.where(
+            fed,
+            np.trunc(population * 0.05 * ai_bonus),
+            np.trunc(population * 0.02),
+        ).astype(np.int64)
+        population = np.minimum(population + growth, MAX_SAFE_INTEGER)
+        
+        self.resources[rows] = resources
+        self.population[rows] = population
+        # Update score
+        self.score[rows] = np.minimum(self.score[rows] + np.trunc(population / 100).astype(np.int64), MAX_SAFE_INTEGER)
+        self.changed_rows(rows)
+        return production
+    
+    def tick_row(self, row):
+        """Advance one city one cycle with scalar math; returns its production vector"""
+        production = self.production[row]
+        resources = self.resources[row]
+        resources += production
+        np.minimum(resources, MAX_SAFE_INTEGER, out=resources)
+        
+        # Population growth
+        population = int(self.population[row])
+        if int(resources[FOOD]) > population * 2:
+            growth = int(population * 0.05 * float(self.ai_bonus[row]))
+        else:
+            growth = int(population * 0.02)
+        population = min(population + growth, MAX_SAFE_INTEGER)
+        self.population[row] = population
+        
+        # Update score
+        self.score[row] = min(int(self.score[row]) + int(population / 100), MAX_SAFE_INTEGER)
+        self.changed(row)
+        return production.copy()
+    
+    def catch_up_row(self, row, ticks):
+        """
+        tick_row() applied `ticks` times, without stepping through every cycle.
+        
+        While population holds still, resources and score grow linearly, so a
+        stationary stretch is applied in one jump, up to the cycle where food
+        next crosses the 2 x population threshold. Population only moves until
+        it saturates or truncation stalls its growth (a few thousand cycles
+        from any start), and only those cycles are stepped one at a time.
+        """
+        if ticks <= 1:
+            return self.tick_row(row) if ticks == 1 else np.zeros(len(RESOURCE_NAMES), dtype=np.int64)
+        production = self.production[row].tolist()
+        resources = self.resources[row].tolist()
+        population = int(self.population[row])
+        score = int(self.score[row])
+        ai_bonus = float(self.ai_bonus[row])
+        
+        done = 0
+        while done < ticks:
+            fed = min(resources[FOOD] + production[FOOD], MAX_SAFE_INTEGER) > population * 2
+            if fed:
+                growth = int(population * 0.05 * ai_bonus)
+            else:
+                growth = int(population * 0.02)
+            grown = min(population + growth, MAX_SAFE_INTEGER)
+            if grown != population:
+                resources = [min(r + p, MAX_SAFE_INTEGER) for r, p in zip(resources, production)]
+                population = grown
+                score = min(score + int(population / 100), MAX_SAFE_INTEGER)
+                done += 1
+                continue
+            
+            run = ticks - done
+            flip = _food_regime_flip(resources[FOOD], production[FOOD], population, fed)
+            if flip is not None:
+                run = min(run, flip - 1)
+            resources = [min(r + run * p, MAX_SAFE_INTEGER) for r, p in zip(resources, production)]
+            score = min(score + run * int(population / 100), MAX_SAFE_INTEGER)
+            done += run
+        
+        self.resources[row] = resources
+        self.population[row] = population
+        self.score[row] = score
+        self.changed(row)
+        return self.production[row].copy()
+    
+    def tick(self):
+        """Advance every city one cycle; returns the [city, resource] production"""
+        return self.tick_rows(np.arange(len(self.ids)))
+    
+    def top(self, k):
+        """Rows of the k highest scores, ties in creation order"""
+        return self.leaderboard.top(k)
+
+
+class CityView(MutableMapping):
+    """Live dict-like view of one city row in a CityStore"""
+    
+    __slots__ = ("store", "row")
+    
+    _FIELDS = ("id", "owner", "name", "level", "population", "resources",
+               "buildings", "building_total", "score", "ai_level", "strategy", "created_at")
+    _STRINGS = {"owner": "owners", "name": "names", "strategy": "strategies"}
+    _NUMBERS = ("level", "population", "score", "created_at")
+    
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+    
+    def __getitem__(self, key):
+        store, row = self.store, self.row
+        if key == "id":
+            return store.ids[row]
+        if key in self._STRINGS:
+            return getattr(store, self._STRINGS[key])[row]
+        if key in self._NUMBERS:
+            return int(getattr(store, key)[row])
+        if key == "ai_level":
+            return _json_number(store.ai_level[row])
+        if key == "resources":
+            return ResourceView(store, row)
+        if key == "buildings":
+            return store.building_summary(row)
+        if key == "building_total":
+            return int(store.building_counts[row].sum())
+        raise KeyError(key)
+    
+    def __setitem__(self, key, value):
+        store, row = self.store, self.row
+        if key in self._STRINGS:
+            getattr(store, self._STRINGS[key])[row] = value
+        elif key in self._NUMBERS:
+            getattr(store, key)[row] = value
+        elif key == "ai_level":
+            store.ai_level[row] = value
+            store.refresh_production(row)
+        elif key == "resources":
+            store.resources[row] = [value[r] for r in RESOURCE_NAMES]
+        else:
+            raise KeyError(f"{key!r} cannot be assigned on a stored city")
+        store.changed(row)
+    
+    def __delitem__(self, key):
+        raise TypeError("stored cities have a fixed set of fields")
+    
+    def __iter__(self):
+        return iter(self._FIELDS)
+    
+    def __len__(self):
+        return len(self._FIELDS)
+    
+    def to_dict(self):
+        return self.store.city_dict(self.row)
+
+
+class ResourceView(MutableMapping):
+    """Live dict-like view of one city's resources column"""
+    
+    __slots__ = ("store", "row")
+    
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+    
+    def __getitem__(self, resource):
+        return int(self.store.resources[self.row, RESOURCE_INDEX[resource]])
+    
+    def __setitem__(self, resource, value):
+        self.store.resources[self.row, RESOURCE_INDEX[resource]] = value
+        self.store.changed(self.row)
+    
+    def __delitem__(self, resource):
+        raise TypeError("stored cities have a fixed set of resources")
+    
+    def __iter__(self):
+        return iter(RESOURCE_NAMES)
+    
+    def __len__(self):
+        return len(RESOURCE_NAMES)
+
+
+class CityResources(Mapping):
+    """game_state["resources"]: city_id -> ResourceView"""
+    
+    def __init__(self, store):
+        self.store = store
+    
+    def __getitem__(self, city_id):
+        return ResourceView(self.store, self.store.index[city_id])
+    
+    def __iter__(self):
+        return iter(self.store)
+    
+    def __len__(self):
+        return len(self.store)
+
+
+cities = CityStore()
 
 # Game State
 game_state = {
-    "cities": {},
-    "resources": {},
+    "cities": cities,
+    "resources": CityResources(cities),
     "leaderboard": []
 }
 
-# Resource templates
-RESOURCES = {
-    "gold": {"emoji": "💰", "name": "Gold"},
-    "wood": {"emoji": "🪵", "name": "Wood"},
-    "stone": {"emoji": "🪨", "name": "Stone"},
-    "food": {"emoji": "🍎", "name": "Food"},
-    "energy": {"emoji": "⚡", "name": "Energy"},
-}
 
-BUILDINGS = {
-    "house": {"emoji": "🏠", "name": "House", "cost": {"gold": 100, "wood": 50, "stone": 25}, "production": {}, "bonus": {"population": 50}},
-    "farm": {"emoji": "🌾", "name": "Farm", "cost": {"gold": 50, "wood": 100, "stone": 0}, "production": {"food": 10}, "bonus": {"population": 10}},
-    "mine": {"emoji": "⛏️", "name": "Mine", "cost": {"gold": 200, "wood": 50, "stone": 100}, "production": {"gold": 5, "stone": 10}, "bonus": {}},
-    "lumber_mill": {"emoji": "🪚", "name": "Lumber Mill", "cost": {"gold": 100, "wood": 50, "stone": 25}, "production": {"wood": 15}, "bonus": {}},
-    "power_plant": {"emoji": "⚡", "name": "Power Plant", "cost": {"gold": 300, "wood": 100, "stone": 150}, "production": {"energy": 20}, "bonus": {}},
-    "factory": {"emoji": "🏭", "name": "Factory", "cost": {"gold": 500, "wood": 250, "stone": 200}, "production": {"gold": 15}, "bonus": {}},
+class SimulatedClock:
+    """A wall clock that only moves when told to, for reproducible runs"""
+    
+    def __init__(self, start):
+        self.now = float(start)
+    
+    def __call__(self):
+        return self.now
+    
+    def advance(self, seconds):
+        self.now += seconds
+
+
+# Where the simulation gets randomness and wall-clock time; seed_simulation()
+# makes both reproducible. Scheduling and timeouts keep using the real clocks.
+sim_random = random.Random()
+sim_clock = time.time
+simulation_seed = None
+
+SIMULATION_EPOCH = 1_700_000_000
+
+
+def seed_simulation(seed, start=SIMULATION_EPOCH):
+    """Seed sim_random and freeze sim_clock at start, so the same requests build the same world"""
+    global sim_clock, simulation_seed
+    simulation_seed = seed
+    sim_random.seed(seed)
+    sim_clock = SimulatedClock(start)
+
+
+def create_city(data):
+    """
+    Create (or reset) a city from a create_city payload; caller holds state_lock.
+    
+    Raises ValueError, having changed and logged nothing, for a bad payload.
+    """
+    city_id = data.get("address", f"city_{sim_random.randint(1000,9999)}")
+    
+    record = {
+        "op": "create_city",
+        "city_id": city_id,
+        "owner": data.get("address", "anonymous"),
+        "name": data.get("name", "My City"),
+        "ai_level": data.get("ai_level", 1),
+        "strategy": data.get("strategy", "balanced"),
+        "created_at": int(sim_clock()),
+    }
+    replay_action(record)
+    journal(record)
+    return city_id
+
+
+def build(city_id, building_type):
+    """Apply one build; caller holds state_lock.for_city(city_id). Returns (status, payload)."""
+    if not isinstance(building_type, str) or building_type not in BUILDING_INDEX:
+        return 400, {"error": f"Unknown building type: {building_type!r}"}
+    row = cities.row_of(city_id)
+    if row is None:
+        return 404, {"error": "City not found"}
+    
+    cost = BUILDINGS[building_type]["cost"]
+    resources = cities.resources[row]
+    
+    # Check resources
+    for resource, amount in cost.items():
+        if resources[RESOURCE_INDEX[resource]] < amount:
+            return 400, {"error": f"Insufficient {resource}"}
+    
+    # Deduct resources, add the building, population bonus and score
+    cities.build(row, BUILDING_INDEX[building_type])
+    journal({"op": "build", "city_id": city_id, "building_type": building_type})
+    
+    return 200, {
+        "status": "success",
+        "building_id": f"building_{int(cities.building_seq[row])}",
+        "city": cities.city_dict(row),
+    }
+
+
+MAX_BATCH_BUILDINGS = 10000
+
+# Resources some building's cost names; build() checks exactly these
+_COST_CHECKED = np.array([any(r in BUILDINGS[b]["cost"] for b in BUILDING_TYPES) for r in RESOURCE_NAMES])
+
+
+def _batch_operations(operations):
+    """Normalize build_batch input to (city_id, building_type, count) triples; raises ValueError"""
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations must be a non-empty list")
+    parsed = []
+    for op in operations:
+        if isinstance(op, dict):
+            op = (op.get("city_id"), op.get("building_type"), op.get("count", 1))
+        if not isinstance(op, (list, tuple)) or len(op) != 3:
+            raise ValueError("each operation is {city_id, building_type, count} or [city_id, building_type, count]")
+        city_id, building_type, count = op
+        if not isinstance(building_type, str) or building_type not in BUILDING_INDEX:
+            raise ValueError(f"Unknown building type: {building_type!r}")
+        if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+            raise ValueError("count must be a positive integer")
+        parsed.append((city_id, building_type, count))
+    if sum(count for _, _, count in parsed) > MAX_BATCH_BUILDINGS:
+        raise ValueError(f"a batch builds at most {MAX_BATCH_BUILDINGS} buildings")
+    return parsed
+
+
+def build_batch(operations):
+    """
+    Apply many builds atomically. Returns (status, payload).
+    
+    Costs are summed per city and checked in one pass. Costs never go
+    negative, so the batch is affordable exactly when its last build would
+    be, whatever the order. Either every build is applied, and journaled as
+    one action, or none is. Takes the shard locks of the cities named, so
+    the caller must hold none.
+    """
+    try:
+        operations = _batch_operations(operations)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    
+    with state_lock.for_cities(city_id for city_id, _, _ in operations):
+        return _apply_batch(operations)
+
+
+def _apply_batch(operations):
+    rows = []
+    for city_id, _, _ in operations:
+        row = cities.row_of(city_id)
+        if row is None:
+            return 404, {"error": "City not found", "city_id": city_id}
+        rows.append(row)
+    type_codes = np.array([BUILDING_INDEX[building_type] for _, building_type, _ in operations])
+    counts = np.array([count for _, _, count in operations], dtype=np.int64)
+    
+    touched, slot = np.unique(rows, return_inverse=True)
+    totals = np.zeros((len(touched), len(RESOURCE_NAMES)), dtype=np.int64)
+    np.add.at(totals, slot, COST_TABLE[type_codes] * counts[:, None])
+    short = (cities.resources[touched] < totals) & _COST_CHECKED
+    if short.any():
+        city, resource = np.argwhere(short)[0]
+        return 400, {
+            "error": f"Insufficient {RESOURCE_NAMES[resource]}",
+            "city_id": cities.ids[int(touched[city])],
+            "needed": int(totals[city, resource]),
+            "available": int(cities.resources[touched[city], resource]),
+        }
+    
+    for row, (city_id, building_type, count) in zip(rows, operations):
+        cities.build_many(row, BUILDING_INDEX[building_type], count)
+    journal({"op": "build_batch", "builds": [list(op) for op in operations]})
+    
+    return 200, {
+        "status": "success",
+        "built": int(counts.sum()),
+        "cities": {
+            cities.ids[row]: {
+                "resources": cities.resources_of(row),
+                "population": int(cities.population[row]),
+                "score": int(cities.score[row]),
+                "building_total": int(cities.building_counts[row].sum()),
+            }
+            for row in touched.tolist()
+        },
+    }
+
+
+MAX_CATCH_UP_TICKS = 10 ** 9
+
+
+def tick_city(city_id, ticks=1):
+    """
+    Advance one city by `ticks` cycles; caller holds state_lock.for_city(city_id).
+    Returns (status, payload).
+    
+    The payload's "production" is per cycle; it is constant across a catch-up.
+    """
+    row = cities.row_of(city_id)
+    if row is None:
+        return 404, {"error": "City not found"}
+    if isinstance(ticks, bool) or not isinstance(ticks, int) or not 1 <= ticks <= MAX_CATCH_UP_TICKS:
+        return 400, {"error": f"ticks must be an integer from 1 to {MAX_CATCH_UP_TICKS}"}
+    
+    if ticks == 1:
+        production = cities.tick_row(row)
+        journal({"op": "tick", "city_id": city_id})
+    else:
+        production = cities.catch_up_row(row, ticks)
+        journal({"op": "tick", "city_id": city_id, "ticks": ticks})
+    payload = {
+        "status": "success",
+        "city": cities.city_dict(row),
+        "production": dict(zip(RESOURCE_NAMES, production.tolist())),
+    }
+    if ticks != 1:
+        payload["ticks"] = ticks
+    return 200, payload
+
+
+def rendered(rows, render):
+    """
+    [render(row) for row in rows], rendering each row under its shard's lock.
+    
+    Rows are grouped by shard and each shard's lock is taken once, so a
+    reader of many cities holds one shard at a time and every city it
+    returns is a consistent snapshot of that city. The caller holds no
+    shard locks, or all of them.
+    """
+    rows = list(rows)
+    out = [None] * len(rows)
+    shards = cities.id_hash[rows] % len(state_lock)
+    for shard in np.unique(shards).tolist():
+        with state_lock.shard(shard):
+            for i in np.flatnonzero(shards == shard).tolist():
+                out[i] = render(rows[i])
+    return out
+
+
+def _row_document(row):
+    resources = cities.resources_of(row)
+    return cities.ids[row], resources, cities.city_dict(row, resources)
+
+
+def state_document(rows=None):
+    """cities.state_document(rows), rendered shard by shard; the caller holds no shard locks"""
+    document = {"cities": {}, "resources": {}, "leaderboard": []}
+    for city_id, resources, city in rendered(range(len(cities)) if rows is None else rows, _row_document):
+        document["resources"][city_id] = resources
+        document["cities"][city_id] = city
+    return document
+
+
+CITY_BUILDINGS_LIMIT = 1000
+
+
+def city_buildings(city_id, offset=0, limit=CITY_BUILDINGS_LIMIT):
+    """One page of a city's buildings in build order; the caller holds no shard locks. Returns (status, payload)."""
+    row = cities.row_of(city_id)
+    if row is None:
+        return 404, {"error": "City not found"}
+    offset, limit = max(0, offset), max(0, min(limit, CITY_BUILDINGS_LIMIT))
+    with state_lock.for_city(city_id):
+        total = int(cities.building_counts[row].sum())
+        buildings = cities.buildings_of(row, offset, limit)
+    payload = {"city_id": city_id, "total": total, "offset": offset, "buildings": buildings}
+    if offset + len(buildings) < total:
+        payload["next_offset"] = offset + len(buildings)
+    return 200, payload
+
+
+def leaderboard_top(limit=10):
+    """Top cities by score, highest first; the caller holds no shard locks"""
+    return rendered(cities.top(max(0, limit)), cities.city_dict)
+
+
+def leaderboard_rank(city_id):
+    """1-based rank of one city; the caller holds no shard locks. Returns (status, payload)."""
+    row = cities.row_of(city_id)
+    if row is None:
+        return 404, {"error": "City not found"}
+    rank, score = cities.leaderboard.placing(row)
+    return 200, {
+        "city_id": city_id,
+        "rank": rank + 1,
+        "score": score,
+        "total": len(cities),
+    }
+
+
+def leaderboard_around(city_id, radius=5):
+    """Cities ranked within radius of city_id; the caller holds no shard locks. Returns (status, payload)."""
+    row = cities.row_of(city_id)
+    if row is None:
+        return 404, {"error": "City not found"}
+    rank, rows = cities.leaderboard.around(row, max(0, radius))
+    return 200, {
+        "city_id": city_id,
+        "rank": rank + 1,
+        "first_rank": max(0, rank - radius) + 1,
+        "cities": rendered(rows, cities.city_dict),
+    }
+
+
+def settled_version():
+    """
+    The world version, once every shard has finished any change in flight.
+    
+    Every change stamped at most the returned version is visible to reads
+    made after this returns; the caller holds no shard locks.
+    """
+    current = cities.world_version
+    for shard in range(len(state_lock)):
+        with state_lock.shard(shard):
+            pass
+    return current
+
+
+def state_since(version):
+    """
+    Cities changed after world version `version`, plus the cursor to poll with next.
+    
+    The caller holds no shard locks. A cursor of 0 (first sync) or one newer
+    than the world (issued before a restart without persistence) gets every
+    city, with "full" set so the client replaces its copy rather than merging
+    into it.
+    
+    Shards move on while a delta is rendered, so the returned version is read
+    first and every shard is passed once (finishing any change in flight)
+    before rows are picked. A change is then either stamped at most that
+    version and included, or newer and included in the next delta as well.
+    """
+    current = settled_version()
+    full = version <= 0 or version > current
+    document = state_document(None if full else cities.changed_since(version))
+    document["version"] = current
+    document["full"] = full
+    return document
+
+
+STATE_PAGE_LIMIT = 1000
+STATE_PAGE_MAX = 10000
+
+
+def state_page(cursor=0, limit=STATE_PAGE_LIMIT):
+    """
+    One page of the world in row order; the caller holds no shard locks.
+    
+    Rows are never reused, so the cursor (a row number) stays valid while
+    cities are added. "next_cursor" is None on the last page.
+    """
+    if cursor < 0 or limit < 1:
+        raise ValueError("cursor must be >= 0 and limit >= 1")
+    stop = min(len(cities), cursor + min(limit, STATE_PAGE_MAX))
+    document = state_document(range(cursor, stop))
+    document["version"] = cities.world_version
+    document["next_cursor"] = stop if stop < len(cities) else None
+    return document
+
+
+EXPORT_BATCH_ROWS = 512
+
+
+def state_chunks(batch_rows=EXPORT_BATCH_ROWS):
+    """
+    Encode the full state document incrementally, batch_rows cities per chunk.
+    
+    Yields the same bytes json.dumps(cities.state_document()) would produce,
+    but only ever holds one batch in memory. Each city is rendered under its
+    shard's lock, so callers must hold none; cities changed mid-export may
+    appear at different versions in "cities" and "resources". Fetching
+    ?since= the version seen at the start reconciles them.
+    """
+    count = len(cities)
+    yield b'{"cities": {'
+    yield from _encoded_rows(cities.city_dict, count, batch_rows)
+    yield b'}, "resources": {'
+    yield from _encoded_rows(cities.resources_of, count, batch_rows)
+    yield b'}, "leaderboard": []}'
+
+
+def _encoded_rows(encode, count, batch_rows):
+    def render(row):
+        return f"{json.dumps(cities.ids[row])}: {json.dumps(encode(row))}"
+    
+    for start in range(0, count, batch_rows):
+        parts = rendered(range(start, min(count, start + batch_rows)), render)
+        yield ((", " if start else "") + ", ".join(parts)).encode()
+
+
+POST_ACTIONS = frozenset({
+    "/api/game/create_city", "/api/game/build", "/api/game/build_batch", "/api/game/tick", "/api/game/tick_all",
+})
+
+
+def post_action(path, data):
+    """
+    Apply one POST request (path in POST_ACTIONS, data its decoded JSON body).
+    
+    Takes the locks the action needs and waits until it is durable, so the
+    caller holds none. Returns (status, payload). GameHandler.do_POST is a
+    thin wrapper around this, and replay tools call it directly to run
+    recorded requests without sockets.
+    """
+    if path == "/api/game/create_city":
+        if not isinstance(data, dict):
+            return 400, {"error": "expected a JSON object"}
+        try:
+            with state_lock:
+                city_id = create_city(data)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        wait_durable()
+        return 200, {"status": "success", "city_id": city_id}
+    
+    if path == "/api/game/build":
+        city_id = data.get("city_id")
+        with state_lock.for_city(city_id):
+            status, payload = build(city_id, data.get("building_type"))
+        wait_durable()
+        return status, payload
+    
+    if path == "/api/game/build_batch":
+        status, payload = build_batch(data.get("operations") if isinstance(data, dict) else data)
+        wait_durable()
+        return status, payload
+    
+    if path == "/api/game/tick":
+        city_id = data.get("city_id")
+        with state_lock.for_city(city_id):
+            status, payload = tick_city(city_id, data.get("ticks", 1))
+        wait_durable()
+        return status, payload
+    
+    if path == "/api/game/tick_all":
+        started = time.perf_counter()
+        with state_lock:
+            count = tick_world()
+        wait_durable()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        return 200, {"status": "success", "cities": count, "elapsed_ms": round(elapsed_ms, 3)}
+    
+    raise ValueError(f"Unknown action: {path}")
+
+
+def export_state(out, batch_rows=EXPORT_BATCH_ROWS):
+    """Write the full state document to a binary file object; returns bytes written"""
+    written = 0
+    for chunk in state_chunks(batch_rows):
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def tick_world():
+    """
+    Advance every city one cycle in a single vectorized pass.
+    
+    Caller holds state_lock. Uses exactly the per-city rules of tick_city().
+    """
+    cities.tick()
+    journal({"op": "tick_world"})
+    return len(cities)
+
+
+def tick_slice(shard, start, stop):
+    """
+    Advance shard's rows among start..stop-1 one cycle (a TickScheduler step).
+    
+    Caller holds state_lock.shard(shard). Rows are picked under the lock, so
+    a city being created concurrently is never half-counted.
+    """
+    shards = len(state_lock)
+    rows = cities.shard_rows(shard, shards, start, stop)
+    if len(rows):
+        cities.tick_rows(rows)
+        journal({"op": "tick_rows", "start": start, "stop": stop, "shard": shard, "shards": shards})
+
+
+# ═══════════════════════════════════════════════════════════════
+#    Persistence: action log + snapshots
+# ═══════════════════════════════════════════════════════════════
+
+def replay_action(record):
+    """Apply one logged action to the store; caller holds state_lock"""
+    op = record["op"]
+    if op == "create_city":
+        cities.create(record["city_id"], record["owner"], record["name"],
+                      record["ai_level"], record["strategy"], record["created_at"])
+    elif op == "build":
+        # Logs from before per-city building ids also carry the random "number" given out
+        cities.build(cities.index[record["city_id"]], BUILDING_INDEX[record["building_type"]])
+    elif op == "build_batch":
+        for city_id, building_type, count in record["builds"]:
+            if isinstance(count, list):
+                count = len(count)
+            cities.build_many(cities.index[city_id], BUILDING_INDEX[building_type], count)
+    elif op == "tick":
+        cities.catch_up_row(cities.index[record["city_id"]], record.get("ticks", 1))
+    elif op == "tick_world":
+        cities.tick()
+    elif op == "tick_rows":
+        if "shard" in record:
+            rows = cities.shard_rows(record["shard"], record["shards"], record["start"], record["stop"])
+        else:
+            rows = np.arange(record["start"], record["stop"])
+        cities.tick_rows(rows)
+    else:
+        raise ValueError(f"Unknown action in log: {op!r}")
+
+
+class ActionLog:
+    """
+    Append-only JSON-lines log of applied actions, written with group commit.
+    
+    append() only queues a record and is cheap enough to call under the
+    shard locks of the cities it touches, which keeps log order identical to
+    apply order on every shard. Actions on different shards commute, so
+    their relative order does not change a replay. A flusher
+    thread writes everything queued so far with one write() and one fsync(),
+    and wait() blocks a request until its record is on disk, so concurrent
+    requests share fsyncs. The log is split into segments named after their
+    first sequence number; rotate() starts a new one at snapshot time so
+    older segments can be deleted.
+    """
+    
+    def __init__(self, directory, next_seq=1, commit_delay=0.002):
+        self.directory = directory
+        self.commit_delay = commit_delay
+        self.batches = 0
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._pending = []
+        self._next_seq = next_seq
+        self._durable_seq = next_seq - 1
+        self._closing = False
+        self._error = None
+        # Called from the flusher with the highest durable seq after each fsync
+        self.on_durable = None
+        self._file = self._open_segment(next_seq)
+        self._thread = threading.Thread(target=self._run, name="action-log", daemon=True)
+        self._thread.start()
+    
+    @staticmethod
+    def segment_path(directory, first_seq):
+        return os.path.join(directory, f"actions-{first_seq:012d}.log")
+    
+    @staticmethod
+    def segments(directory):
+        """(first_seq, path) of every segment, oldest first"""
+        found = []
+        for name in os.listdir(directory):
+            if name.startswith("actions-") and name.endswith(".log"):
+                found.append((int(name[8:-4]), os.path.join(directory, name)))
+        return sorted(found)
+    
+    @staticmethod
+    def read(path):
+        """Records of one segment; stops at a torn final line"""
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+    
+    def _open_segment(self, first_seq):
+        # A file already named after first_seq can only hold a torn record
+        return open(self.segment_path(self.directory, first_seq), "wb")
+    
+    @property
+    def last_seq(self):
+        return self._next_seq - 1
+    
+    def append(self, record):
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pending.append(json.dumps({"seq": seq, **record}).encode() + b"\n")
+            self._cond.notify_all()
+        return seq
+    
+    def wait(self, seq):
+        with self._cond:
+            while self._durable_seq < seq and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+    
+    def _write_pending(self):
+        """Write and fsync everything queued so far; holds _io_lock"""
+        with self._cond:
+            batch, self._pending = self._pending, []
+            last = self._next_seq - 1
+        if batch:
+            self._file.write(b"".join(batch))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.batches += 1
+        with self._cond:
+            self._durable_seq = max(self._durable_seq, last)
+            self._cond.notify_all()
+        if self.on_durable is not None:
+            self.on_durable(last)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if self._closing and not self._pending:
+                    return
+            # Let concurrent requests join this commit
+            if self.commit_delay:
+                time.sleep(self.commit_delay)
+            try:
+                with self._io_lock:
+                    self._write_pending()
+            except OSError as exc:
+                with self._cond:
+                    self._error = exc
+                    self._cond.notify_all()
+                return
+    
+    def rotate(self):
+        """Flush and close the current segment and start the next one"""
+        with self._io_lock:
+            self._write_pending()
+            self._file.close()
+            self._file = self._open_segment(self._next_seq)
+    
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._io_lock:
+            self._write_pending()
+            self._file.close()
+
+
+# Binary snapshot layout, all little-endian, sections 4 KiB aligned:
+#   header | city records | building runs | building links | string table | id hash table
+# Each city record holds every CityStore column plus (offset, length) refs
+# into the string table for id, owner, name and strategy. A length with
+# _JSON_STRING set marks a non-string value stored as JSON text. The hash
+# table maps crc32(id) by linear probing to row + 1 (0 = empty).
+SNAPSHOT_MAGIC = b"AICITY\x00\x04"
+SNAPSHOT_STRING_FIELDS = ("id", "owner", "name", "strategy")
+_SNAPSHOT_HEADER = struct.Struct("<8s7Q7Q")
+_SNAPSHOT_ALIGN = 4096
+_JSON_STRING = 1 << 63
+CITY_RECORD = np.dtype(
+    [(name, dtype, shape) for name, (dtype, shape) in CityStore.COLUMNS.items()]
+    + [("strings", np.uint64, (len(SNAPSHOT_STRING_FIELDS), 2))],
+    align=True,
+)
+
+
+def _encode_string(value):
+    if type(value) is str:
+        return value.encode("utf-8"), False
+    return json.dumps(value).encode("utf-8"), True
+
+
+def _align(offset):
+    return -(-offset // _SNAPSHOT_ALIGN) * _SNAPSHOT_ALIGN
+
+
+def write_snapshot(path, arrays, seq):
+    """Write CityStore.to_arrays() output as a binary snapshot at log sequence seq"""
+    n = len(arrays["strings"][0])
+    # Headroom so new cities fit in the mapped records without a copy
+    capacity = max(1024, n + n // 4)
+    records = np.zeros(capacity, dtype=CITY_RECORD)
+    for name in CityStore.COLUMNS:
+        records[name][:n] = arrays[name]
+    
+    table = []
+    table_size = 0
+    id_hashes = None
+    for field, values in enumerate(arrays["strings"]):
+        encoded = [_encode_string(value) for value in values]
+        lengths = np.fromiter((len(data) for data, _ in encoded), dtype=np.uint64, count=n)
+        flags = np.fromiter((is_json for _, is_json in encoded), dtype=bool, count=n)
+        offsets = np.cumsum(lengths) - lengths + np.uint64(table_size)
+        records["strings"][:n, field, 0] = offsets
+        records["strings"][:n, field, 1] = lengths | (flags.astype(np.uint64) << np.uint64(63))
+        table.extend(data for data, _ in encoded)
+        table_size += int(lengths.sum())
+        if field == 0:
+            id_hashes = np.fromiter((zlib.crc32(data) for data, _ in encoded), dtype=np.int64, count=n)
+    
+    # Linear probing, placed in vectorized rounds
+    slots = 1 << max(10, (2 * n).bit_length())
+    hash_table = np.zeros(slots, dtype=np.int64)
+    pending = np.arange(n)
+    position = id_hashes & (slots - 1)
+    while len(pending):
+        free = hash_table[position] == 0
+        taken, first = np.unique(position[free], return_index=True)
+        hash_table[taken] = pending[free][first] + 1
+        placed = np.zeros(len(pending), dtype=bool)
+        placed[np.flatnonzero(free)[first]] = True
+        pending = pending[~placed]
+        position = (position[~placed] + 1) & (slots - 1)
+    
+    building_capacity = max(1024, arrays["building_code"].size * 5 // 4)
+    building_code = np.zeros(building_capacity, dtype=np.uint32)
+    building_next = np.zeros(building_capacity, dtype=np.int64)
+    building_code[:arrays["building_code"].size] = arrays["building_code"]
+    building_next[:arrays["building_next"].size] = arrays["building_next"]
+    
+    records_off = _align(_SNAPSHOT_HEADER.size)
+    codes_off = _align(records_off + records.nbytes)
+    links_off = _align(codes_off + building_code.nbytes)
+    strings_off = _align(links_off + building_next.nbytes)
+    index_off = _align(strings_off + table_size)
+    header = _SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, seq, arrays["world_version"], n, capacity,
+        len(arrays["building_code"]), building_capacity, slots, records_off,
+        codes_off, links_off, strings_off, table_size, index_off, CITY_RECORD.itemsize,
+    )
+    
+    with open(path + ".tmp", "wb") as f:
+        for offset, chunk in ((0, header), (records_off, records), (codes_off, building_code),
+                              (links_off, building_next), (strings_off, None), (index_off, hash_table)):
+            f.write(b"\x00" * (offset - f.tell()))
+            if chunk is None:
+                for data in table:
+                    f.write(data)
+            else:
+                f.write(chunk if isinstance(chunk, bytes) else chunk.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class MappedSnapshot:
+    """A binary snapshot mapped copy-on-write; nothing is parsed up front"""
+    
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        (magic, self.seq, self.world_version, self.count, capacity, self.building_total, building_capacity, slots,
+         records_off, codes_off, links_off, self._strings_off, _, index_off, record_size) = \
+            _SNAPSHOT_HEADER.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC or record_size != CITY_RECORD.itemsize:
+            raise ValueError(f"{path} is not a compatible city snapshot")
+        self.records = np.frombuffer(self._mmap, dtype=CITY_RECORD, count=capacity, offset=records_off)
+        self.building_code = np.frombuffer(self._mmap, dtype=np.uint32, count=building_capacity, offset=codes_off)
+        self.building_next = np.frombuffer(self._mmap, dtype=np.int64, count=building_capacity, offset=links_off)
+        self._hash_table = np.frombuffer(self._mmap, dtype=np.int64, count=slots, offset=index_off)
+        self._refs = self.records["strings"]
+    
+    def string(self, row, field):
+        offset, length = self._refs[row, field].tolist()
+        start = self._strings_off + offset
+        data = self._mmap[start:start + (length & ~_JSON_STRING)]
+        return json.loads(data) if length & _JSON_STRING else data.decode("utf-8")
+    
+    def lookup(self, city_id, ids):
+        """Row of city_id among the snapshot's cities, or None"""
+        return _probe(self._hash_table, city_id, ids)[0]
+
+
+def _probe(hash_table, city_id, ids):
+    """(row of city_id or None, slot where it is or would go) in a crc32 linear-probing table"""
+    mask = len(hash_table) - 1
+    position = city_hash(city_id) & mask
+    while True:
+        row = int(hash_table[position]) - 1
+        if row < 0:
+            return None, position
+        # A row still being created by another process has no id yet
+        if row < len(ids) and ids[row] == city_id:
+            return row, position
+        position = (position + 1) & mask
+
+
+class MappedStrings:
+    """One string column of a MappedSnapshot, decoded (and kept) on first access"""
+    
+    def __init__(self, snapshot, field):
+        self._snapshot = snapshot
+        self._field = field
+        self._count = snapshot.count
+        self._loaded = {}
+        self._appended = []
+    
+    def __len__(self):
+        return self._count + len(self._appended)
+    
+    def __getitem__(self, row):
+        if row >= self._count:
+            return self._appended[row - self._count]
+        value = self._loaded.get(row)
+        if value is None:
+            value = self._loaded[row] = self._snapshot.string(row, self._field)
+        return value
+    
+    def __setitem__(self, row, value):
+        if row >= self._count:
+            self._appended[row - self._count] = value
+        else:
+            self._loaded[row] = value
+    
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+    
+    def append(self, value):
+        self._appended.append(value)
+
+
+class MappedIndex:
+    """city_id -> row over a MappedSnapshot's hash table, plus cities created since"""
+    
+    def __init__(self, snapshot, ids):
+        self._snapshot = snapshot
+        self._ids = ids
+        self._known = {}
+    
+    def get(self, city_id, default=None):
+        row = self._known.get(city_id)
+        if row is None:
+            row = self._snapshot.lookup(city_id, self._ids)
+            if row is None:
+                return default
+            self._known[city_id] = row
+        return row
+    
+    def __getitem__(self, city_id):
+        row = self.get(city_id)
+        if row is None:
+            raise KeyError(city_id)
+        return row
+    
+    def __contains__(self, city_id):
+        return self.get(city_id) is not None
+    
+    def __setitem__(self, city_id, row):
+        self._known[city_id] = row
+    
+    def __len__(self):
+        return len(self._ids)
+
+
+class Persistence:
+    """
+    Durable game state for demo_server: an ActionLog plus periodic snapshots.
+    
+    A snapshot is the store's state at one log sequence number, saved in
+    the binary layout of write_snapshot() as snapshot-<seq>.city. Taking one
+    rotates the log, after which older segments and snapshots are deleted.
+    recover() maps the newest snapshot (cities load lazily on first access)
+    and replays only the log tail behind it. An unreadable snapshot is only
+    passed over for an older one the log still covers without gaps.
+    """
+    
+    def __init__(self, directory, snapshot_interval=60.0, commit_delay=0.002):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.commit_delay = commit_delay
+        self.snapshot_seq = 0
+        self.log = None
+        # A SharedJournal in pre-fork mode: every process's actions reach
+        # self.log through it, in one sequence
+        self.shared = None
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._snapshot_lock = threading.Lock()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+    
+    def _snapshots(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith("snapshot-") and name.endswith(".city"):
+                found.append((int(name[9:-5]), os.path.join(self.directory, name)))
+        return sorted(found)
+    
+    def _usable_snapshot(self):
+        """
+        (MappedSnapshot or None, seq) to recover from: the newest snapshot
+        that maps, or an older one (or none) only when the log segments
+        still hold every action after it without gaps, past the unreadable
+        ones. Otherwise nothing is touched and recovery stops.
+        """
+        unreadable = None
+        for seq, path in reversed([(0, None)] + self._snapshots()):
+            snapshot = None
+            if path is not None:
+                try:
+                    snapshot = MappedSnapshot(path)
+                except (OSError, ValueError, struct.error) as exc:
+                    unreadable = unreadable or (seq, path, exc)
+                    continue
+            if unreadable is not None and not self._log_covers(seq, unreadable[0]):
+                lost_seq, lost_path, exc = unreadable
+                raise RuntimeError(
+                    f"snapshot {lost_path} is unreadable ({exc}) and the action log does not hold "
+                    f"actions {seq + 1}..{lost_seq} to rebuild it; restore it or move it aside to "
+                    f"start from what is left")
+            return snapshot, seq
+    
+    def _log_covers(self, seq, through):
+        """Whether the log holds every action after seq, without gaps, to its end and at least through `through`"""
+        for _, path in ActionLog.segments(self.directory):
+            for record in ActionLog.read(path):
+                if record["seq"] <= seq:
+                    continue
+                if record["seq"] != seq + 1:
+                    return False
+                seq += 1
+        return seq >= through
+    
+    def recover(self):
+        """Rebuild the store from disk and open the log; returns (snapshot seq, replayed actions)"""
+        with state_lock:
+            snapshot, self.snapshot_seq = self._usable_snapshot()
+            if snapshot is not None:
+                cities.attach(snapshot)
+            
+            last_seq = self.snapshot_seq
+            replayed = 0
+            for _, path in ActionLog.segments(self.directory):
+                for record in ActionLog.read(path):
+                    if record["seq"] <= last_seq:
+                        continue
+                    replay_action(record)
+                    last_seq = record["seq"]
+                    replayed += 1
+            
+            # Never append after a possibly torn tail: continue in a fresh segment
+            self.log = ActionLog(self.directory, next_seq=last_seq + 1, commit_delay=self.commit_delay)
+        return self.snapshot_seq, replayed
+    
+    def record(self, record):
+        """Queue one applied action; caller holds the locks of the shards it changed"""
+        if self.shared is not None:
+            self.shared.record(record)
+            return
+        self._local.seq = self.log.append(record)
+    
+    def wait(self):
+        """Block until the calling thread's last recorded action is durable"""
+        if self.shared is not None:
+            self.shared.wait()
+            return
+        seq = getattr(self._local, "seq", 0)
+        if seq:
+            self.log.wait(seq)
+            self._local.seq = 0
+    
+    def snapshot(self):
+        """Write a snapshot of the current state; returns its sequence number"""
+        with self._snapshot_lock:
+            with state_lock:
+                if self.shared is not None:
+                    self.shared.drain()
+                seq = self.log.last_seq
+                if seq == self.snapshot_seq:
+                    return seq
+                arrays = cities.to_arrays()
+                self.log.rotate()
+            
+            write_snapshot(os.path.join(self.directory, f"snapshot-{seq:012d}.city"), arrays, seq)
+            self.snapshot_seq = seq
+            
+            for old_seq, old_path in self._snapshots():
+                if old_seq < seq:
+                    os.remove(old_path)
+            for first_seq, old_path in ActionLog.segments(self.directory):
+                if first_seq <= seq:
+                    os.remove(old_path)
+            return seq
+    
+    def start(self):
+        """Begin periodic snapshots"""
+        if self.snapshot_interval > 0:
+            self._thread = threading.Thread(target=self._run, name="snapshotter", daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.snapshot()
+    
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.snapshot()
+        self.log.close()
+
+
+# Set by run_demo when --data-dir is given
+persistence = None
+
+
+def journal(record):
+    """Log an action that was just applied; caller holds the locks of the shards it changed"""
+    if persistence is not None:
+        persistence.record(record)
+
+
+def wait_durable():
+    """Wait until this thread's logged actions are on disk (call without state_lock)"""
+    if persistence is not None:
+        persistence.wait()
+
+
+# ═══════════════════════════════════════════════════════════════
+#    Pre-fork serving: the world in shared memory
+# ═══════════════════════════════════════════════════════════════
+
+# Slots of SharedWorld.counters; _STRING_COUNTS + field counts the values
+# appended to each string column
+_WORLD_VERSION, _BUILDING_TOTAL, _STRING_BYTES, _LOG_SEQ, _DURABLE_SEQ, _BULLETIN_BYTES = range(6)
+_STRING_COUNTS = 8
+_COUNTER_SLOTS = 16
+
+
+class SharedWorld:
+    """
+    City records, building pool, string table and id hash table in one
+    multiprocessing.shared_memory block, laid out like a binary snapshot.
+    
+    Every section is sized up front: a forked process cannot follow a
+    reallocation, so a full world refuses new cities instead of growing.
+    The parent creates the block and the locks guarding its shared counters
+    before forking, and workers inherit both. A small bulletin lets the
+    parent publish a JSON document (scheduler stats) for workers to serve.
+    """
+    
+    _BULLETIN_SIZE = 8192
+    
+    def __init__(self, capacity, building_capacity, string_capacity):
+        slots = 1 << max(10, (2 * capacity).bit_length())
+        bulletin_off = _align(_COUNTER_SLOTS * 8)
+        records_off = _align(bulletin_off + self._BULLETIN_SIZE)
+        codes_off = _align(records_off + capacity * CITY_RECORD.itemsize)
+        links_off = _align(codes_off + building_capacity * 4)
+        strings_off = _align(links_off + building_capacity * 8)
+        index_off = _align(strings_off + string_capacity)
+        self.shm = shared_memory.SharedMemory(create=True, size=index_off + slots * 8)
+        buf = self.shm.buf
+        self.capacity = capacity
+        self.counters = np.ndarray(_COUNTER_SLOTS, dtype=np.int64, buffer=buf)
+        self.bulletin = np.ndarray(self._BULLETIN_SIZE, dtype=np.uint8, buffer=buf, offset=bulletin_off)
+        self.records = np.ndarray(capacity, dtype=CITY_RECORD, buffer=buf, offset=records_off)
+        self.building_code = np.ndarray(building_capacity, dtype=np.uint32, buffer=buf, offset=codes_off)
+        self.building_next = np.ndarray(building_capacity, dtype=np.int64, buffer=buf, offset=links_off)
+        self.strings = np.ndarray(string_capacity, dtype=np.uint8, buffer=buf, offset=strings_off)
+        self.hash_table = np.ndarray(slots, dtype=np.int64, buffer=buf, offset=index_off)
+        self.pool_lock = multiprocessing.Lock()
+        self.version_lock = multiprocessing.Lock()
+        self.bulletin_lock = multiprocessing.Lock()
+        self._refs = self.records["strings"]
+    
+    def string(self, row, field):
+        offset, length = self._refs[row, field].tolist()
+        data = self.strings[offset:offset + (length & ~_JSON_STRING)].tobytes()
+        return json.loads(data) if length & _JSON_STRING else data.decode("utf-8")
+    
+    def set_string(self, row, field, value):
+        """Point row's field at a copy of value; caller holds state_lock. Replaced bytes are not reclaimed."""
+        data, is_json = _encode_string(value)
+        offset = int(self.counters[_STRING_BYTES])
+        if offset + len(data) > len(self.strings):
+            raise RuntimeError("shared string table is full; raise --max-cities")
+        self.strings[offset:offset + len(data)] = np.frombuffer(data, dtype=np.uint8)
+        self.counters[_STRING_BYTES] = offset + len(data)
+        self._refs[row, field] = (offset, len(data) | (_JSON_STRING if is_json else 0))
+    
+    def publish(self, document):
+        """Replace the bulletin with document (as JSON)"""
+        data = json.dumps(document).encode()
+        if len(data) > len(self.bulletin):
+            raise ValueError("bulletin document too large")
+        with self.bulletin_lock:
+            self.bulletin[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+            self.counters[_BULLETIN_BYTES] = len(data)
+    
+    def published(self):
+        with self.bulletin_lock:
+            return json.loads(self.bulletin[:int(self.counters[_BULLETIN_BYTES])].tobytes())
+    
+    def unlink(self):
+        """Remove the block's name; its memory is freed once every process has exited"""
+        self.shm.unlink()
+
+
+class SharedStrings:
+    """One string column of a SharedWorld, as the list CityStore expects"""
+    
+    def __init__(self, world, field):
+        self._world = world
+        self._field = field
+        self._slot = _STRING_COUNTS + field
+        # An id never changes once written, so each process keeps the decoded ones
+        self._cache = {} if field == 0 else None
+    
+    def __len__(self):
+        return int(self._world.counters[self._slot])
+    
+    def __getitem__(self, row):
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        if self._cache is None:
+            return self._world.string(row, self._field)
+        value = self._cache.get(row)
+        if value is None:
+            value = self._cache[row] = self._world.string(row, self._field)
+        return value
+    
+    def __setitem__(self, row, value):
+        self._world.set_string(row, self._field, value)
+        if self._cache is not None:
+            self._cache.pop(row, None)
+    
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+    
+    def append(self, value):
+        row = len(self)
+        self._world.set_string(row, self._field, value)
+        self._world.counters[self._slot] = row + 1
+
+
+class SharedIndex:
+    """city_id -> row over a SharedWorld's hash table"""
+    
+    def __init__(self, world, ids):
+        self._world = world
+        self._ids = ids
+        self._known = {}
+    
+    def get(self, city_id, default=None):
+        row = self._known.get(city_id)
+        if row is None:
+            row = _probe(self._world.hash_table, city_id, self._ids)[0]
+            if row is None:
+                return default
+            self._known[city_id] = row
+        return row
+    
+    def __getitem__(self, city_id):
+        row = self.get(city_id)
+        if row is None:
+            raise KeyError(city_id)
+        return row
+    
+    def __contains__(self, city_id):
+        return self.get(city_id) is not None
+    
+    def __setitem__(self, city_id, row):
+        found, slot = _probe(self._world.hash_table, city_id, self._ids)
+        if found is None:
+            self._world.hash_table[slot] = row + 1
+        self._known[city_id] = row
+    
+    def __len__(self):
+        return len(self._ids)
+
+
+class SharedCityStore(CityStore):
+    """
+    CityStore over a SharedWorld, so every pre-fork process serves one world.
+    
+    The counters CityStore keeps as attributes (world_version,
+    building_total) are shared cells, and the pool and version locks are
+    process-shared. The leaderboard index is per process. Before each read
+    it marks the rows whose shared version moved since the last one, so it
+    follows other processes' writes row by row and only re-sorts when most
+    of the world moved at once.
+    """
+    
+    def __init__(self, world):
+        self.world = world
+        self.capacity = world.capacity
+        for name in self.COLUMNS:
+            setattr(self, name, world.records[name])
+        self.building_code = world.building_code
+        self.building_next = world.building_next
+        self.ids, self.owners, self.names, self.strategies = (
+            SharedStrings(world, field) for field in range(len(SNAPSHOT_STRING_FIELDS))
+        )
+        self.index = SharedIndex(world, self.ids)
+        self._pool_lock = world.pool_lock
+        self._version_lock = world.version_lock
+        self._ranked_version = -1
+        self.leaderboard = LeaderboardIndex(self._current_scores, sync=self._mark_moved)
+        self.leaderboard.defer()
+    
+    @classmethod
+    def from_arrays(cls, world, arrays):
+        """A store over world holding CityStore.to_arrays() output"""
+        ids = arrays["strings"][0]
+        total = len(arrays["building_code"])
+        if len(ids) > world.capacity or total > len(world.building_code):
+            raise ValueError("the world does not fit in this SharedWorld")
+        store = cls(world)
+        for name in cls.COLUMNS:
+            getattr(store, name)[:len(ids)] = arrays[name]
+        store.building_code[:total] = arrays["building_code"]
+        store.building_next[:total] = arrays["building_next"]
+        store.building_total = total
+        for column, values in zip((store.ids, store.owners, store.names, store.strategies), arrays["strings"]):
+            for value in values:
+                column.append(value)
+        for row, city_id in enumerate(ids):
+            store.index[city_id] = row
+        store.world_version = arrays["world_version"]
+        return store
+    
+    @property
+    def world_version(self):
+        return int(self.world.counters[_WORLD_VERSION])
+    
+    @world_version.setter
+    def world_version(self, value):
+        self.world.counters[_WORLD_VERSION] = value
+    
+    @property
+    def building_total(self):
+        return int(self.world.counters[_BUILDING_TOTAL])
+    
+    @building_total.setter
+    def building_total(self, value):
+        self.world.counters[_BUILDING_TOTAL] = value
+    
+    def _mark_moved(self):
+        """Queue the rows changed (by any process) since the last leaderboard read"""
+        # Versions are stamped under the version lock, so every row stamped
+        # up to the version read here is already visible to the scan
+        with self._version_lock:
+            version = self.world_version
+        if version != self._ranked_version:
+            rows = np.flatnonzero(self.version[:len(self.ids)] > self._ranked_version)
+            self._ranked_version = version
+            self.leaderboard.mark(rows)
+    
+    def _grow(self):
+        raise RuntimeError("shared world is full; raise --max-cities")
+    
+    def _reserve_strings(self, *values):
+        needed = sum(len(_encode_string(value)[0]) for value in values)
+        if self.world.counters[_STRING_BYTES] + needed > len(self.world.strings):
+            raise RuntimeError("shared string table is full; raise --max-cities")
+    
+    def _grow_buildings(self):
+        raise RuntimeError("shared building pool is full; raise --max-cities")
+    
+    def build_many(self, row, type_code, count):
+        # Refuse up front rather than fail with the build half applied
+        if self.building_total + 1 + count // _MAX_RUN > len(self.building_code):
+            self._grow_buildings()
+        super().build_many(row, type_code, count)
+
+
+class SchedulerMirror:
+    """Stands in for the parent's TickScheduler in pre-fork workers, serving what it last published"""
+    
+    def __init__(self, world):
+        self._world = world
+    
+    @staticmethod
+    def publish(world, scheduler):
+        """Post scheduler's stats to world; the parent's on_cycle hook"""
+        world.publish({"stats": scheduler.stats(), "durations": scheduler.duration_summary(METRIC_QUANTILES)})
+    
+    def stats(self):
+        return self._world.published()["stats"]
+    
+    def duration_summary(self, quantiles):
+        """The published summary, which is always for METRIC_QUANTILES"""
+        values, total, count = self._world.published()["durations"]
+        return values, total, count
+
+
+class SharedJournal:
+    """
+    Funnels the logged actions of every pre-fork process into the parent's ActionLog.
+    
+    Each action is numbered from a shared counter under the shard locks its
+    process holds while applying it, so on every shard numbering follows
+    apply order, as with a direct ActionLog.append(). Workers send (seq,
+    record) to the parent over a pipe. The parent appends records strictly
+    in seq order, so the log's own sequence numbers match, and publishes
+    the durable seq after each fsync for wait().
+    """
+    
+    def __init__(self, world, processes):
+        self._counters = world.counters
+        self._seq_lock = multiprocessing.Lock()
+        self._durable = multiprocessing.Condition()
+        self._pipes = [multiprocessing.Pipe(duplex=False) for _ in range(processes)]
+        self._sender = None
+        self._send_lock = threading.Lock()
+        self._local = threading.local()
+        self._log = None
+        self._waiting = []
+        self._appended = threading.Condition()
+        self._thread = None
+    
+    def start(self, log):
+        """In the parent, before forking: number actions after log's and feed them to it"""
+        self._log = log
+        self._counters[_LOG_SEQ] = self._counters[_DURABLE_SEQ] = log.last_seq
+        log.on_durable = self._publish
+        self._thread = threading.Thread(target=self._collect, args=([r for r, _ in self._pipes],),
+                                        name="journal-collector", daemon=True)
+        self._thread.start()
+    
+    def forked(self):
+        """In the parent, once every worker is forked: keep only the read ends"""
+        for _, writer in self._pipes:
+            writer.close()
+    
+    def attach_worker(self, index):
+        """In worker `index`, after forking: send this process's actions to the parent"""
+        for i, (reader, writer) in enumerate(self._pipes):
+            reader.close()
+            if i != index:
+                writer.close()
+        self._sender = self._pipes[index][1]
+    
+    def record(self, record):
+        """Number and log one applied action; caller holds the locks of the shards it changed"""
+        with self._seq_lock:
+            seq = int(self._counters[_LOG_SEQ]) + 1
+            self._counters[_LOG_SEQ] = seq
+        if self._sender is None:
+            self._submit(seq, record)
+        else:
+            with self._send_lock:
+                self._sender.send((seq, record))
+        self._local.seq = seq
+    
+    def wait(self):
+        """Block until the calling thread's last recorded action is durable"""
+        seq = getattr(self._local, "seq", 0)
+        if seq:
+            with self._durable:
+                while self._counters[_DURABLE_SEQ] < seq:
+                    self._durable.wait(1.0)
+            self._local.seq = 0
+    
+    def drain(self):
+        """In the parent: wait until every numbered action is in the log; caller holds state_lock"""
+        with self._appended:
+            while self._log.last_seq < self._counters[_LOG_SEQ]:
+                if not self._thread.is_alive():
+                    raise RuntimeError("a worker exited before sending all of its logged actions")
+                self._appended.wait(1.0)
+    
+    def _publish(self, seq):
+        with self._durable:
+            self._counters[_DURABLE_SEQ] = max(seq, int(self._counters[_DURABLE_SEQ]))
+            self._durable.notify_all()
+    
+    def _submit(self, seq, record):
+        with self._appended:
+            heapq.heappush(self._waiting, (seq, record))
+            while self._waiting and self._waiting[0][0] == self._log.last_seq + 1:
+                self._log.append(heapq.heappop(self._waiting)[1])
+            self._appended.notify_all()
+    
+    def _collect(self, readers):
+        while readers:
+            for reader in wait_connections(readers):
+                try:
+                    seq, record = reader.recv()
+                except EOFError:
+                    readers.remove(reader)
+                    continue
+                self._submit(seq, record)
+
+
+# ═══════════════════════════════════════════════════════════════
+#    Fixed-rate world ticks
+# ═══════════════════════════════════════════════════════════════
+
+class TickScheduler:
+    """
+    Advances every city at a fixed rate from a background thread.
+    
+    Each cycle of 1/rate seconds is cut into `slices` evenly spaced steps.
+    Each step ticks a contiguous range of rows one shard at a time, under
+    that shard's lock. That way, no request ever waits behind a whole-world
+    tick, and requests on other shards do not wait at all. Cycles follow the
+    clock, not each other. A cycle that comes due more than a full interval
+    late is skipped rather than run back-to-back.
+    
+    Stats: duration is the time spent ticking in one cycle. Lag is the
+    furthest any of its steps started behind schedule. Utilization
+    (duration / interval) approaching 1 means the world has outgrown
+    one core at this rate.
+    """
+    
+    def __init__(self, rate, slices=10):
+        if rate <= 0:
+            raise ValueError("tick rate must be positive")
+        self.rate = rate
+        self.interval = 1.0 / rate
+        self.slices = max(1, slices)
+        self.cycles = 0
+        self.skipped = 0
+        self.overruns = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.durations = LatencyHistogram()
+        # Called with the scheduler after every cycle
+        self.on_cycle = None
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ticker", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self):
+        due = time.monotonic()
+        while not self._stop.is_set():
+            behind = time.monotonic() - due
+            if behind >= self.interval:
+                missed = int(behind // self.interval)
+                due += missed * self.interval
+                with self._stats_lock:
+                    self.skipped += missed
+            self._cycle(due)
+            due += self.interval
+    
+    def _cycle(self, due):
+        """Run one cycle's steps on schedule; a stop request only cancels the waits"""
+        count = len(cities)
+        duration = lag = 0.0
+        for step in range(self.slices):
+            step_due = due + step * self.interval / self.slices
+            delay = step_due - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            start, stop = count * step // self.slices, count * (step + 1) // self.slices
+            if start == stop:
+                continue
+            lag = max(lag, time.monotonic() - step_due)
+            started = time.perf_counter()
+            for shard in range(len(state_lock)):
+                with state_lock.shard(shard):
+                    tick_slice(shard, start, stop)
+            duration += time.perf_counter() - started
+        
+        with self._stats_lock:
+            self.cycles += 1
+            self.last_duration = duration
+            self.total_duration += duration
+            self.max_duration = max(self.max_duration, duration)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.durations.record(duration)
+            if duration > self.interval:
+                self.overruns += 1
+        if self.on_cycle is not None:
+            self.on_cycle(self)
+    
+    def stats(self):
+        """Counters and timings (milliseconds) for GET /api/game/scheduler"""
+        with self._stats_lock:
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "rate": self.rate,
+                "slices": self.slices,
+                "cycles": self.cycles,
+                "skipped": self.skipped,
+                "overruns": self.overruns,
+                "last_duration_ms": round(self.last_duration * 1000, 3),
+                "mean_duration_ms": round(self.total_duration / max(1, self.cycles) * 1000, 3),
+                "max_duration_ms": round(self.max_duration * 1000, 3),
+                "p99_duration_ms": round(self.durations.quantiles([0.99])[0] * 1000, 3),
+                "last_lag_ms": round(self.last_lag * 1000, 3),
+                "max_lag_ms": round(self.max_lag * 1000, 3),
+                "utilization": round(self.last_duration / self.interval, 4),
+            }
+    
+    def duration_summary(self, quantiles):
+        """(quantile values, sum, count) of cycle durations in seconds, for /metrics"""
+        with self._stats_lock:
+            return self.durations.quantiles(quantiles), self.durations.sum, self.durations.count
+
+
+# Set by run_demo when --tick-rate is given
+scheduler = None
+
+
+# ═══════════════════════════════════════════════════════════════
+#    Server-Sent Events: pushed deltas
+# ═══════════════════════════════════════════════════════════════
+
+EVENTS_INTERVAL = 0.25
+EVENTS_HEARTBEAT = 15.0
+EVENTS_MAX_BUFFER = 8 * 1024 * 1024
+EVENTS_MAX_SUBSCRIBERS = 1000
+EVENTS_LEADERBOARD_SIZE = 10
+EVENTS_RETRY_MS = 1000
+
+
+def sse_frame(event, event_id, payload):
+    """One Server-Sent Events message; json.dumps never emits a newline, so data fits one line"""
+    return f"event: {event}\nid: {event_id}\ndata: ".encode() + json.dumps(payload).encode() + b"\n\n"
+
+
+class _Subscriber:
+    __slots__ = ("sock", "cities", "since", "pending", "pending_bytes", "writing")
+    
+    def __init__(self, sock, cities, since):
+        self.sock = sock
+        self.cities = cities
+        self.since = since
+        self.pending = collections.deque()
+        self.pending_bytes = 0
+        self.writing = False
+
+
+class EventHub:
+    """
+    Pushes world changes to Server-Sent Events subscribers from one thread.
+    
+    GameHandler hands a subscriber's connection over once the response
+    headers are out, so subscribers hold no worker thread. Each publish
+    renders the delta since the last one with state_since (the same
+    guarantees as ?since= polling), encodes it once and queues those bytes
+    for every whole-world subscriber. Subscribers to particular cities
+    share one frame per changed city. The top EVENTS_LEADERBOARD_SIZE go to
+    everyone as a leaderboard event when their order changes.
+    
+    Publishing happens every `interval` seconds if the world moved, and
+    right after each local scheduler cycle (wake()). Sockets are
+    non-blocking; a subscriber whose unsent backlog passes max_buffer is
+    dropped and can resume with Last-Event-ID, the world version of the
+    last frame it got.
+    """
+    
+    def __init__(self, interval=EVENTS_INTERVAL, max_buffer=EVENTS_MAX_BUFFER, max_subscribers=EVENTS_MAX_SUBSCRIBERS):
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._joining = []
+        self._count = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake_r = self._wake_w = None
+    
+    def full(self):
+        return self._count >= self.max_subscribers
+    
+    def subscribe(self, sock, cities=None, since=None):
+        """Take over sock (response headers already sent); False if the hub is full"""
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return False
+            self._count += 1
+            if self._thread is None:
+                self._start()
+            self._joining.append(_Subscriber(sock, cities, since))
+        self.wake()
+        return True
+    
+    def subscribers(self):
+        return self._count
+    
+    def wake(self, *_):
+        if self._wake_w is not None:
+            try:
+                self._wake_w.send(b"\0")
+            except OSError:
+                pass
+    
+    def stop(self):
+        self._stop.set()
+        self.wake()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _start(self):
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._thread = threading.Thread(target=self._run, name="events", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wake_r, selectors.EVENT_READ)
+        everyone, watchers = set(), {}
+        version = cities.world_version
+        leaders = None
+        next_publish = time.monotonic()
+        next_ping = next_publish + EVENTS_HEARTBEAT
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                woken = False
+                for key, mask in selector.select(max(0.0, min(next_publish, next_ping) - now)):
+                    sub = key.data
+                    if sub is None:
+                        woken = True
+                        try:
+                            while self._wake_r.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    elif mask & selectors.EVENT_READ and not self._readable(sub):
+                        self._drop(selector, sub, everyone, watchers)
+                    elif mask & selectors.EVENT_WRITE and not self._flush(selector, sub):
+                        self._drop(selector, sub, everyone, watchers)
+                
+                now = time.monotonic()
+                if woken or now >= next_publish:
+                    version, leaders = self._publish(selector, version, leaders, everyone, watchers)
+                    next_publish = now + self.interval
+                with self._lock:
+                    joining, self._joining = self._joining, []
+                for sub in joining:
+                    self._join(selector, sub, everyone, watchers, leaders)
+                if now >= next_ping:
+                    for sub in list(everyone) + [s for subs in watchers.values() for s in subs]:
+                        self._send(selector, sub, b": ping\n\n", everyone, watchers)
+                    next_ping = now + EVENTS_HEARTBEAT
+        finally:
+            for key in list(selector.get_map().values()):
+                if key.data is not None:
+                    key.data.sock.close()
+            selector.close()
+    
+    def _publish(self, selector, version, leaders, everyone, watchers):
+        """Send what changed after version; returns the (version, leaderboard) now published"""
+        if cities.world_version != version and (everyone or watchers):
+            # As in state_since, minus its full resync for version 0
+            current = settled_version()
+            rows = cities.changed_since(version)
+            if not everyone:
+                rows = [row for row in rows if cities.ids[row] in watchers]
+            changed = {}
+            resources = {}
+            for city_id, city_resources, city in rendered(rows, _row_document):
+                resources[city_id] = city_resources
+                changed[city_id] = city
+            version = current
+            if everyone:
+                delta = {"cities": changed, "resources": resources, "leaderboard": [], "version": version,
+                         "full": False}
+                frame = sse_frame("delta", version, delta)
+                for sub in list(everyone):
+                    self._send(selector, sub, frame, everyone, watchers)
+            for city_id, city in changed.items():
+                if city_id in watchers:
+                    frame = sse_frame("city", version, {"version": version, "city": city})
+                    for sub in list(watchers[city_id]):
+                        self._send(selector, sub, frame, everyone, watchers)
+        elif not (everyone or watchers):
+            version = cities.world_version
+        
+        top = leaderboard_top(EVENTS_LEADERBOARD_SIZE) if everyone or watchers else None
+        if top is not None and leaders is not None and self._ranking(top) != self._ranking(leaders):
+            frame = sse_frame("leaderboard", version, {"version": version, "top": top})
+            for sub in list(everyone) + [s for subs in watchers.values() for s in subs]:
+                self._send(selector, sub, frame, everyone, watchers)
+        return version, top if top is not None else leaders
+    
+    @staticmethod
+    def _ranking(top):
+        return [city["id"] for city in top]
+    
+    def _join(self, selector, sub, everyone, watchers, leaders):
+        """Start a subscriber off with the state it is missing, then the current leaderboard"""
+        sub.sock.setblocking(False)
+        selector.register(sub.sock, selectors.EVENT_READ, sub)
+        if sub.cities is None:
+            if sub.since is None:
+                version = settled_version()
+                first = {"cities": {}, "resources": {}, "leaderboard": [], "version": version, "full": False}
+            else:
+                first = state_since(sub.since)
+                version = first["version"]
+            frame = sse_frame("delta", version, first)
+            everyone.add(sub)
+        else:
+            version = settled_version()
+            rows = [row for row in (cities.row_of(city_id) for city_id in sub.cities) if row is not None]
+            frame = b"".join(sse_frame("city", version, {"version": version, "city": city})
+                             for _, _, city in rendered(rows, _row_document))
+            for city_id in sub.cities:
+                watchers.setdefault(city_id, set()).add(sub)
+        top = leaders if leaders is not None else leaderboard_top(EVENTS_LEADERBOARD_SIZE)
+        frame += sse_frame("leaderboard", version, {"version": version, "top": top})
+        self._send(selector, sub, f"retry: {EVENTS_RETRY_MS}\n\n".encode() + frame, everyone, watchers)
+    
+    def _send(self, selector, sub, frame, everyone, watchers):
+        if sub.pending_bytes + len(frame) > self.max_buffer:
+            self._drop(selector, sub, everyone, watchers)
+            return
+        sub.pending.append(memoryview(frame))
+        sub.pending_bytes += len(frame)
+        if not sub.writing and not self._flush(selector, sub):
+            self._drop(selector, sub, everyone, watchers)
+    
+    def _flush(self, selector, sub):
+        """Write what the socket takes now; watch for writability if some is left. False if the peer is gone."""
+        try:
+            while sub.pending:
+                sent = sub.sock.send(sub.pending[0])
+                sub.pending_bytes -= sent
+                if sent < len(sub.pending[0]):
+                    sub.pending[0] = sub.pending[0][sent:]
+                    break
+                sub.pending.popleft()
+        except BlockingIOError:
+            pass
+        except OSError:
+            return False
+        writing = bool(sub.pending)
+        if writing != sub.writing:
+            sub.writing = writing
+            selector.modify(sub.sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0), sub)
+        return True
+    
+    @staticmethod
+    def _readable(sub):
+        """Subscribers send nothing after their request; readable means closed (or misbehaving)"""
+        try:
+            return bool(sub.sock.recv(4096))
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+    
+    def _drop(self, selector, sub, everyone, watchers):
+        if sub.sock.fileno() == -1:
+            # Already dropped
+            return
+        everyone.discard(sub)
+        for city_id in sub.cities or ():
+            subs = watchers.get(city_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del watchers[city_id]
+        try:
+            selector.unregister(sub.sock)
+        except (KeyError, ValueError):
+            pass
+        sub.sock.close()
+        with self._lock:
+            self._count -= 1
+
+
+events = EventHub()
+
+
+# ═══════════════════════════════════════════════════════════════
+#    Metrics: latency histograms and /metrics
+# ═══════════════════════════════════════════════════════════════
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of durations, kept in whole microseconds.
+    
+    Below 2**sub_bits us every value has its own bucket; above, each power
+    of two is split into 2**sub_bits linear buckets, so a recorded value is
+    known to within 1/2**sub_bits (about 3%) however large it is. Recording
+    is O(1) with no allocation. Not thread-safe: callers hold their own lock.
+    """
+    
+    def __init__(self, sub_bits=5, max_exponent=36):
+        self.sub_bits = sub_bits
+        self.limit = (1 << (max_exponent + 1)) - 1
+        self.counts = [0] * ((max_exponent - sub_bits + 2) << sub_bits)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0
+    
+    def record(self, seconds):
+        micros = min(int(seconds * 1_000_000), self.limit)
+        if micros < (1 << self.sub_bits):
+            index = micros
+        else:
+            shift = micros.bit_length() - self.sub_bits - 1
+            index = ((shift + 1) << self.sub_bits) + (micros >> shift) - (1 << self.sub_bits)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        if micros > self.max:
+            self.max = micros
+    
+    def _upper_bound(self, index):
+        if index < (1 << self.sub_bits):
+            return index
+        shift = (index >> self.sub_bits) - 1
+        mantissa = (index & ((1 << self.sub_bits) - 1)) | (1 << self.sub_bits)
+        return ((mantissa + 1) << shift) - 1
+    
+    def quantiles(self, quantiles):
+        """Upper bounds, in seconds, of the buckets holding each quantile (ascending)"""
+        values = []
+        targets = [max(1, math.ceil(q * self.count)) for q in quantiles]
+        seen = 0
+        wanted = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            while wanted < len(targets) and seen >= targets[wanted]:
+                values.append(min(self._upper_bound(index), self.max) / 1_000_000)
+                wanted += 1
+            if wanted == len(targets):
+                break
+        return values + [0.0] * (len(targets) - len(values))
+
+
+class _CountingWriter:
+    """Wraps a handler's wfile to count the bytes written through it"""
+    
+    def __init__(self, raw):
+        self._raw = raw
+        self.written = 0
+    
+    def write(self, data):
+        self.written += len(data)
+        return self._raw.write(data)
+    
+    def flush(self):
+        self._raw.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+# API paths reported as their own route; anything else is "static" (GET/HEAD) or "other"
+METRIC_ROUTES = frozenset({
+    "/api/game/state", "/api/resources", "/api/buildings", "/api/game/scheduler",
+    "/api/leaderboard", "/api/leaderboard/rank", "/api/leaderboard/around", "/api/game/city/buildings",
+    "/api/game/create_city", "/api/game/build", "/api/game/build_batch",
+    "/api/game/tick", "/api/game/tick_all", "/api/game/events", "/metrics",
+})
+METRIC_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Metrics:
+    """Per-route request counters and latency histograms, rendered for Prometheus"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._shed = {}
+    
+    def observe(self, method, route, status, seconds, request_bytes, response_bytes):
+        with self._lock:
+            stats = self._routes.get((method, route))
+            if stats is None:
+                stats = self._routes[(method, route)] = {
+                    "latency": LatencyHistogram(), "statuses": {}, "request_bytes": 0, "response_bytes": 0,
+                }
+            stats["latency"].record(seconds)
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            stats["request_bytes"] += request_bytes
+            stats["response_bytes"] += response_bytes
+    
+    def shed(self, reason):
+        """Count one request turned away by admission control or a rate limit"""
+        with self._lock:
+            self._shed[reason] = self._shed.get(reason, 0) + 1
+    
+    def render(self):
+        """The Prometheus text exposition (format 0.0.4)"""
+        lines = []
+        
+        def family(name, kind, text):
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        with self._lock:
+            routes = sorted(self._routes.items())
+            family("demo_http_requests_total", "counter", "Requests handled, by route and status.")
+            for (method, route), stats in routes:
+                for status, count in sorted(stats["statuses"].items()):
+                    lines.append(f'demo_http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+            family("demo_http_request_duration_seconds", "summary",
+                   "Time from request line to response written, from an HDR histogram (about 3% precision).")
+            for (method, route), stats in routes:
+                labels = f'method="{method}",route="{route}"'
+                latency = stats["latency"]
+                for q, value in zip(METRIC_QUANTILES, latency.quantiles(METRIC_QUANTILES)):
+                    lines.append(f'demo_http_request_duration_seconds{{{labels},quantile="{q}"}} {value}')
+                lines.append(f"demo_http_request_duration_seconds_sum{{{labels}}} {latency.sum}")
+                lines.append(f"demo_http_request_duration_seconds_count{{{labels}}} {latency.count}")
+            family("demo_http_request_bytes_total", "counter", "Request body bytes received.")
+            for (method, route), stats in routes:
+                lines.append(f'demo_http_request_bytes_total{{method="{method}",route="{route}"}} {stats["request_bytes"]}')
+            family("demo_http_shed_total", "counter", "Requests refused with 503 or 429, by reason.")
+            for reason, count in sorted(self._shed.items()):
+                lines.append(f'demo_http_shed_total{{reason="{reason}"}} {count}')
+            family("demo_http_response_bytes_total", "counter", "Response bytes sent, headers included.")
+            for (method, route), stats in routes:
+                lines.append(f'demo_http_response_bytes_total{{method="{method}",route="{route}"}} {stats["response_bytes"]}')
+        
+        family("demo_cities", "gauge", "Cities in the world.")
+        lines.append(f"demo_cities {len(cities)}")
+        family("demo_world_version", "gauge", "Changes applied to the world so far.")
+        lines.append(f"demo_world_version {cities.world_version}")
+        
+        if scheduler is not None:
+            stats = scheduler.stats()
+            values, total, count = scheduler.duration_summary(METRIC_QUANTILES)
+            family("demo_tick_duration_seconds", "summary", "Time spent ticking per scheduled world cycle.")
+            for q, value in zip(METRIC_QUANTILES, values):
+                lines.append(f'demo_tick_duration_seconds{{quantile="{q}"}} {value}')
+            lines.append(f"demo_tick_duration_seconds_sum {total}")
+            lines.append(f"demo_tick_duration_seconds_count {count}")
+            family("demo_tick_lag_seconds", "gauge", "How far the last cycle ran behind schedule.")
+            lines.append(f"demo_tick_lag_seconds {round(stats['last_lag_ms'] / 1000, 6)}")
+            family("demo_tick_utilization", "gauge", "Last cycle's tick time over the tick interval.")
+            lines.append(f"demo_tick_utilization {stats['utilization']}")
+            for name, key, text in (("demo_tick_skipped_total", "skipped", "Cycles skipped for running a full interval late."),
+                                    ("demo_tick_overruns_total", "overruns", "Cycles that took longer than the interval.")):
+                family(name, "counter", text)
+                lines.append(f"{name} {stats[key]}")
+        return "\n".join(lines) + "\n"
+
+
+# Replaced with None by run_demo(collect_metrics=False)
+metrics = Metrics()
+
+
+# ═══════════════════════════════════════════════════════════════
+#    Admission control: priorities, load shedding, rate limits
+# ═══════════════════════════════════════════════════════════════
+
+# When requests queue for a worker, lower values run first
+PRIORITY_READ, PRIORITY_WRITE, PRIORITY_BULK = range(3)
+
+DEFAULT_QUEUE_DEPTH = 64
+DEFAULT_QUEUE_TIMEOUT = 0.5
+RETRY_AFTER_SECONDS = 1
+
+
+def route_priority(command, path):
+    """Cheap reads first, then writes, then whole-world work (full state dumps, tick_all)"""
+    path, _, query = path.partition("?")
+    if path == "/api/game/tick_all" or (path == "/api/game/state" and "since=" not in query
+                                        and "cursor=" not in query):
+        return PRIORITY_BULK
+    if command == "POST":
+        return PRIORITY_WRITE
+    return PRIORITY_READ
+
+
+class AdmissionControl:
+    """
+    A bounded, prioritized queue for `slots` request slots.
+    
+    A request that finds every slot busy waits its turn in priority order,
+    oldest first within a priority. It is refused at once if the queue is
+    too deep for its priority (bulk requests get a quarter of it, writes
+    three quarters) or the oldest waiter has already been there for
+    max_wait. A waiter that reaches max_wait gives up too. Refused requests
+    are answered 503 with Retry-After, so under overload latency stays
+    bounded for the requests that are served instead of growing for all.
+    """
+    
+    PRIORITY_SHARE = (1.0, 0.75, 0.25)
+    
+    def __init__(self, slots, max_queue=DEFAULT_QUEUE_DEPTH, max_wait=DEFAULT_QUEUE_TIMEOUT):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._free = slots
+        self._lock = threading.Lock()
+        self._heap = []
+        self._arrivals = collections.deque()
+        self._queued = 0
+        self._tickets = itertools.count()
+    
+    def admit(self, priority):
+        """Take a slot, waiting if need be; returns None, or why the request was refused"""
+        with self._lock:
+            if self._free and not self._queued:
+                self._free -= 1
+                return None
+            now = time.monotonic()
+            if self._queued >= self.max_queue * self.PRIORITY_SHARE[priority]:
+                return "queue_full"
+            if self._oldest_wait(now) >= self.max_wait:
+                return "queue_stale"
+            waiter = _Waiter(now)
+            heapq.heappush(self._heap, (priority, next(self._tickets), waiter))
+            self._arrivals.append(waiter)
+            self._queued += 1
+        
+        if waiter.granted.wait(self.max_wait):
+            return None
+        with self._lock:
+            if waiter.granted.is_set():
+                return None
+            waiter.cancelled = True
+            self._queued -= 1
+        return "queue_timeout"
+    
+    def release(self):
+        """Give the slot to the most urgent waiter, or free it"""
+        with self._lock:
+            while self._heap:
+                waiter = heapq.heappop(self._heap)[2]
+                if not waiter.cancelled:
+                    self._queued -= 1
+                    waiter.granted.set()
+                    return
+            self._free += 1
+    
+    def _oldest_wait(self, now):
+        arrivals = self._arrivals
+        while arrivals and (arrivals[0].cancelled or arrivals[0].granted.is_set()):
+            arrivals.popleft()
+        return now - arrivals[0].arrived if arrivals else 0.0
+
+
+class _Waiter:
+    __slots__ = ("arrived", "granted", "cancelled")
+    
+    def __init__(self, arrived):
+        self.arrived = arrived
+        self.granted = threading.Event()
+        self.cancelled = False
+
+
+class RateLimiter:
+    """
+    A token bucket per client address: `rate` requests per second sustained,
+    bursts of up to `burst`. check() takes a token, answering 0 to admit
+    a request or the seconds until the address has a token again; limited()
+    answers the same without taking one.
+    
+    At most max_clients buckets are kept, in order of last use. A new
+    address first evicts buckets that have refilled (they are the oldest),
+    then, if the table is still full, the least recently used ones; those
+    addresses start over with a full bucket.
+    """
+    
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = collections.OrderedDict()
+    
+    def check(self, address):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(address, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if address in self._buckets:
+                self._buckets.move_to_end(address)
+            elif len(self._buckets) >= self.max_clients:
+                self._evict(now)
+            if tokens < 1:
+                self._buckets[address] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[address] = (tokens - 1, now)
+            return 0.0
+    
+    def limited(self, address):
+        now = time.monotonic()
+        with self._lock:
+            if address not in self._buckets:
+                return 0.0
+            tokens, last = self._buckets[address]
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            return (1 - tokens) / self.rate if tokens < 1 else 0.0
+    
+    def _evict(self, now):
+        # Buckets that have refilled are indistinguishable from new ones;
+        # in last-use order they come first
+        refill = self.burst / self.rate
+        buckets = self._buckets
+        while buckets and now - next(iter(buckets.values()))[1] >= refill:
+            buckets.popitem(last=False)
+        while len(buckets) >= self.max_clients:
+            buckets.popitem(last=False)
+
+
+def _canned_response(status, reason, error):
+    body = json.dumps({"error": error, "retry_after": RETRY_AFTER_SECONDS}).encode()
+    return (
+        f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nRetry-After: {RETRY_AFTER_SECONDS}\r\n"
+        f"Connection: close\r\n\r\n"
+    ).encode() + body
+
+
+# Written straight from the accept loop, without handing the connection to
+# a thread: when every connection thread is taken, and to addresses that
+# are over their rate limit
+OVERLOADED_RESPONSE = _canned_response(503, "Service Unavailable", "Server overloaded, retry later")
+RATE_LIMITED_RESPONSE = _canned_response(429, "Too Many Requests", "Too many requests")
+
+
+# ═══════════════════════════════════════════════════════════════
+#    HTTP: payloads, handler and servers
+# ═══════════════════════════════════════════════════════════════
+
+class EncodedPayload:
+    """
+    A response body encoded once: identity bytes, an optional gzip variant
+    (kept only when it is smaller) and a strong ETag per representation.
+    """
+    
+    __slots__ = ("body", "gzip", "etag", "gzip_etag", "content_type")
+    
+    def __init__(self, body, content_type="application/json"):
+        self.body = body
+        self.content_type = content_type
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        self.gzip = compressed if len(compressed) < len(body) else None
+    
+    @classmethod
+    def from_json(cls, obj):
+        return cls(json.dumps(obj).encode())
+
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows (q > 0), lower-cased"""
+    codings = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            codings.add(coding.lower())
+    return codings
+
+
+def etag_matches(header, *etags):
+    """If-None-Match check, using the weak comparison RFC 9110 requires for it"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") in etags for tag in header.split(","))
+
+
+# Dynamic JSON bodies at least this large are compressed when the client allows
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+_COMPRESS_WBITS = {"gzip": 31, "deflate": 15}
+
+
+def negotiate_coding(header):
+    """The content coding to compress a dynamic response with (gzip preferred), or None"""
+    codings = accepted_encodings(header)
+    for coding in _COMPRESS_WBITS:
+        if coding in codings:
+            return coding
+    return None
+
+
+def compressor(coding):
+    """A zlib compressobj writing the gzip or deflate (zlib) format"""
+    return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, _COMPRESS_WBITS[coding])
+
+
+# RESOURCES and BUILDINGS never change at runtime
+CATALOG_CACHE_CONTROL = "public, max-age=3600"
+CATALOG_PAYLOADS = {
+    "/api/resources": EncodedPayload.from_json(RESOURCES),
+    "/api/buildings": EncodedPayload.from_json(BUILDINGS),
 }
 
+
+# Static files: bodies up to STATIC_MAX_CACHED_FILE are kept in memory (up
+# to STATIC_CACHE_BYTES in all), larger ones are sent from disk with sendfile
+STATIC_CACHE_BYTES = 32 * 1024 * 1024
+STATIC_MAX_CACHED_FILE = 1024 * 1024
+STATIC_RECHECK_SECONDS = 1.0
+STATIC_CACHE_CONTROL = "no-cache"
+STATIC_PRELOAD = ("index.html",)
+_COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+
+def static_content_type(path):
+    """The Content-Type SimpleHTTPRequestHandler would send for path"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in SimpleHTTPRequestHandler.extensions_map:
+        return SimpleHTTPRequestHandler.extensions_map[ext]
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+class StaticAsset:
+    """
+    One static file as of (mtime_ns, size): validators, the response headers
+    and, when cached, the body and an optional gzip variant kept only when
+    it is smaller.
+    """
+    
+    __slots__ = ("path", "mtime_ns", "size", "checked", "etag", "gzip_etag", "last_modified",
+                 "headers", "body", "gzip")
+    
+    def __init__(self, path, st, content_type, body=None):
+        self.path = path
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.checked = time.monotonic()
+        tag = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+        self.etag = f'"{tag}"'
+        self.gzip_etag = f'"{tag}-gzip"'
+        self.last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        self.headers = (("Content-type", content_type), ("Last-Modified", self.last_modified),
+                        ("Cache-Control", STATIC_CACHE_CONTROL), ("Vary", "Accept-Encoding"))
+        self.body = body
+        self.gzip = None
+        if body is not None and content_type.startswith(_COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            self.gzip = compressed if len(compressed) < len(body) else None
+    
+    def not_modified(self, if_none_match, if_modified_since):
+        """Conditional GET: If-None-Match wins over If-Modified-Since, as RFC 9110 says"""
+        if if_none_match:
+            return etag_matches(if_none_match, self.etag, self.gzip_etag)
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError):
+                return False
+            return since.timestamp() >= self.mtime_ns // 1_000_000_000
+        return False
+
+
+class StaticFiles:
+    """
+    Static assets by filesystem path, re-validated against the file's mtime
+    and size at most every STATIC_RECHECK_SECONDS. Threads share one cache;
+    entries are immutable and replaced whole when the file changes.
+    """
+    
+    def __init__(self, budget=STATIC_CACHE_BYTES, max_file=STATIC_MAX_CACHED_FILE, recheck=STATIC_RECHECK_SECONDS):
+        self.budget = budget
+        self.max_file = max_file
+        self.recheck = recheck
+        self._assets = {}
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, path):
+        """The asset at path, or None if it is not a regular file (directories and misses go to the default handler)"""
+        asset = self._assets.get(path)
+        now = time.monotonic()
+        if asset is not None and now - asset.checked < self.recheck:
+            return asset
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._forget(path)
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        if asset is not None and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size:
+            asset.checked = now
+            return asset
+        return self._load(path, st, static_content_type(path))
+    
+    def preload(self, directory, names=STATIC_PRELOAD):
+        for name in names:
+            self.get(os.path.join(directory, name))
+    
+    def _load(self, path, st, content_type):
+        body = None
+        if st.st_size <= self.max_file:
+            try:
+                with open(path, "rb") as f:
+                    body = f.read()
+                    st = os.fstat(f.fileno())
+            except OSError:
+                self._forget(path)
+                return None
+        asset = StaticAsset(path, st, content_type, body)
+        with self._lock:
+            old = self._assets.get(path)
+            held = len(old.body) + len(old.gzip or b"") if old is not None and old.body is not None else 0
+            added = len(body) + len(asset.gzip or b"") if body is not None else 0
+            if self._cached_bytes - held + added > self.budget:
+                # Over budget: keep the validators and headers, send the body from disk
+                asset.body = asset.gzip = None
+                added = 0
+            self._cached_bytes += added - held
+            self._assets[path] = asset
+        return asset
+    
+    def _forget(self, path):
+        with self._lock:
+            old = self._assets.pop(path, None)
+            if old is not None and old.body is not None:
+                self._cached_bytes -= len(old.body) + len(old.gzip or b"")
+
+
+# Replaced with None by run_demo(static_cache=False)
+static_files = StaticFiles()
+
+
 class GameHandler(SimpleHTTPRequestHandler):
+    # Persistent connections: every response carries Content-Length or is
+    # chunked. Idle connections are dropped after `timeout` seconds, and
+    # servers without spare workers (or no pool at all) close after each
+    # response so one client cannot hold a worker others are queued for.
+    # Headers and body go out in separate writes, so Nagle's algorithm
+    # would hold the body until the client's delayed ACK on a reused
+    # connection.
+    protocol_version = "HTTP/1.1"
+    timeout = 5
+    disable_nagle_algorithm = True
+    _sent_connection = False
+    
+    # Instrumentation: time each request from its parsed request line to
+    # the end of its response, and count the bytes that went out
+    def setup(self):
+        super().setup()
+        self.wfile = _CountingWriter(self.wfile)
+    
+    def parse_request(self):
+        self._started = None
+        if not super().parse_request():
+            return False
+        self._started = time.perf_counter()
+        self._status = None
+        self.wfile.written = 0
+        return self._enter_world() and self._admit()
+    
+    # In a world's process, /worlds/<its id>/... is served as the unprefixed
+    # path. The router sent this connection here for its first request; a
+    # later one for another world is refused so the client reconnects.
+    def _enter_world(self):
+        if world_name is None:
+            return True
+        name, rest = split_world(self.path)
+        if name is None:
+            return True
+        if name != world_name:
+            self.close_connection = True
+            body = json.dumps({"error": f"this connection is routed to world {world_name!r}, reconnect"}).encode()
+            self._send_json(421, body, {"Connection": "close"})
+            return False
+        self.path = rest
+        return True
+    
+    # Admission: the per-address rate limit, then a request slot. A refused
+    # request is answered without reading its body, so the connection closes.
+    def _admit(self):
+        limiter = getattr(self.server, "rate_limiter", None)
+        if limiter is not None:
+            retry_after = limiter.check(self.client_address[0])
+            if retry_after:
+                self._shed(429, "rate_limited", "Too many requests", retry_after)
+                return False
+        admission = getattr(self.server, "admission", None)
+        if admission is not None:
+            refused = admission.admit(route_priority(self.command, self.path))
+            if refused is not None:
+                self._shed(503, refused, "Server overloaded, retry later", RETRY_AFTER_SECONDS)
+                return False
+            self._admitted = True
+        return True
+    
+    def _shed(self, status, reason, error, retry_after):
+        if metrics is not None:
+            metrics.shed(reason)
+        retry_after = max(1, math.ceil(retry_after))
+        body = json.dumps({"error": error, "retry_after": retry_after}).encode()
+        self._send_json(status, body, {"Retry-After": str(retry_after), "Connection": "close"})
+    
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+    
+    def handle_one_request(self):
+        self._started = None
+        self._admitted = False
+        try:
+            super().handle_one_request()
+        finally:
+            if self._admitted:
+                self.server.admission.release()
+            if self._started is not None and metrics is not None:
+                length = self.headers.get("Content-Length", "0")
+                path = self.path.partition("?")[0]
+                if path in METRIC_ROUTES:
+                    route = path
+                else:
+                    route = "static" if self.command in ("GET", "HEAD") else "other"
+                metrics.observe(self.command, route, self._status or 0, time.perf_counter() - self._started,
+                                int(length) if length.isdigit() else 0, self.wfile.written)
+    
     def do_GET(self):
-        if self.path == "/api/game/state":
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(game_state).encode())
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        
+        if url.path == "/api/game/state":
+            if "since" not in query and "cursor" not in query:
+                version = cities.world_version
+                self._send_stream(state_chunks(), {"X-World-Version": str(version)})
+                return
+            try:
+                if "since" in query:
+                    payload = state_since(int(query["since"]))
+                else:
+                    payload = state_page(int(query["cursor"]), int(query.get("limit", STATE_PAGE_LIMIT)))
+            except ValueError:
+                self._send_json(400, json.dumps({"error": "since, cursor and limit must be integers"}).encode())
+                return
+            self._send_json(200, json.dumps(payload).encode(), {"X-World-Version": str(payload["version"])})
             return
         
-        elif self.path == "/api/resources":
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(RESOURCES).encode())
+        elif url.path == "/api/game/events":
+            self._subscribe(query)
             return
         
-        elif self.path == "/api/buildings":
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(BUILDINGS).encode())
+        elif self.path in CATALOG_PAYLOADS:
+            self._send_payload(CATALOG_PAYLOADS[self.path], CATALOG_CACHE_CONTROL)
             return
         
-        elif self.path == "/api/leaderboard":
+        elif self.path == "/metrics" and metrics is not None:
+            body = metrics.render().encode()
             self.send_response(200)
-            self.send_header("Content-type", "application/json")
+            self.send_header("Content-type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            # Sort by score
-            sorted_cities = sorted(game_state["cities"].values(), key=lambda x: x["score"], reverse=True)[:10]
-            self.wfile.write(json.dumps(sorted_cities).encode())
+            self.wfile.write(body)
+            return
+        
+        elif url.path == "/api/game/city/buildings":
+            try:
+                status, payload = city_buildings(query.get("city_id"), int(query.get("offset", 0)),
+                                                 int(query.get("limit", CITY_BUILDINGS_LIMIT)))
+                body = json.dumps(payload).encode()
+            except ValueError:
+                status, body = 400, json.dumps({"error": "offset and limit must be integers"}).encode()
+            self._send_json(status, body)
+            return
+        
+        elif self.path == "/api/game/scheduler":
+            body = json.dumps(scheduler.stats() if scheduler is not None else {"running": False}).encode()
+            self._send_json(200, body)
+            return
+        
+        elif self.path.startswith("/api/leaderboard"):
+            try:
+                if url.path == "/api/leaderboard":
+                    status, payload = 200, leaderboard_top(int(query.get("limit", 10)))
+                elif url.path == "/api/leaderboard/rank":
+                    status, payload = leaderboard_rank(query.get("city_id"))
+                elif url.path == "/api/leaderboard/around":
+                    status, payload = leaderboard_around(query.get("city_id"), int(query.get("radius", 5)))
+                else:
+                    status, payload = 404, {"error": "Not found"}
+                body = json.dumps(payload).encode()
+            except ValueError:
+                status, body = 400, json.dumps({"error": "limit and radius must be integers"}).encode()
+            self._send_json(status, body)
             return
         
         # Serve static files
         elif self.path == "/":
             self.path = "/index.html"
         
-        return SimpleHTTPRequestHandler.do_GET(self)
+        if not self._send_static():
+            SimpleHTTPRequestHandler.do_GET(self)
     
-    def do_POST(self):
-        if self.path == "/api/game/create_city":
-            content_length = int(self.headers.get("Content-Length", 0))
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode())
-            
-            city_id = data.get("address", f"city_{random.randint(1000,9999)}")
-            
-            # Create new city
-            game_state["cities"][city_id] = {
-                "id": city_id,
-                "owner": data.get("address", "anonymous"),
-                "name": data.get("name", "My City"),
-                "level": 1,
-                "population": 100,
-                "resources": {
-                    "gold": 1000,
-                    "wood": 500,
-                    "stone": 250,
-                    "food": 1000,
-                    "energy": 500,
-                },
-                "buildings": [],
-                "score": 100,
-                "ai_level": data.get("ai_level", 1),
-                "strategy": data.get("strategy", "balanced"),
-                "created_at": int(time.time()),
-            }
-            
-            game_state["resources"][city_id] = game_state["cities"][city_id]["resources"]
-            
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"status": "success", "city_id": city_id}).encode())
+    def do_HEAD(self):
+        if self.path in CATALOG_PAYLOADS:
+            self._send_payload(CATALOG_PAYLOADS[self.path], CATALOG_CACHE_CONTROL)
+            return
+        if self.path == "/":
+            self.path = "/index.html"
+        if not self._send_static():
+            SimpleHTTPRequestHandler.do_HEAD(self)
+    
+    def _subscribe(self, query):
+        """
+        Turn this connection into a Server-Sent Events stream owned by events.
+        
+        ?cities=a,b limits it to those cities, and starts it with their
+        current documents. Without it every change in the world is sent,
+        starting with what changed after ?since= (or Last-Event-ID on a
+        reconnect); with neither, it starts at the current version, and
+        ?since=0 starts it with the whole world.
+        """
+        if not hasattr(self.server, "detach"):
+            self._send_json(501, json.dumps({"error": "events need the threaded or prefork mode"}).encode())
+            return
+        since = query.get("since", self.headers.get("Last-Event-ID"))
+        try:
+            since = None if since is None else int(since)
+        except ValueError:
+            self._send_json(400, json.dumps({"error": "since must be an integer"}).encode())
+            return
+        watched = None
+        if "cities" in query:
+            watched = [city_id for city_id in query["cities"].split(",") if city_id]
+        if events.full():
+            self._shed(503, "subscribers", "Too many event subscribers, retry later", RETRY_AFTER_SECONDS)
             return
         
-        elif self.path == "/api/game/build":
-            content_length = int(self.headers.get("Content-Length", 0))
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode())
-            
-            city_id = data.get("city_id")
-            building_type = data.get("building_type")
-            
-            if city_id not in game_state["cities"]:
-                self.send_response(404)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "City not found"}).encode())
-                return
-            
-            city = game_state["cities"][city_id]
-            cost = BUILDINGS[building_type]["cost"]
-            
-            # Check resources
-            for resource, amount in cost.items():
-                if city["resources"].get(resource, 0) < amount:
-                    self.send_response(400)
-                    self.send_header("Content-type", "application/json")
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"error": f"Insufficient {resource}"}).encode())
-                    return
-            
-            # Deduct resources
-            for resource, amount in cost.items():
-                city["resources"][resource] -= amount
-            
-            # Add building
-            building = {
-                "id": f"building_{random.randint(10000, 99999)}",
-                "type": building_type,
-                "level": 1,
-                "emoji": BUILDINGS[building_type]["emoji"],
-            }
-            city["buildings"].append(building)
-            
-            # Update population
-            bonus = BUILDINGS[building_type]["bonus"]
-            city["population"] += bonus.get("population", 0)
-            
-            # Update score
-            city["score"] += 10
-            
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Accel-Buffering", "no")
+        self.end_headers()
+        self.wfile.flush()
+        if events.subscribe(self.connection, watched, since):
+            self.server.detach(self.connection)
+    
+    def send_header(self, keyword, value):
+        if keyword.lower() == "connection":
+            self._sent_connection = True
+        super().send_header(keyword, value)
+    
+    def end_headers(self):
+        # A response that already named its Connection header (the HTTP/1.0
+        # stream, a shed or a misrouted request) keeps the one it sent
+        sent, self._sent_connection = self._sent_connection, False
+        if not sent and not self.close_connection and not getattr(self.server, "has_idle_workers", lambda: False)():
+            self.send_header("Connection", "close")
+            self._sent_connection = False
+        super().end_headers()
+    
+    def _send_json(self, status, body, headers=None):
+        """Send a JSON body with Content-Length, compressed if large and the client accepts it"""
+        coding = None
+        if len(body) >= COMPRESS_MIN_BYTES:
+            coding = negotiate_coding(self.headers.get("Accept-Encoding"))
+        if coding is not None:
+            packer = compressor(coding)
+            body = packer.compress(body) + packer.flush()
+        
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if coding is not None:
+            self.send_header("Content-Encoding", coding)
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_stream(self, chunks, headers):
+        """
+        Send a body produced incrementally by chunks, without knowing its length.
+        
+        HTTP/1.1 clients get chunked transfer encoding and keep the connection;
+        HTTP/1.0 clients get the raw bytes, delimited by closing it. Either
+        way the stream is compressed on the fly when the client accepts it.
+        """
+        chunked = self.request_version == "HTTP/1.1"
+        coding = negotiate_coding(self.headers.get("Accept-Encoding"))
+        packer = compressor(coding) if coding is not None else None
+        if not chunked:
+            self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-type", "application/json")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if coding is not None:
+            self.send_header("Content-Encoding", coding)
+            self.send_header("Vary", "Accept-Encoding")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        
+        def write(data):
+            if chunked and data:
+                self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+            elif data:
+                self.wfile.write(data)
+        
+        for chunk in chunks:
+            write(packer.compress(chunk) if packer is not None else chunk)
+        if packer is not None:
+            write(packer.flush())
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+    
+    def _send_payload(self, payload, cache_control):
+        """Send a pre-encoded payload, or 304 if the client's copy is current"""
+        use_gzip = payload.gzip is not None and "gzip" in accepted_encodings(self.headers.get("Accept-Encoding"))
+        body, etag = (payload.gzip, payload.gzip_etag) if use_gzip else (payload.body, payload.etag)
+        
+        if etag_matches(self.headers.get("If-None-Match"), payload.etag, payload.gzip_etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+            self.send_header("Vary", "Accept-Encoding")
             self.end_headers()
-            self.wfile.write(json.dumps({"status": "success", "city": city}).encode())
             return
         
-        elif self.path == "/api/game/tick":
-            content_length = int(self.headers.get("Content-Length", 0))
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode())
-            
-            city_id = data.get("city_id")
-            
-            if city_id not in game_state["cities"]:
-                self.send_response(404)
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "City not found"}).encode())
-                return
-            
-            city = game_state["cities"][city_id]
-            ai_bonus = 1 + (city["ai_level"] * 0.1)
-            
-            # Calculate production
-            production = {"gold": 0, "wood": 0, "stone": 0, "food": 0, "energy": 0}
-            
-            for building in city["buildings"]:
-                building_type = building["type"]
-                if building_type in BUILDINGS:
-                    for resource, amount in BUILDINGS[building_type]["production"].items():
-                        production[resource] += int(amount * ai_bonus)
-            
-            # Update resources
-            for resource, amount in production.items():
-                city["resources"][resource] += amount
-            
-            # Population growth
-            if city["resources"]["food"] > city["population"] * 2:
-                growth = int(city["population"] * 0.05 * ai_bonus)
-            else:
-                growth = int(city["population"] * 0.02)
-            
-            city["population"] += growth
-            
-            # Update score
-            city["score"] += int(city["population"] / 100)
-            
+        self.send_response(200)
+        self.send_header("Content-type", payload.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+    
+    def _send_static(self):
+        """
+        Send a regular file through static_files; False leaves the request
+        (directories, missing files) to SimpleHTTPRequestHandler.
+        """
+        if static_files is None:
+            return False
+        asset = static_files.get(self.translate_path(self.path))
+        if asset is None:
+            return False
+        if asset.not_modified(self.headers.get("If-None-Match"), self.headers.get("If-Modified-Since")):
+            self.send_response(304)
+            self.send_header("ETag", asset.etag)
+            self.send_header("Cache-Control", STATIC_CACHE_CONTROL)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return True
+        if asset.body is None:
+            return self._send_file(asset)
+        
+        use_gzip = asset.gzip is not None and "gzip" in accepted_encodings(self.headers.get("Accept-Encoding"))
+        body, etag = (asset.gzip, asset.gzip_etag) if use_gzip else (asset.body, asset.etag)
+        self.send_response(200)
+        for name, value in asset.headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+        return True
+    
+    def _send_file(self, asset):
+        """Send an asset too large to cache straight from disk with sendfile"""
+        try:
+            f = open(asset.path, "rb")
+        except OSError:
+            return False
+        with f:
+            # The file may have changed since it was validated: send what is there now
+            size = os.fstat(f.fileno()).st_size
             self.send_response(200)
-            self.send_header("Content-type", "application/json")
+            for name, value in asset.headers:
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(size))
+            self.send_header("ETag", asset.etag)
             self.end_headers()
-            self.wfile.write(json.dumps({"status": "success", "city": city, "production": production}).encode())
+            if self.command != "HEAD":
+                self.wfile.flush()
+                sent = self.connection.sendfile(f, 0, size)
+                self.wfile.written += sent
+                if sent < size:
+                    # Truncated under us: the client cannot tell where this body ends
+                    self.close_connection = True
+        return True
+    
+    def do_POST(self):
+        if self.path not in POST_ACTIONS:
+            self._send_json(404, json.dumps({"error": "Not found"}).encode())
+            return
+        
+        content_length = int(self.headers.get("Content-Length", 0))
+        post_data = self.rfile.read(content_length)
+        # tick_all takes no body
+        data = json.loads(post_data.decode()) if self.path != "/api/game/tick_all" else None
+        
+        status, payload = post_action(self.path, data)
+        self._send_json(status, json.dumps(payload).encode())
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands each accepted connection to a fixed worker pool.
+    
+    At most ``workers`` requests are in flight. Requests beyond that wait in
+    AdmissionControl's queue of queue_depth, and the pool has a thread for
+    each running or queued request. A connection arriving when every thread
+    is taken gets an immediate 503 from the accept loop, so nothing ages in
+    the listen backlog. With queue_depth=0 there is no admission control:
+    the pool has ``workers`` threads and the accept loop blocks until one
+    frees up. rate_limit (requests/s per client address, bursts of `burst`)
+    adds a token bucket per address: each request takes a token, and the
+    accept loop answers 429 to connections from an address with none left,
+    so a flood from one address never occupies the threads.
+    
+    With reuse_port, several processes can each bind their own socket to
+    the same port (SO_REUSEPORT) and the kernel spreads connections across
+    them.
+    
+    A handler can detach() its connection to pass it on (Server-Sent Events
+    subscribers go to the EventHub); the worker is then freed and the
+    socket is left open.
+    """
+    
+    allow_reuse_address = True
+    request_queue_size = 128
+    
+    def __init__(self, server_address, handler_class, workers=None, reuse_port=False,
+                 queue_depth=DEFAULT_QUEUE_DEPTH, queue_timeout=DEFAULT_QUEUE_TIMEOUT, rate_limit=0.0, burst=None,
+                 bind_and_activate=True):
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.reuse_port = reuse_port
+        self.admission = AdmissionControl(self.workers, queue_depth, queue_timeout) if queue_depth > 0 else None
+        self.rate_limiter = RateLimiter(rate_limit, burst or max(1.0, rate_limit)) if rate_limit > 0 else None
+        self.connections = self.workers + max(0, queue_depth)
+        self._slots = threading.BoundedSemaphore(self.connections)
+        self._open = 0
+        self._open_lock = threading.Lock()
+        self._detached = set()
+        self._draining = False
+        self._pool = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="demo-worker")
+        super().__init__(server_address, handler_class, bind_and_activate)
+    
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+    
+    def has_idle_workers(self):
+        """Whether another connection could be served right now; keep-alive is only offered while it could"""
+        return self._open < self.connections and not self._draining
+    
+    def drain(self):
+        """Once serve_forever() has returned: finish every accepted connection, ending keep-alive"""
+        self._draining = True
+        self._pool.shutdown(wait=True)
+    
+    def process_request(self, request, client_address):
+        if self.rate_limiter is not None and self.rate_limiter.limited(client_address[0]):
+            self._refuse(request, RATE_LIMITED_RESPONSE, "rate_limited")
             return
+        if not self._slots.acquire(blocking=False):
+            if self.admission is not None:
+                self._refuse(request, OVERLOADED_RESPONSE, "connections")
+                return
+            self._slots.acquire()
+        with self._open_lock:
+            self._open += 1
+        try:
+            self._pool.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:
+            # Pool already shut down
+            self._closed()
+            self.shutdown_request(request)
+    
+    def _refuse(self, request, response, reason):
+        """Answer a canned 503 or 429 from the accept loop, without a thread"""
+        if metrics is not None:
+            metrics.shed(reason)
+        try:
+            # Read what already arrived, so closing does not reset the
+            # connection before the client sees the reply
+            request.setblocking(False)
+            request.recv(65536)
+        except OSError:
+            pass
+        try:
+            request.send(response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+    
+    def _closed(self):
+        with self._open_lock:
+            self._open -= 1
+        self._slots.release()
+    
+    def detach(self, request):
+        """Keep request open after its handler returns; whoever it is handed to closes it"""
+        with self._open_lock:
+            self._detached.add(request)
+    
+    def shutdown_request(self, request):
+        with self._open_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+        super().shutdown_request(request)
+    
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._closed()
+    
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+
+SERVER_MODES = ("single", "threaded", "prefork")
+
+
+def make_server(port=8080, mode="threaded", workers=None, host="0.0.0.0", **limits):
+    """
+    Build (but do not start) the demo server for the given serving mode; for prefork, one process's.
+    
+    limits (queue_depth, queue_timeout, rate_limit, burst) go to PooledHTTPServer;
+    single mode has no admission control.
+    """
+    if mode == "single":
+        return HTTPServer((host, int(port)), GameHandler)
+    if mode == "threaded":
+        return PooledHTTPServer((host, int(port)), GameHandler, workers=workers, **limits)
+    if mode == "prefork":
+        return PooledHTTPServer((host, int(port)), GameHandler, workers=workers, reuse_port=True, **limits)
+    raise ValueError(f"Unknown server mode: {mode}")
+
+def enable_persistence(data_dir, snapshot_interval=60.0, commit_delay=0.002):
+    """Recover state from data_dir and log every action there from now on"""
+    global persistence
+    store = Persistence(data_dir, snapshot_interval=snapshot_interval, commit_delay=commit_delay)
+    started = time.perf_counter()
+    snapshot_seq, replayed = store.recover()
+    persistence = store
+    store.start()
+    return snapshot_seq, replayed, time.perf_counter() - started
+
+
+DEFAULT_MAX_CITIES = 100_000
+
+
+def share_world(max_cities, processes):
+    """
+    Move the store into shared memory before forking pre-fork workers.
+    
+    Returns (SharedWorld, SharedJournal or None). With persistence, actions
+    from every process reach the parent's log through the journal.
+    """
+    with state_lock:
+        arrays = cities.to_arrays()
+        count = len(arrays["strings"][0])
+        capacity = max(max_cities, count + count // 4)
+        buildings = max(16 * capacity, len(arrays["building_code"]) * 5 // 4)
+        world = SharedWorld(capacity, buildings, 256 * capacity)
+        use_store(SharedCityStore.from_arrays(world, arrays))
+    journal = None
+    if persistence is not None:
+        journal = SharedJournal(world, processes)
+        journal.start(persistence.log)
+        persistence.shared = journal
+    return world, journal
+
+
+def use_store(store):
+    """Serve game_state from store from now on"""
+    global cities
+    cities = store
+    game_state["cities"] = store
+    game_state["resources"] = CityResources(store)
+
+
+def fork_workers(port, processes, workers, journal, world=None, limits=None):
+    """
+    Fork pre-fork workers serving port; returns {pid: index}.
+    
+    Pass world if the parent runs a scheduler. limits are make_server's;
+    every process has its own admission queue and rate limiter.
+    """
+    children = {}
+    for index in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _prefork_worker(index, port, workers, journal, world, limits or {})
+            finally:
+                os._exit(1)
+        children[pid] = index
+    if journal is not None:
+        journal.forked()
+    return children
+
+
+def _prefork_worker(index, port, workers, journal, world, limits):
+    """Body of one pre-fork worker process; exits the process when done"""
+    global persistence, scheduler
+    parent = os.getppid()
+    # Workers must not hand out the same random city ids
+    sim_random.seed(None if simulation_seed is None else f"{simulation_seed}/{index}")
+    scheduler = SchedulerMirror(world) if world is not None else None
+    if journal is not None:
+        journal.attach_worker(index)
+        persistence = journal
+    server = make_server(port, mode="prefork", workers=workers, **limits)
+    stopping = threading.Event()
+    
+    def stop(*_):
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=server.shutdown, daemon=True).start()
+    
+    def watch_parent():
+        # Nobody is left to log our actions once the parent is gone
+        while not stopping.wait(1.0):
+            if os.getppid() != parent:
+                os._exit(1)
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    threading.Thread(target=watch_parent, daemon=True).start()
+    server.serve_forever()
+    # No thread may die holding a shard lock: the other processes share them
+    server.drain()
+    server.socket.close()
+    os._exit(0)
+
+
+def stop_workers(children):
+    """Ask every worker to finish its requests and exit, and reap them"""
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in list(children):
+        os.waitpid(pid, 0)
+        del children[pid]
+
+
+# ═══════════════════════════════════════════════════════════════
+#    Worlds: one process per world, routed by world id
+# ═══════════════════════════════════════════════════════════════
+
+WORLD_PREFIX = "/worlds/"
+WORLD_NAME_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-")
+ROUTER_PEEK_BYTES = 8192
+ROUTER_PEEK_TIMEOUT = 5.0
+ROUTER_THREADS = 4
+
+# Set in a world's process: the id it answers /worlds/<id>/ for
+world_name = None
+
+
+def parse_worlds(spec, tick_rate=0.0):
+    """ "eu,us:2" -> [("eu", tick_rate), ("us", 2.0)]: world ids, each with an optional tick rate"""
+    worlds = []
+    for item in spec.split(","):
+        name, _, rate = item.strip().partition(":")
+        if not name or not set(name) <= WORLD_NAME_CHARS:
+            raise ValueError(f"bad world id {name!r}: use letters, digits, '_' and '-'")
+        if name in dict(worlds):
+            raise ValueError(f"world {name!r} given twice")
+        worlds.append((name, float(rate) if rate else tick_rate))
+    return worlds
 
-def run_demo(port=8080):
-    """Run the game demo server"""
+
+def split_world(path):
+    """ "/worlds/eu/api/game/state" -> ("eu", "/api/game/state"); (None, path) without the prefix"""
+    if not path.startswith(WORLD_PREFIX):
+        return None, path
+    rest = path[len(WORLD_PREFIX):]
+    end = len(rest)
+    for separator in "/?":
+        found = rest.find(separator)
+        if found >= 0:
+            end = min(end, found)
+    rest, name = rest[end:], rest[:end]
+    return name, rest if rest.startswith("/") else "/" + rest
+
+
+class WorldRouter(socketserver.TCPServer):
+    """
+    Front of a multi-world server: sends each connection to its world's process.
+    
+    Every world runs in its own process with its own city store,
+    leaderboard, scheduler and log. The router peeks at a new
+    connection's request line (without consuming it), picks the world
+    from a /worlds/<id>/ prefix (unprefixed paths go to the default
+    world) and passes the socket itself to that process over a Unix
+    socket, so the world reads the request and answers the client
+    directly; the router never copies bytes. GET /worlds lists the
+    worlds. A connection stays with its world: a world answers 421 to a
+    request for another one.
+    """
+    
+    allow_reuse_address = True
+    request_queue_size = 128
+    
+    def __init__(self, server_address, channels, default):
+        self.channels = channels
+        self.default = default
+        self._send_locks = {name: threading.Lock() for name in channels}
+        self._pool = ThreadPoolExecutor(max_workers=ROUTER_THREADS, thread_name_prefix="router")
+        super().__init__(server_address, socketserver.BaseRequestHandler)
+    
+    def process_request(self, request, client_address):
+        # Peeking can wait on a slow client, so it happens off the accept loop
+        self._pool.submit(self._route, request)
+    
+    def _route(self, request):
+        try:
+            line = self._request_line(request)
+            if line is None:
+                return
+            parts = line.split()
+            path = parts[1] if len(parts) == 3 else "/"
+            name, rest = split_world(path)
+            if name is None and path.partition("?")[0] in ("/worlds", "/worlds/"):
+                self._answer(request, 200, {"worlds": list(self.channels), "default": self.default})
+                return
+            name = self.default if name is None else name
+            if name not in self.channels:
+                self._answer(request, 404, {"error": f"no world {name!r}", "worlds": list(self.channels)})
+                return
+            request.settimeout(None)
+            with self._send_locks[name]:
+                socket.send_fds(self.channels[name], [b"c"], [request.fileno()])
+        except OSError:
+            if metrics is not None:
+                metrics.shed("world_unavailable")
+        finally:
+            request.close()
+    
+    @staticmethod
+    def _request_line(request):
+        """The first request's line, still unread on the socket; None if it never came"""
+        request.settimeout(ROUTER_PEEK_TIMEOUT)
+        deadline = time.monotonic() + ROUTER_PEEK_TIMEOUT
+        while True:
+            data = request.recv(ROUTER_PEEK_BYTES, socket.MSG_PEEK)
+            end = data.find(b"\n")
+            if end >= 0:
+                return data[:end].decode("latin-1")
+            if not data or len(data) >= ROUTER_PEEK_BYTES or time.monotonic() > deadline:
+                return None
+            # More is on its way; MSG_PEEK would return what is there at once
+            time.sleep(0.001)
+    
+    @staticmethod
+    def _answer(request, status, payload):
+        body = json.dumps(payload).encode()
+        reason = "OK" if status == 200 else "Not Found"
+        request.sendall(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+        for channel in self.channels.values():
+            channel.close()
+
+
+def fork_worlds(worlds, workers, data_dir, snapshot_interval, commit_delay, tick_slices, limits):
+    """
+    Fork one process per (name, tick_rate) in worlds; returns ({pid: name}, {name: channel}).
+    
+    Each world recovers from and logs to data_dir/<name>, ticks at its own
+    rate and serves the connections the router sends down its channel.
+    """
+    children, channels = {}, {}
+    for name, tick_rate in worlds:
+        parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                parent_end.close()
+                for channel in channels.values():
+                    channel.close()
+                _world_process(name, child_end, tick_rate, workers, data_dir, snapshot_interval, commit_delay,
+                               tick_slices, limits)
+            finally:
+                os._exit(1)
+        child_end.close()
+        children[pid] = name
+        channels[name] = parent_end
+    return children, channels
+
+
+def _world_process(name, channel, tick_rate, workers, data_dir, snapshot_interval, commit_delay, tick_slices, limits):
+    """Body of one world's process; exits the process when done"""
+    global world_name, scheduler
+    world_name = name
+    sim_random.seed(None if simulation_seed is None else f"{simulation_seed}/{name}")
+    parent = os.getppid()
+    if data_dir:
+        directory = os.path.join(data_dir, name)
+        os.makedirs(directory, exist_ok=True)
+        snapshot_seq, replayed, elapsed = enable_persistence(directory, snapshot_interval, commit_delay)
+        print(f"💾 World {name}: recovered {len(cities)} cities from {directory} "
+              f"(snapshot @{snapshot_seq} + {replayed} logged actions, {elapsed:.2f}s)")
+    # Not bound to a port: connections arrive from the router
+    server = PooledHTTPServer(("", 0), GameHandler, workers=workers, bind_and_activate=False, **limits)
+    if tick_rate > 0:
+        scheduler = TickScheduler(tick_rate, tick_slices)
+        scheduler.on_cycle = events.wake
+        scheduler.start()
+    stopping = threading.Event()
+    
+    def receive():
+        while True:
+            try:
+                _, fds, _, _ = socket.recv_fds(channel, 1, 16)
+            except OSError:
+                fds = None
+            if not fds:
+                # The router is gone
+                break
+            for fd in fds:
+                request = socket.socket(fileno=fd)
+                try:
+                    client_address = request.getpeername()
+                except OSError:
+                    request.close()
+                    continue
+                server.process_request(request, client_address)
+        stopping.set()
+    
+    def watch_parent():
+        while not stopping.wait(1.0):
+            if os.getppid() != parent:
+                stopping.set()
+    
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    threading.Thread(target=receive, name="world-channel", daemon=True).start()
+    threading.Thread(target=watch_parent, daemon=True).start()
+    while not stopping.is_set():
+        stopping.wait(1.0)
+    channel.close()
+    server.drain()
+    if scheduler is not None:
+        scheduler.stop()
+    events.stop()
+    if persistence is not None:
+        persistence.close()
+    os._exit(0)
+
+
+def run_demo(port=8080, mode="threaded", workers=None, data_dir=None, snapshot_interval=60.0, commit_delay_ms=2.0,
+             tick_rate=0.0, tick_slices=10, collect_metrics=True, shards=DEFAULT_SHARDS,
+             processes=None, max_cities=DEFAULT_MAX_CITIES, queue_depth=DEFAULT_QUEUE_DEPTH,
+             queue_timeout_ms=DEFAULT_QUEUE_TIMEOUT * 1000, rate_limit=0.0, burst=None, static_cache=True,
+             events_interval_ms=EVENTS_INTERVAL * 1000, seed=None, worlds=None):
+    """Run the game demo server; worlds ("eu,us:2") serves several, one process each"""
+    global scheduler, metrics, static_files
     port = int(port)
-    server = HTTPServer(("0.0.0.0", port), GameHandler)
+    if worlds:
+        worlds = parse_worlds(worlds, tick_rate)
+        if mode != "threaded":
+            raise ValueError("worlds are served in threaded mode, one process per world")
+    if not collect_metrics:
+        metrics = None
+    if static_cache:
+        static_files.preload(os.getcwd())
+    else:
+        static_files = None
+    prefork = mode == "prefork"
+    state_lock.resize(shards, multiprocessing.RLock if prefork else threading.RLock)
+    if data_dir and not worlds:
+        snapshot_seq, replayed, elapsed = enable_persistence(data_dir, snapshot_interval, commit_delay_ms / 1000)
+        print(f"💾 Recovered {len(cities)} cities from {data_dir} "
+              f"(snapshot @{snapshot_seq} + {replayed} logged actions, {elapsed:.2f}s)")
+    events.interval = events_interval_ms / 1000
+    if seed is not None:
+        seed_simulation(seed)
+    if tick_rate > 0 and not worlds:
+        scheduler = TickScheduler(tick_rate, tick_slices)
+        if not prefork:
+            # Push each cycle's changes as soon as it ends
+            scheduler.on_cycle = events.wake
+    limits = dict(queue_depth=queue_depth, queue_timeout=queue_timeout_ms / 1000, rate_limit=rate_limit, burst=burst)
+    world = children = server = None
+    if worlds:
+        children, channels = fork_worlds(worlds, workers, data_dir, snapshot_interval, commit_delay_ms / 1000,
+                                         tick_slices, limits)
+        server = WorldRouter(("0.0.0.0", port), channels, default=worlds[0][0])
+        threads = workers or min(32, (os.cpu_count() or 1) + 4)
+        serving = f"{len(worlds)} worlds ({len(worlds)} processes x {threads} workers)"
+        for name, rate in worlds:
+            print(f"🌍 World {name}: /worlds/{name}/..." + (f", ticking {rate:g}x per second" if rate > 0 else ""))
+    elif prefork:
+        processes = processes or os.cpu_count() or 1
+        world, journal = share_world(max_cities, processes)
+        if scheduler is not None:
+            # The scheduler runs here in the parent; workers serve its published stats
+            scheduler.on_cycle = functools.partial(SchedulerMirror.publish, world)
+            SchedulerMirror.publish(world, scheduler)
+        # Fork before starting the scheduler, so workers never inherit its thread
+        children = fork_workers(port, processes, workers, journal, world if scheduler is not None else None, limits)
+        threads = workers or min(32, (os.cpu_count() or 1) + 4)
+        serving = f"prefork ({processes} processes x {threads} workers)"
+    else:
+        server = make_server(port, mode=mode, workers=workers, **limits)
+        serving = f"{mode} ({server.workers} workers)" if mode == "threaded" else mode
+    serving += f", {len(state_lock)} shards"
+    if scheduler is not None:
+        scheduler.start()
+        print(f"⏱️  Ticking every city {tick_rate:g}x per second in {scheduler.slices} slices")
     
     print(f"""
 ╔══════════════════════════════════════════════════════════════════╗
 ║          🏙️  Solana AI City - Demo Server Started!           ║
 ╠══════════════════════════════════════════════════════════════════╣
 ║  🚀 Server running at: http://localhost:{port}                ║
+║  🧵 Serving mode: {serving:<42}║
 ║  📊 API Endpoints:                                          ║
 ║     - GET  /api/game/state   - Get game state               ║
+║     - GET  /api/game/state?since= - Cities changed since    ║
+║     - GET  /api/game/state?cursor=&limit= - One page        ║
 ║     - GET  /api/resources   - Get resources                 ║
 ║     - GET  /api/buildings   - Get buildings                ║
 ║     - GET  /api/leaderboard - Get leaderboard              ║
+║     - GET  /api/leaderboard/rank?city_id=  - Rank of a city   ║
+║     - GET  /api/leaderboard/around?city_id= - Nearby ranks    ║
+║     - GET  /api/game/city/buildings?city_id= - Building list  ║
 ║     - POST /api/game/create_city - Create city              ║
 ║     - POST /api/game/build   - Build structure             ║
+║     - POST /api/game/build_batch - Many builds, all or none ║
 ║     - POST /api/game/tick    - Process game cycle          ║
+║     - POST /api/game/tick_all - Process cycle for all cities ║
+║     - GET  /api/game/scheduler - Tick duration and lag      ║
+║     - GET  /api/game/events  - Pushed changes (SSE)         ║
+║     - GET  /worlds, /worlds/<id>/api/... - Worlds (--worlds)  ║
+║     - GET  /metrics          - Prometheus metrics           ║
 ╠══════════════════════════════════════════════════════════════════╣
 ║  💡 Try these curl commands:                                 ║
 ║                                                             ║
@@ -250,12 +4332,126 @@ def run_demo(port=8080):
     """)
     
     try:
-        server.serve_forever()
+        if server is not None:
+            server.serve_forever()
+        else:
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            pid, status = os.wait()
+            index = children.pop(pid)
+            if status != 0:
+                _abandon_workers(index, status, children, world)
+            print(f"🛑 Worker {index} exited; stopping the others")
+            raise KeyboardInterrupt
     except KeyboardInterrupt:
         print("\n🛑 Server stopped")
-        server.server_close()
+        if server is not None:
+            server.server_close()
+        if scheduler is not None:
+            scheduler.stop()
+        events.stop()
+        if children:
+            stop_workers(children)
+        if persistence is not None:
+            persistence.close()
+        if world is not None:
+            world.unlink()
+
+
+def _abandon_workers(index, status, children, world):
+    """
+    A pre-fork worker died mid-flight, maybe holding shard locks: stop at once.
+    
+    Kills the other workers, keeps what reached the log (a consistent prefix
+    of the actions) and exits without a final snapshot.
+    """
+    print(f"💥 Worker {index} died (wait status {status}); shutting down without a final snapshot")
+    for pid in children:
+        os.kill(pid, signal.SIGKILL)
+    for pid in children:
+        os.waitpid(pid, 0)
+    if persistence is not None:
+        persistence.log.close()
+    world.unlink()
+    sys.exit(1)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Solana AI City demo server")
+    parser.add_argument("port", nargs="?", default="8080", help="port to listen on (default: 8080)")
+    parser.add_argument("--mode", choices=SERVER_MODES, default="threaded",
+                        help="single: one request at a time; threaded: bounded worker pool (default); "
+                             "prefork: --processes worker processes sharing the world in shared memory")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker threads in threaded mode, or per process in prefork mode "
+                             "(default: min(32, cpus + 4))")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes in prefork mode (default: cpus)")
+    parser.add_argument("--max-cities", type=int, default=DEFAULT_MAX_CITIES,
+                        help=f"cities the shared world has room for in prefork mode (default: {DEFAULT_MAX_CITIES})")
+    parser.add_argument("--data-dir", default=None,
+                        help="persist cities to this directory (action log + snapshots); in-memory only if unset")
+    parser.add_argument("--snapshot-interval", type=float, default=60.0,
+                        help="seconds between snapshots with --data-dir (0 disables periodic snapshots)")
+    parser.add_argument("--commit-delay-ms", type=float, default=2.0,
+                        help="how long the log writer waits to group concurrent commits")
+    parser.add_argument("--tick-rate", type=float, default=0.0,
+                        help="world ticks per second driven by the server (default 0: only clients tick)")
+    parser.add_argument("--tick-slices", type=int, default=10,
+                        help="steps each scheduled tick is spread over, to keep lock holds short")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS,
+                        help=f"city state shards, each with its own lock (default: {DEFAULT_SHARDS})")
+    parser.add_argument("--queue-depth", type=int, default=DEFAULT_QUEUE_DEPTH,
+                        help="requests that may wait for a busy worker before the rest get 503 "
+                             f"(default: {DEFAULT_QUEUE_DEPTH}; 0 disables admission control)")
+    parser.add_argument("--queue-timeout-ms", type=float, default=DEFAULT_QUEUE_TIMEOUT * 1000,
+                        help="longest a queued request waits for a worker before it gets 503 "
+                             f"(default: {DEFAULT_QUEUE_TIMEOUT * 1000:g})")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="requests per second allowed from each client address, 429 beyond (default 0: no limit)")
+    parser.add_argument("--burst", type=float, default=None,
+                        help="requests a client address may send at once with --rate-limit (default: one second's worth)")
+    parser.add_argument("--events-interval-ms", type=float, default=EVENTS_INTERVAL * 1000,
+                        help="how often changes are pushed to /api/game/events subscribers "
+                             f"(default: {EVENTS_INTERVAL * 1000:g}; with --tick-rate, also after every tick)")
+    parser.add_argument("--worlds", default=None, metavar="ID[:RATE],...",
+                        help="serve several independent worlds, one process each, at /worlds/<id>/...; "
+                             "unprefixed paths go to the first. RATE overrides --tick-rate for that world")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed the simulation's randomness and freeze its clock, for reproducible runs")
+    parser.add_argument("--no-metrics", action="store_true",
+                        help="skip per-request instrumentation and disable /metrics")
+    parser.add_argument("--no-static-cache", action="store_true",
+                        help="read static files from disk on every request instead of caching them in memory")
+    parser.add_argument("--export", metavar="PATH", default=None,
+                        help="write the full state of --data-dir to PATH ('-' for stdout) and exit")
+    return parser.parse_args(argv)
+
+
+def run_export(data_dir, path):
+    """Recover data_dir and stream its state document to path without starting a server"""
+    if data_dir:
+        enable_persistence(data_dir, snapshot_interval=0)
+    try:
+        if path == "-":
+            written = export_state(sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        else:
+            with open(path, "wb") as f:
+                written = export_state(f)
+        print(f"📦 Exported {len(cities)} cities ({written} bytes) to {path}", file=sys.stderr)
+    finally:
+        if persistence is not None:
+            persistence.close()
+
 
 if __name__ == "__main__":
-    import sys
-    port = sys.argv[1] if len(sys.argv) > 1 else "8080"
-    run_demo(port)
+    args = parse_args()
+    if args.export:
+        run_export(args.data_dir, args.export)
+        sys.exit(0)
+    run_demo(args.port, mode=args.mode, workers=args.workers, data_dir=args.data_dir,
+             snapshot_interval=args.snapshot_interval, commit_delay_ms=args.commit_delay_ms,
+             tick_rate=args.tick_rate, tick_slices=args.tick_slices, collect_metrics=not args.no_metrics,
+             shards=args.shards, processes=args.processes, max_cities=args.max_cities,
+             queue_depth=args.queue_depth, queue_timeout_ms=args.queue_timeout_ms,
+             rate_limit=args.rate_limit, burst=args.burst, static_cache=not args.no_static_cache,
+             events_interval_ms=args.events_interval_ms, seed=args.seed, worlds=args.worlds)
@@ -0,0 +1,37 @@
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import demo_server  # noqa: E402
+
+
+@pytest.fixture
+def fresh_world(monkeypatch):
+    """An empty module-level CityStore with persistence switched off"""
+    monkeypatch.setattr(demo_server, "cities", demo_server.CityStore())
+    monkeypatch.setattr(demo_server, "persistence", None)
+    return demo_server
+
+
+@pytest.fixture
+def make_world():
+    """Factory for a CityStore of `count` cities with random buildings, ai levels and food"""
+    def make(count, seed=0):
+        rng = random.Random(seed)
+        store = demo_server.CityStore()
+        for i in range(count):
+            row = store.create(f"city-{i}", f"owner-{i}", f"City {i}", rng.choice([0, 1, 2, 3, 5, 7.5, 10]),
+                               rng.choice(["balanced", "economy", "military"]), 0)
+            for _ in range(rng.randrange(6)):
+                store.build_many(row, rng.randrange(len(demo_server.BUILDING_TYPES)), rng.randrange(1, 4))
+            # Some cities start hungry, so both growth rules are exercised
+            if rng.random() < 0.3:
+                store.resources[row, demo_server.FOOD] = rng.randrange(0, 400)
+        return store
+    return make
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from ai.ai_manager import AICityManager, CityState, CityStateBatch, CityStrategy
+
+
+def random_cities(count, seed):
+    rng = np.random.default_rng(seed)
+    states, resources = [], []
+    for _ in range(count):
+        available = {r: int(rng.integers(0, 600)) for r in ('gold', 'wood', 'stone', 'food', 'energy')}
+        states.append(CityState(
+            resources=available,
+            population=int(rng.integers(0, 20000)),
+            buildings={b: int(rng.integers(0, 40)) for b in ('house', 'farm', 'mine', 'factory') if rng.random() < 0.7},
+            score=int(rng.integers(0, 200000)),
+            cycle=int(rng.integers(0, 1000)),
+        ))
+        resources.append(available)
+    # Nothing affordable, and exactly the cheapest building's cost
+    resources[0] = {'gold': 0, 'wood': 0, 'stone': 0}
+    resources[1] = {'gold': 50, 'wood': 100, 'stone': 0}
+    return states, resources
+
+
+@pytest.fixture
+def manager():
+    np.random.seed(24)
+    return AICityManager(ai_level=3)
+
+
+@pytest.mark.parametrize("strategy", list(CityStrategy))
+def test_get_optimal_builds_matches_get_optimal_build(manager, strategy):
+    manager.set_strategy(strategy)
+    states, resources = random_cities(500, seed=len(strategy.value))
+    expected = [manager.get_optimal_build(s, r) for s, r in zip(states, resources)]
+    
+    assert manager.get_optimal_builds(states, resources) == expected
+    
+    available = np.array([[r['gold'], r['wood'], r['stone']] for r in resources], dtype=np.float64)
+    assert manager.get_optimal_builds(states, available) == expected
+    
+    batch = CityStateBatch.from_states(states)
+    assert manager.get_optimal_builds(batch, resources) == expected
+
+
+def test_get_optimal_builds_of_nothing(manager):
+    assert manager.get_optimal_builds([], []) == []
+    with pytest.raises(ValueError):
+        manager.get_optimal_builds(random_cities(2, seed=0)[0], [])
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from demo_server import BUILDING_INDEX, FOOD, MAX_SAFE_INTEGER
+
+
+def stalled_world(make_world):
+    """
+    A random world plus cities whose population stands still for a while:
+    small hungry ones whose growth truncates to 0 until their farms lift
+    food past 2 x population, and ones saturated at MAX_SAFE_INTEGER
+    """
+    store = make_world(200, seed=3)
+    rng = np.random.default_rng(3)
+    for row in range(0, len(store), 4):
+        store.add_buildings(row, BUILDING_INDEX["farm"], 1)
+        store.building_counts[row, BUILDING_INDEX["farm"]] += 1
+        store.refresh_production(row)
+        store.population[row] = rng.integers(5, 50)
+        store.resources[row, FOOD] = rng.integers(0, 2 * store.population[row] + 1)
+    for row in range(1, len(store), 8):
+        store.population[row] = MAX_SAFE_INTEGER - int(rng.integers(0, 10))
+        store.resources[row] = MAX_SAFE_INTEGER - rng.integers(0, 50, size=store.resources.shape[1])
+        store.score[row] = MAX_SAFE_INTEGER - int(rng.integers(0, 1000))
+    return store
+
+
+@pytest.mark.parametrize("ticks", [2, 3, 17, 250, 4000])
+def test_catch_up_row_matches_repeated_ticks(make_world, ticks):
+    stepped, caught_up = stalled_world(make_world), stalled_world(make_world)
+    fed_before = stepped.resources[:, FOOD] > 2 * stepped.population
+    for row in range(len(stepped)):
+        for _ in range(ticks):
+            production = stepped.tick_row(row)
+        assert np.array_equal(caught_up.catch_up_row(row, ticks), production)
+    n = len(stepped)
+    assert np.array_equal(caught_up.resources[:n], stepped.resources[:n])
+    assert np.array_equal(caught_up.population[:n], stepped.population[:n])
+    assert np.array_equal(caught_up.score[:n], stepped.score[:n])
+    # The food regime flipped mid catch-up for some of the hungry cities
+    fed_after = stepped.resources[:n, FOOD] > 2 * stepped.population[:n]
+    assert (fed_before[:n] != fed_after).any()
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from demo_server import MAX_SAFE_INTEGER, LeaderboardIndex
+
+
+def full_sort(scores):
+    """Rows by score, highest first, ties in row (creation) order"""
+    return sorted(range(len(scores)), key=lambda row: (-int(scores[row]), row))
+
+
+def assert_ordered(index, scores, rng):
+    expected = full_sort(scores)
+    n = len(expected)
+    assert len(index) == n
+    assert index.top(10) == expected[:10]
+    start = int(rng.integers(0, n))
+    assert index.slice(start, start + 25) == expected[start:start + 25]
+    for row in rng.choice(n, size=50, replace=False).tolist():
+        rank = expected.index(row)
+        assert index.rank(row) == rank
+        assert index.placing(row) == (rank, int(scores[row]))
+        assert index.around(row, 3) == (rank, expected[max(0, rank - 3):rank + 4])
+
+
+@pytest.mark.parametrize("high", [1000, MAX_SAFE_INTEGER])
+def test_index_matches_a_full_sort(high):
+    rng = np.random.default_rng(high % 997)
+    scores = rng.integers(0, high, size=2000, dtype=np.int64)
+    index = LeaderboardIndex(lambda: scores)
+    index.rebuild(scores)
+    assert_ordered(index, scores, rng)
+    
+    # Single updates, moved at once
+    for row in rng.integers(0, len(scores), size=300).tolist():
+        scores[row] = rng.integers(0, high)
+        index.update(row, scores[row])
+    assert_ordered(index, scores, rng)
+    
+    # Column writes reported in small batches, then one past the rebuild threshold
+    for size in (1, 40, 700, 5000):
+        rows = rng.integers(0, len(scores), size=size)
+        scores[rows] = rng.integers(0, high, size=size)
+        index.mark(rows)
+        assert_ordered(index, scores, rng)
+    
+    # A dropped index rebuilds from the source on first read
+    scores[:] = rng.integers(0, 50, size=len(scores))
+    index.defer()
+    assert_ordered(index, scores, rng)
+    
+    scores[::3] += 7
+    index.rebuild(scores)
+    assert_ordered(index, scores, rng)
+
+
+def test_store_leaderboard_follows_ticks_builds_and_resets(make_world):
+    store = make_world(500, seed=4)
+    rng = np.random.default_rng(4)
+    for cycle in range(10):
+        store.tick_rows(np.flatnonzero(rng.random(len(store)) < 0.5))
+        row = int(rng.integers(0, len(store)))
+        store.build_many(row, int(rng.integers(0, 6)), 2)
+        store.tick_row(int(rng.integers(0, len(store))))
+        if cycle % 3 == 0:
+            store.create(store.ids[row], "owner", "Reset", 1, "balanced", 0)
+        assert_ordered(store.leaderboard, store.score[:len(store)], rng)
@@ -0,0 +1,101 @@
+import io
+import os
+
+import pytest
+
+
+def start(ds, monkeypatch, directory):
+    """Recover directory into a fresh store and log to it, as enable_persistence does"""
+    monkeypatch.setattr(ds, "cities", ds.CityStore())
+    store = ds.Persistence(str(directory), snapshot_interval=0, commit_delay=0)
+    store.recover()
+    monkeypatch.setattr(ds, "persistence", store)
+    return store
+
+
+def crash(ds, monkeypatch, store):
+    """Stop logging without the closing snapshot a clean shutdown takes"""
+    store.log.close()
+    monkeypatch.setattr(ds, "persistence", None)
+
+
+def play(ds, first, count):
+    for i in range(first, first + count):
+        status, _ = ds.post_action("/api/game/create_city", {
+            "address": f"city-{i}", "name": f"City {i}", "ai_level": i % 5 + 1,
+            "strategy": ("balanced", "economy", "military")[i % 3]})
+        assert status == 200
+        status, _ = ds.post_action("/api/game/build", {"city_id": f"city-{i}", "building_type": "farm"})
+        assert status == 200
+    ds.post_action("/api/game/tick_all", {})
+    ds.post_action("/api/game/tick", {"city_id": f"city-{first}", "ticks": 3})
+
+
+def export(ds):
+    out = io.BytesIO()
+    ds.export_state(out)
+    return out.getvalue()
+
+
+def corrupt(path):
+    with open(path, "r+b") as f:
+        f.write(b"\0" * 8)
+
+
+def files(directory):
+    contents = {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "rb") as f:
+            contents[name] = f.read()
+    return contents
+
+
+def test_snapshot_and_log_replay_match_the_live_state(fresh_world, monkeypatch, tmp_path):
+    ds = fresh_world
+    store = start(ds, monkeypatch, tmp_path)
+    play(ds, 0, 30)
+    store.snapshot()
+    play(ds, 30, 10)
+    expected = export(ds)
+    crash(ds, monkeypatch, store)
+
+    store = start(ds, monkeypatch, tmp_path)
+    assert store.snapshot_seq > 0
+    assert export(ds) == expected
+    crash(ds, monkeypatch, store)
+
+
+def test_unreadable_snapshot_falls_back_when_the_log_covers_it(fresh_world, monkeypatch, tmp_path):
+    ds = fresh_world
+    store = start(ds, monkeypatch, tmp_path)
+    play(ds, 0, 20)
+    older = store.snapshot()
+    play(ds, 20, 10)
+    # Crash between writing the newer snapshot and deleting what it replaces
+    with monkeypatch.context() as m:
+        m.setattr(ds.os, "remove", lambda path: None)
+        newer = store.snapshot()
+    play(ds, 30, 5)
+    expected = export(ds)
+    crash(ds, monkeypatch, store)
+
+    corrupt(os.path.join(tmp_path, f"snapshot-{newer:012d}.city"))
+    store = start(ds, monkeypatch, tmp_path)
+    assert store.snapshot_seq == older
+    assert export(ds) == expected
+    crash(ds, monkeypatch, store)
+
+
+def test_unreadable_snapshot_without_log_coverage_refuses_to_start(fresh_world, monkeypatch, tmp_path):
+    ds = fresh_world
+    store = start(ds, monkeypatch, tmp_path)
+    play(ds, 0, 20)
+    seq = store.snapshot()
+    play(ds, 20, 5)
+    crash(ds, monkeypatch, store)
+
+    corrupt(os.path.join(tmp_path, f"snapshot-{seq:012d}.city"))
+    before = files(tmp_path)
+    with pytest.raises(RuntimeError, match="unreadable"):
+        start(ds, monkeypatch, tmp_path)
+    assert files(tmp_path) == before
@@ -0,0 +1,73 @@
+import numpy as np
+
+from demo_server import BUILDINGS, RESOURCE_NAMES
+
+
+def baseline_tick(city):
+    """One POST /api/game/tick of the original dict-based handler"""
+    ai_bonus = 1 + (city["ai_level"] * 0.1)
+    production = {resource: 0 for resource in RESOURCE_NAMES}
+    for building_type in city["buildings"]:
+        for resource, amount in BUILDINGS[building_type]["production"].items():
+            production[resource] += int(amount * ai_bonus)
+    for resource, amount in production.items():
+        city["resources"][resource] += amount
+    if city["resources"]["food"] > city["population"] * 2:
+        growth = int(city["population"] * 0.05 * ai_bonus)
+    else:
+        growth = int(city["population"] * 0.02)
+    city["population"] += growth
+    city["score"] += int(city["population"] / 100)
+    return production
+
+
+def as_dict(store, row):
+    """The baseline's representation of one row: a list of buildings and plain numbers"""
+    return {
+        "ai_level": float(store.ai_level[row]),
+        "buildings": [t for t, n in store.building_summary(row).items() for _ in range(n)],
+        "resources": store.resources_of(row),
+        "population": int(store.population[row]),
+        "score": int(store.score[row]),
+    }
+
+
+def assert_matches(store, rows, expected):
+    for row in rows:
+        city = expected[row]
+        assert store.resources_of(row) == city["resources"], row
+        assert int(store.population[row]) == city["population"], row
+        assert int(store.score[row]) == city["score"], row
+
+
+def test_tick_matches_the_per_city_rules(make_world):
+    store = make_world(300)
+    expected = [as_dict(store, row) for row in range(len(store))]
+    for _ in range(25):
+        production = store.tick()
+        for row, city in enumerate(expected):
+            assert dict(zip(RESOURCE_NAMES, production[row].tolist())) == baseline_tick(city)
+        assert_matches(store, range(len(store)), expected)
+
+
+def test_tick_rows_advances_only_the_given_rows(make_world):
+    store = make_world(300, seed=1)
+    expected = [as_dict(store, row) for row in range(len(store))]
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        rows = np.flatnonzero(rng.random(len(store)) < 0.4)
+        store.tick_rows(rows)
+        for row in rows.tolist():
+            baseline_tick(expected[row])
+        assert_matches(store, range(len(store)), expected)
+
+
+def test_tick_row_matches_the_vectorized_pass(make_world):
+    scalar, vectorized = make_world(200, seed=2), make_world(200, seed=2)
+    for _ in range(20):
+        for row in range(len(scalar)):
+            scalar.tick_row(row)
+        vectorized.tick()
+    assert np.array_equal(scalar.resources[:200], vectorized.resources[:200])
+    assert np.array_equal(scalar.population[:200], vectorized.population[:200])
+    assert np.array_equal(scalar.score[:200], vectorized.score[:200])